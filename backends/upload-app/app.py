@@ -1,13 +1,13 @@
-from flask import Flask, request, jsonify, make_response, send_file
+from flask import Flask, Request, request, g, jsonify, make_response, send_file, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 from dotenv import load_dotenv
-import openai
-from docx import Document
 import traceback
 import logging
 import tempfile
+import shutil
+import json
 
 # Configure logging
 logging.basicConfig(
@@ -19,49 +19,70 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Configure OpenAI for Azure
-openai.api_type = os.getenv("OPENAI_API_TYPE", "azure")
-openai.api_base = os.getenv("OPENAI_API_BASE")
-openai.api_version = os.getenv("OPENAI_API_VERSION", "2023-05-15")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
 logger.debug(f"App.py - .env file location: {os.path.abspath('.env')}")
-logger.debug(f"App.py - API type: {openai.api_type}")
-logger.debug(f"App.py - API base: {openai.api_base}")
+logger.debug(f"App.py - API base: {os.getenv('OPENAI_API_BASE')}")
 
-# Import the SOX testing functions
+# Import the SOX testing functions (cheap: pandas, openpyxl and the OpenAI client load on first use)
 from sox_processor import (
     generate_test_steps,
+    generate_test_steps_batch,
+    stream_test_steps,
+    BATCH_LAYOUTS,
     export_test_plan_to_word
 )
+from response_cache import get_response_cache
+from llm_client import get_client_state
+from telemetry import render_prometheus
+from profiling import start_profile, PROFILE_HEADER
+from job_queue import (
+    submit_job,
+    record_completed_job,
+    get_job,
+    job_to_dict,
+    resume_pending_jobs,
+    STATUS_COMPLETED,
+    JOBS_FOLDER
+)
+
+class SpooledUploadRequest(Request):
+    """Keep uploads in memory up to SPOOL_MAX_BYTES before spilling them to a temporary file."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
 
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
 
 # Updated CORS configuration to allow Next.js dev server
 CORS(app, resources={
     r"/*": {
         "origins": ["http://localhost:3000"],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "X-Requested-With", "Accept", "Origin", "Authorization"],
-        "expose_headers": ["Content-Type", "Content-Disposition"],
+        "allow_headers": ["Content-Type", "X-Requested-With", "Accept", "Origin", "Authorization", PROFILE_HEADER],
+        "expose_headers": ["Content-Type", "Content-Disposition", "X-Profile-File"],
         "supports_credentials": False,
         "max_age": 3600
     }
 })
 
 # Configuration
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+# Uploads and generated workbooks stay in memory up to this size, then spill to disk
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_MB", "16")) * 1024 * 1024
 
-# Create necessary directories
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32MB max file size
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def send_spooled_file(output, download_name, mimetype):
+    """Send a rewound in-memory (or spilled) file; it is closed once the response has been sent."""
+    size = output.seek(0, os.SEEK_END)
+    output.seek(0)
+    response = send_file(output, as_attachment=True, download_name=download_name, mimetype=mimetype)
+    response.content_length = size
+    return response
+
 @app.after_request
 def after_request(response):
     """Add CORS headers to all responses"""
@@ -74,6 +95,32 @@ def after_request(response):
         response.headers.add('Access-Control-Max-Age', '3600')
     return response
 
+@app.before_request
+def start_request_profile():
+    """Profile the request when PROFILE_REQUESTS_ENABLED is set and it carries an X-Profile header."""
+    if request.method != 'OPTIONS':
+        g.profile = start_profile(request.headers.get(PROFILE_HEADER), request.endpoint or 'request')
+
+@app.after_request
+def finish_request_profile(response):
+    """Write the profile once the response (including a streamed body) has been sent."""
+    profile = g.pop('profile', None)
+    if profile:
+        response.headers['X-Profile-File'] = os.path.basename(profile.path)
+        # File downloads bypass close callbacks and are complete by now; other bodies may still be streaming
+        if response.direct_passthrough:
+            profile.stop()
+        else:
+            response.call_on_close(profile.stop)
+    return response
+
+@app.teardown_request
+def stop_request_profile(error=None):
+    """Stop a profile left running by a request that failed before after_request."""
+    profile = g.pop('profile', None)
+    if profile:
+        profile.stop()
+
 @app.route('/generate-test-steps', methods=['POST', 'OPTIONS'])
 def generate_test_steps_endpoint():
     """Handle Excel file upload with SOX controls and generate test steps template."""
@@ -97,48 +144,170 @@ def generate_test_steps_endpoint():
     if not file or not allowed_file(file.filename):
         return jsonify({'error': 'Please upload an Excel file (.xlsx or .xls)'}), 400
 
+    # Long workbooks can be queued as a background job and polled via /jobs/<id>
+    run_async = request.args.get('async', request.form.get('async', '')).lower() in ('1', 'true', 'yes')
+    if run_async:
+        try:
+            job = submit_job(file, secure_filename(file.filename))
+            return jsonify(job), 202
+        except Exception as e:
+            logger.error(f"Error queueing test step job: {str(e)}")
+            return jsonify({'error': f"An error occurred while queueing the job: {str(e)}"}), 500
+
+    # Parse straight from the upload and build the template in memory (spilling to disk past SPOOL_MAX_BYTES)
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
     try:
-        # Save uploaded file temporarily
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
 
         # Process the Excel file to generate test steps
-        result = generate_test_steps([filepath])
+        generate_test_steps([file.stream], manifest_key=filename, filename=filename, output=output)
         
         # Return the Excel template as a download
-        if 'excelTemplatePath' in result:
-            return send_file(
-                result['excelTemplatePath'],
-                as_attachment=True,
-                download_name="SOX_Test_Steps_Template.xlsx",
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        else:
-            return jsonify({
-                'success': True,
-                'result': result
-            }), 200
+        return send_spooled_file(
+            output,
+            "SOX_Test_Steps_Template.xlsx",
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
 
     except Exception as e:
+        output.close()
         logger.error(f"Error generating test steps: {str(e)}")
         return jsonify({
             'error': f"An error occurred during processing: {str(e)}",
         }), 500
-    finally:
-        # Clean up uploaded file
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
-            logger.info(f"Cleaned up temporary file: {filepath}")
-        # Clean up generated template file
-        if 'result' in locals() and 'excelTemplatePath' in result:
-            template_path = result['excelTemplatePath']
-            if os.path.exists(template_path):
-                try:
-                    os.remove(template_path)
-                    logger.info(f"Cleaned up generated template: {template_path}")
-                except Exception as remove_err:
-                    logger.error(f"Error cleaning up template {template_path}: {remove_err}")
+
+@app.route('/generate-test-steps/batch', methods=['POST', 'OPTIONS'])
+def generate_test_steps_batch_endpoint():
+    """Generate one test steps template for every sheet of every uploaded Excel file."""
+    logger.info("Received request to /generate-test-steps/batch endpoint")
+
+    if request.method == 'OPTIONS':
+        logger.debug("Handling OPTIONS request")
+        return '', 204
+
+    files = [file for file in request.files.getlist('files') if file and file.filename]
+
+    if not files:
+        logger.error("No files uploaded")
+        return jsonify({'error': "No Excel file uploaded"}), 400
+
+    if not all(allowed_file(file.filename) for file in files):
+        return jsonify({'error': 'Please upload only Excel files (.xlsx or .xls)'}), 400
+
+    # 'combined' puts every row on one sheet with a Source Sheet column, 'sheets' keeps one sheet per source sheet
+    layout = request.args.get('layout', request.form.get('layout', 'combined')).lower()
+    if layout not in BATCH_LAYOUTS:
+        return jsonify({'error': f"Unknown layout '{layout}', expected one of {', '.join(BATCH_LAYOUTS)}"}), 400
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        uploads = [(file.stream, secure_filename(file.filename)) for file in files]
+        manifest_key = ' + '.join(sorted(filename for _, filename in uploads))
+
+        generate_test_steps_batch(uploads, layout, manifest_key=manifest_key, output=output)
+
+        return send_spooled_file(
+            output,
+            "SOX_Test_Steps_Template.xlsx",
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+    except Exception as e:
+        output.close()
+        logger.error(f"Error generating batch test steps: {str(e)}")
+        return jsonify({
+            'error': f"An error occurred during processing: {str(e)}",
+        }), 500
+
+def format_sse(event: dict) -> str:
+    """Serialize an event dict as a Server-Sent Events message."""
+    payload = {key: value for key, value in event.items() if key != 'event'}
+    return f"event: {event['event']}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/generate-test-steps/stream', methods=['POST', 'OPTIONS'])
+def generate_test_steps_stream_endpoint():
+    """Stream each control's generated test steps as Server-Sent Events, then a download link."""
+    logger.info("Received request to /generate-test-steps/stream endpoint")
+
+    if request.method == 'OPTIONS':
+        logger.debug("Handling OPTIONS request")
+        return '', 204
+
+    files = request.files.getlist('files')
+
+    if not files or len(files) == 0:
+        logger.error("No files uploaded")
+        return jsonify({'error': "No Excel file uploaded"}), 400
+
+    file = files[0]
+
+    if not file or not allowed_file(file.filename):
+        return jsonify({'error': 'Please upload an Excel file (.xlsx or .xls)'}), 400
+
+    # The request's files are closed once streaming starts, so copy the upload into a spooled file we own
+    filename = secure_filename(file.filename)
+    upload = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    shutil.copyfileobj(file.stream, upload)
+    upload.seek(0)
+
+    def event_stream():
+        try:
+            for event in stream_test_steps(upload, manifest_key=filename, filename=filename):
+                if event['event'] == 'complete':
+                    job = record_completed_job(
+                        filename, event.pop('excelTemplatePath'), event['controlsProcessed'], event.get('usage')
+                    )
+                    event['jobId'] = job['jobId']
+                    event['downloadUrl'] = f"/jobs/{job['jobId']}/result"
+                yield format_sse(event)
+
+        except Exception as e:
+            logger.error(f"Error streaming test steps: {str(e)}")
+            yield format_sse({'event': 'error', 'error': f"An error occurred during processing: {str(e)}"})
+
+        finally:
+            upload.close()
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_endpoint(job_id):
+    """Return status and progress (controls done/total) of a background job."""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': f"Job {job_id} not found"}), 404
+
+    status = job_to_dict(job)
+    if job['status'] == STATUS_COMPLETED:
+        status['resultUrl'] = f"/jobs/{job_id}/result"
+    return jsonify(status), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result_endpoint(job_id):
+    """Download the Excel template produced by a completed background job."""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': f"Job {job_id} not found"}), 404
+
+    if job['status'] != STATUS_COMPLETED:
+        return jsonify({
+            'error': f"Job {job_id} is not completed",
+            'status': job['status']
+        }), 409
+
+    if not job['result_path'] or not os.path.exists(job['result_path']):
+        return jsonify({'error': f"Result for job {job_id} is no longer available"}), 410
+
+    return send_file(
+        os.path.abspath(job['result_path']),
+        as_attachment=True,
+        download_name="SOX_Test_Steps_Template.xlsx",
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
 
 @app.route('/export-test-plan', methods=['POST', 'OPTIONS'])
 def export_test_plan_endpoint():
@@ -149,35 +318,27 @@ def export_test_plan_endpoint():
         logger.debug("Handling OPTIONS request")
         return '', 204
 
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
     try:
         data = request.get_json()
         if not data:
+            output.close()
             return jsonify({'error': 'No data provided'}), 400
 
         # Generate Word document from test plan data
-        doc_path = export_test_plan_to_word(data)
+        document = export_test_plan_to_word(data, output)
+        download_name = f"{data.get('controlName', 'TestPlan').replace(' ', '_')}.docx"
+        mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
         
         # Send the generated Word document
-        return send_file(
-            doc_path,
-            as_attachment=True,
-            download_name=f"{data.get('controlName', 'TestPlan').replace(' ', '_')}.docx",
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
+        return send_spooled_file(document, download_name, mimetype)
 
     except Exception as e:
+        output.close()
         logger.error(f"Error exporting test plan: {str(e)}")
         return jsonify({
             'error': f"An error occurred during export: {str(e)}",
         }), 500
-    finally:
-        # Clean up generated file
-        if 'doc_path' in locals() and os.path.exists(doc_path):
-            try:
-                os.remove(doc_path)
-                logger.info(f"Cleaned up generated document: {doc_path}")
-            except Exception as remove_err:
-                logger.error(f"Error cleaning up generated file {doc_path}: {remove_err}")
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -185,28 +346,37 @@ def health_check():
     logger.info("Health check requested")
     status = {
         'status': 'healthy',
-        'upload_folder_exists': os.path.exists(UPLOAD_FOLDER),
-        'openai_key_configured': bool(openai.api_key)
+        'jobs_folder_exists': os.path.exists(JOBS_FOLDER),
+        'spool_folder': tempfile.gettempdir(),
+        'openai_key_configured': bool(os.getenv("OPENAI_API_KEY"))
     }
+    cache = get_response_cache()
+    if cache:
+        status['response_cache'] = cache.stats()
+    status['openai_client'] = get_client_state()
     logger.debug(f"Health status: {status}")
     return jsonify(status), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Azure OpenAI usage, latency and retry metrics in Prometheus text format."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 # Startup checks
 def run_startup_checks():
     """Perform startup checks and log results"""
     logger.info("Running startup checks...")
 
-    if not os.path.exists(UPLOAD_FOLDER):
-        logger.info(f"Creating upload folder at {os.path.abspath(UPLOAD_FOLDER)}")
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-    if not openai.api_key:
+    if not os.getenv("OPENAI_API_KEY"):
         logger.warning("OpenAI API key not configured")
     else:
         logger.info("OpenAI API key configured")
 
 if __name__ == '__main__':
     run_startup_checks()
+    # The debug reloader's parent process only watches files; resume jobs in the serving child
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        resume_pending_jobs()
     logger.info("Starting Flask server...")
     # Enable debug mode for detailed error messages during development
     app.run(debug=True, port=3002, host='localhost')
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""Check that importing the backend stays within a startup-time budget.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter (best of --runs) and
+fails if the cumulative import time exceeds the budget, or if a heavy dependency that
+should only load on first use (pandas, openpyxl, python-docx, openai, numpy) was imported:
+
+    python benchmarks/check_import_time.py --budget-ms 600
+
+Exits non-zero on failure, so it can gate CI alongside the load test.
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "600"))
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'docx', 'openai')
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def measure_import(module: str) -> Tuple[int, Dict[str, int]]:
+    """Import module in a fresh interpreter; returns (cumulative microseconds, {top-level package: microseconds})."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=APP_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+
+    total = 0
+    packages: Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # Top-level entries (one space of indent) are direct imports of the -c statement
+        if indent == 1:
+            if name == module:
+                total = cumulative
+        top_level = name.split('.')[0]
+        packages[top_level] = max(packages.get(top_level, 0), cumulative)
+    return total, packages
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--module', default='app', help="Module to import")
+    parser.add_argument('--budget-ms', type=int, default=DEFAULT_BUDGET_MS, help="Maximum cumulative import time")
+    parser.add_argument('--runs', type=int, default=3, help="Imports to run; the fastest is compared to the budget")
+    args = parser.parse_args()
+
+    measurements = [measure_import(args.module) for _ in range(max(1, args.runs))]
+    total, packages = min(measurements, key=lambda measurement: measurement[0])
+    total_ms = total / 1000
+
+    failures: List[str] = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import {args.module} took {total_ms:.0f}ms, budget is {args.budget_ms}ms")
+    for module in LAZY_MODULES:
+        if module in packages:
+            failures.append(f"{module} is imported at startup ({packages[module] / 1000:.0f}ms); import it on first use")
+
+    slowest = sorted((item for item in packages.items() if item[0] != args.module), key=lambda item: item[1], reverse=True)[:8]
+    print(f"import {args.module}: {total_ms:.0f}ms (budget {args.budget_ms}ms)")
+    for name, microseconds in slowest:
+        print(f"  {name:<24} {microseconds / 1000:>7.1f}ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""Local stand-in for the Azure OpenAI chat completions API, for benchmarks without credentials.
+
+Answers every POST to .../chat/completions after a configurable latency (plus jitter),
+fails a configurable fraction of requests with 429/503 responses, and counts requests and
+tokens so benchmarks can report them:
+
+    python benchmarks/fake_azure.py --port 8765 --latency 0.5 --jitter 0.2 --error-rate 0.02
+    OPENAI_API_BASE=http://127.0.0.1:8765 OPENAI_API_KEY=fake python app.py
+
+Responses follow the request's response_format: test_steps and batch_test_steps schemas get
+test steps for the Control IDs found in the prompt, plain requests get a short text answer.
+--canned takes a JSON file mapping a schema name (or "text") to a fixed response content.
+GET /stats returns the counters; POST /stats resets them.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+
+CONTROL_ID_PATTERN = re.compile(r"^Control ID: (.+)$", re.MULTILINE)
+
+# Rough token estimate used for the usage block (the API counts about 4 characters per token)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def fake_test_steps(control_id: str) -> List[Dict]:
+    return [
+        {
+            'control_id': control_id,
+            'name': 'Inspect Control Design',
+            'description': f"Inspected the design of control {control_id} against the documented procedure.",
+            'attribute_name': 'Design Inspected',
+            'attribute_description': 'The control design was inspected and found appropriate.'
+        },
+        {
+            'control_id': control_id,
+            'name': 'Inspect Control Operation',
+            'description': f"Selected a sample and re-performed control {control_id}.",
+            'attribute_name': 'Operation Verified',
+            'attribute_description': 'The control operated as designed for the selected sample.'
+        }
+    ]
+
+
+def fake_content(messages: List[Dict], response_format: Optional[Dict], canned: Dict[str, str]) -> str:
+    """Build the response content a real deployment would return for this request."""
+    user_prompt = messages[-1].get('content', '') if messages else ''
+    schema_name = 'text'
+    if response_format:
+        schema_name = response_format.get('json_schema', {}).get('name', response_format.get('type', 'text'))
+
+    if schema_name in canned:
+        return canned[schema_name]
+
+    control_ids = [control_id.strip() for control_id in CONTROL_ID_PATTERN.findall(user_prompt)] or ['UNKNOWN']
+    if schema_name == 'batch_test_steps':
+        return json.dumps({
+            'controls': [{'control_id': control_id, 'test_steps': fake_test_steps(control_id)} for control_id in control_ids]
+        })
+    if schema_name in ('test_steps', 'json_object'):
+        return json.dumps({'test_steps': fake_test_steps(control_ids[0])})
+    return (
+        "1. The process owner reviews the request and approves it in the system.\n"
+        "2. The administrator applies the change and retains the approval as evidence.\n"
+        "3. Management reviews the changes made during the period on a quarterly basis."
+    )
+
+
+class FakeAzureOpenAI:
+    """Threaded fake chat completions server; use as a context manager or call start()/stop()."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.2, jitter: float = 0.0,
+                 error_rate: float = 0.0, canned: Optional[Dict[str, str]] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.canned = canned or {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = self._empty_counters()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _empty_counters() -> Dict[str, int]:
+        return {'requests': 0, 'errors': 0, 'promptTokens': 0, 'completionTokens': 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = self._empty_counters()
+
+    def start(self) -> 'FakeAzureOpenAI':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-azure', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def __enter__(self) -> 'FakeAzureOpenAI':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _should_fail(self) -> Optional[int]:
+        with self._lock:
+            draw = self._random.random()
+        if draw >= self.error_rate:
+            return None
+        # Mostly throttling, sometimes an unavailable backend, like a busy deployment
+        return 429 if draw < self.error_rate * 0.7 else 503
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/stats':
+                    return self.send_json(404, {'error': {'code': '404', 'message': 'Not found'}})
+                self.send_json(200, fake.stats())
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                path = self.path.split('?')[0]
+                if path == '/stats':
+                    fake.reset()
+                    return self.send_json(200, fake.stats())
+                if not path.endswith('/chat/completions'):
+                    return self.send_json(404, {'error': {'code': '404', 'message': 'Not found'}})
+
+                time.sleep(fake._delay())
+                status = fake._should_fail()
+                if status:
+                    with fake._lock:
+                        fake._counters['requests'] += 1
+                        fake._counters['errors'] += 1
+                    return self.send_json(
+                        status, {'error': {'code': str(status), 'message': 'Injected failure'}}, {'Retry-After': '0.1'}
+                    )
+
+                messages = request.get('messages', [])
+                content = fake_content(messages, request.get('response_format'), fake.canned)
+                prompt_tokens = sum(estimate_tokens(str(message.get('content', ''))) for message in messages)
+                completion_tokens = estimate_tokens(content)
+                with fake._lock:
+                    fake._counters['requests'] += 1
+                    fake._counters['promptTokens'] += prompt_tokens
+                    fake._counters['completionTokens'] += completion_tokens
+
+                self.send_json(200, {
+                    'id': f"chatcmpl-fake-{time.monotonic_ns()}",
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': request.get('model', 'fake'),
+                    'choices': [{
+                        'index': 0,
+                        'finish_reason': 'stop',
+                        'message': {'role': 'assistant', 'content': content}
+                    }],
+                    'usage': {
+                        'prompt_tokens': prompt_tokens,
+                        'completion_tokens': completion_tokens,
+                        'total_tokens': prompt_tokens + completion_tokens,
+                        'prompt_tokens_details': {'cached_tokens': 0}
+                    }
+                })
+
+        return Handler
+
+
+def load_canned(path: Optional[str]) -> Dict[str, str]:
+    """Read {schema name or "text": content}; non-string contents are serialized as JSON."""
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        canned = json.load(f)
+    return {name: content if isinstance(content, str) else json.dumps(content) for name, content in canned.items()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds before each response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Latency varies uniformly by +/- this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 429/503")
+    parser.add_argument('--canned', help="JSON file of fixed response contents by schema name")
+    parser.add_argument('--seed', type=int, help="Seed for jitter and error injection")
+    args = parser.parse_args()
+
+    fake = FakeAzureOpenAI(args.host, args.port, args.latency, args.jitter, args.error_rate, load_canned(args.canned), args.seed)
+    print(f"Fake Azure OpenAI listening on {fake.url}")
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
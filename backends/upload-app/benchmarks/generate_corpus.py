@@ -0,0 +1,79 @@
+"""Generate a seeded corpus of synthetic RCM workbooks and walkthrough transcripts.
+
+Writes rcm_<controls>.xlsx and transcript_<words>w.txt files plus a corpus.json describing
+them into the output directory. The same seed and options always produce the same files:
+
+    python benchmarks/generate_corpus.py corpus --rcm-sizes 100,1000,10000 --na-ratio 0.15 --duplicate-ratio 0.3
+    python benchmarks/generate_corpus.py corpus --rcm-sizes 0 --transcript-words 5000,50000 --seed 7
+
+The workbooks feed benchmarks/load_test.py (pass the directory to upload all of them) and
+benchmarks/run_benchmarks.py generates its inputs the same way.
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from synthetic import write_rcm, make_transcript
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(size) for size in value.split(',') if size.strip() and int(size) > 0]
+
+
+def generate_corpus(output_dir: str, rcm_sizes: List[int], transcript_words: List[int], seed: int = 0,
+                    na_ratio: float = 0.0, duplicate_ratio: float = 0.0) -> Dict:
+    """Write the corpus files and return the corpus.json description."""
+    os.makedirs(output_dir, exist_ok=True)
+    corpus = {
+        'seed': seed,
+        'naRatio': na_ratio,
+        'duplicateRatio': duplicate_ratio,
+        'rcms': [],
+        'transcripts': []
+    }
+
+    for size in rcm_sizes:
+        filename = f"rcm_{size}.xlsx"
+        write_rcm(os.path.join(output_dir, filename), size, seed, na_ratio, duplicate_ratio)
+        corpus['rcms'].append({'file': filename, 'controls': size})
+
+    for words in transcript_words:
+        filename = f"transcript_{words}w.txt"
+        transcript = make_transcript(words, seed)
+        with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
+            f.write(transcript)
+        corpus['transcripts'].append({'file': filename, 'words': len(transcript.split())})
+
+    with open(os.path.join(output_dir, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, indent=2)
+    return corpus
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('output_dir', help="Directory to write the corpus into")
+    parser.add_argument('--rcm-sizes', default='10,100,1000', help="Comma-separated control counts (0 for none)")
+    parser.add_argument('--transcript-words', default='2000,20000', help="Comma-separated transcript lengths (0 for none)")
+    parser.add_argument('--na-ratio', type=float, default=0.1, help="Share of controls with N/A attributes")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2, help="Share of controls repeating an earlier one for another entity")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = generate_corpus(
+        args.output_dir, parse_sizes(args.rcm_sizes), parse_sizes(args.transcript_words),
+        args.seed, args.na_ratio, args.duplicate_ratio
+    )
+    for entry in corpus['rcms'] + corpus['transcripts']:
+        print(os.path.join(args.output_dir, entry['file']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Concurrent upload load test for the backend.
+
+Uploads workbooks many times in parallel and reports latency percentiles and throughput,
+e.g. to compare `python app.py` with `gunicorn -c gunicorn.conf.py wsgi:app`:
+
+    python benchmarks/load_test.py controls.xlsx --concurrency 16 --requests 64
+    python benchmarks/load_test.py controls.xlsx --mode async --url http://host:3002
+    python benchmarks/load_test.py corpus/ --concurrency 32 --duration 300
+
+Directories are expanded to the workbooks they contain (e.g. a corpus written by
+benchmarks/generate_corpus.py) and uploads cycle through them. With --duration, each of
+the --concurrency virtual users uploads back to back until the time is up instead of
+sending a fixed number of --requests.
+
+Modes: sync posts to /generate-test-steps and waits for the template; async queues a job
+and polls /jobs/<id> until it finishes; stream reads /generate-test-steps/stream to the end.
+Only the standard library is used, so it runs from any machine that can reach the server.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import itertools
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def build_multipart(filename: str, content: bytes) -> Tuple[bytes, str]:
+    """Encode a single `files` upload as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'.encode(),
+        f'Content-Type: {XLSX_MIMETYPE}\r\n\r\n'.encode(),
+        content,
+        f'\r\n--{boundary}--\r\n'.encode()
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def post_upload(url: str, filename: str, content: bytes, timeout: float):
+    body, content_type = build_multipart(filename, content)
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def run_sync(base_url: str, filename: str, content: bytes, timeout: float) -> int:
+    with post_upload(f"{base_url}/generate-test-steps", filename, content, timeout) as response:
+        return len(response.read())
+
+
+def run_async(base_url: str, filename: str, content: bytes, timeout: float) -> int:
+    with post_upload(f"{base_url}/generate-test-steps?async=true", filename, content, timeout) as response:
+        job = json.load(response)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with urllib.request.urlopen(f"{base_url}/jobs/{job['jobId']}", timeout=timeout) as response:
+            job = json.load(response)
+        if job['status'] == 'completed':
+            return job['progress']['total']
+        if job['status'] == 'failed':
+            raise RuntimeError(f"job {job['jobId']} failed: {job['error']}")
+        time.sleep(0.5)
+    raise TimeoutError(f"job {job['jobId']} did not finish within {timeout}s")
+
+
+def run_stream(base_url: str, filename: str, content: bytes, timeout: float) -> int:
+    events = 0
+    with post_upload(f"{base_url}/generate-test-steps/stream", filename, content, timeout) as response:
+        for line in response:
+            if line.startswith(b'event: error'):
+                raise RuntimeError("stream reported an error")
+            if line.startswith(b'event: '):
+                events += 1
+    return events
+
+
+MODES = {'sync': run_sync, 'async': run_async, 'stream': run_stream}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def collect_workbooks(paths: List[str]) -> List[str]:
+    """Expand directories to the Excel workbooks they contain, in name order."""
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            workbooks.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(('.xlsx', '.xls'))
+            )
+        else:
+            workbooks.append(path)
+    if not workbooks:
+        raise ValueError(f"No Excel workbooks found in {', '.join(paths)}")
+    return workbooks
+
+
+def run_load_test(base_url: str, workbooks: List[str], mode: str, concurrency: int, requests: int, timeout: float,
+                  duration: Optional[float] = None) -> Dict:
+    uploads = []
+    for workbook in workbooks:
+        with open(workbook, 'rb') as f:
+            uploads.append((os.path.basename(workbook), f.read()))
+    run = MODES[mode]
+
+    def timed_request(i: int) -> float:
+        filename, content = uploads[i % len(uploads)]
+        started = time.monotonic()
+        # Distinct filenames keep incremental re-generation from reusing earlier uploads
+        run(base_url, f"load_{i}_{filename}", content, timeout)
+        return time.monotonic() - started
+
+    latencies, errors = [], []
+    started = time.monotonic()
+    if duration:
+        deadline = started + duration
+        counter = itertools.count()
+
+        def virtual_user() -> None:
+            while time.monotonic() < deadline:
+                try:
+                    latencies.append(timed_request(next(counter)))
+                except Exception as e:
+                    errors.append(str(e))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(virtual_user)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(timed_request, i) for i in range(requests)]
+            for future in as_completed(futures):
+                try:
+                    latencies.append(future.result())
+                except Exception as e:
+                    errors.append(str(e))
+    wall = time.monotonic() - started
+
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'workbooks': len(uploads),
+        'requests': len(latencies) + len(errors),
+        'succeeded': len(latencies),
+        'failed': len(errors),
+        'wallSeconds': round(wall, 3),
+        'requestsPerSecond': round(len(latencies) / wall, 3) if wall else 0,
+        'latencySeconds': {
+            'p50': round(percentile(latencies, 0.5), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'max': round(max(latencies), 3),
+            'mean': round(statistics.mean(latencies), 3)
+        } if latencies else None,
+        'errors': sorted(set(errors))[:5]
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('workbooks', nargs='+', help="RCM workbooks (.xlsx) or directories of them to upload")
+    parser.add_argument('--url', default='http://localhost:3002', help="Backend base URL")
+    parser.add_argument('--mode', choices=sorted(MODES), default='sync')
+    parser.add_argument('--concurrency', type=int, default=8, help="Uploads in flight at once")
+    parser.add_argument('--requests', type=int, default=32, help="Total uploads")
+    parser.add_argument('--duration', type=float, help="Upload continuously for this many seconds instead of --requests")
+    parser.add_argument('--timeout', type=float, default=900, help="Per-upload timeout in seconds")
+    args = parser.parse_args()
+
+    result = run_load_test(
+        args.url.rstrip('/'), collect_workbooks(args.workbooks), args.mode, args.concurrency, args.requests,
+        args.timeout, args.duration
+    )
+    print(json.dumps(result, indent=2))
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Throughput benchmarks for test step generation and transcript processing, against a local fake API.
+
+Starts benchmarks/fake_azure.py in-process, generates synthetic RCMs and transcripts, and
+runs every case in a fresh interpreter so its peak RSS is its own (and the parse stage
+includes loading pandas/openpyxl, as the first upload to a worker does). Reports wall
+time, API calls (including injected failures), tokens and peak RSS for each stage:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --rcm-sizes 10,100,1000,10000 --latency 0.5 --jitter 0.2 --error-rate 0.02
+    python benchmarks/run_benchmarks.py --rcm-sizes 1000 --transcript-words 0 --output results.json
+
+No Azure credentials are needed. The response cache and control manifest are disabled so
+every run makes the same calls; other settings (SOX_MAX_CONCURRENT_REQUESTS, SOX_BATCH_SIZE,
+TRANSCRIPT_QUESTION_WORKERS, ...) are read from the environment as usual.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, APP_DIR)
+
+from fake_azure import FakeAzureOpenAI, load_canned
+from synthetic import write_rcm, make_transcript
+
+DEFAULT_RCM_SIZES = '10,100,1000,10000'
+DEFAULT_TRANSCRIPT_WORDS = '2000,20000,100000'
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where the resource module is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def fake_stats(fake_url: str) -> Dict[str, int]:
+    with urllib.request.urlopen(f"{fake_url}/stats", timeout=10) as response:
+        return json.load(response)
+
+
+@contextmanager
+def stage(results: List[Dict], name: str, fake_url: str) -> Iterator[Dict]:
+    """Measure one stage of a case; the block may add fields to the yielded dict."""
+    before = fake_stats(fake_url)
+    extra: Dict = {}
+    started = time.perf_counter()
+    yield extra
+    wall = time.perf_counter() - started
+    after = fake_stats(fake_url)
+    results.append({
+        'stage': name,
+        'wallSeconds': round(wall, 3),
+        'calls': after['requests'] - before['requests'],
+        'failedCalls': after['errors'] - before['errors'],
+        'promptTokens': after['promptTokens'] - before['promptTokens'],
+        'completionTokens': after['completionTokens'] - before['completionTokens'],
+        'peakRssMb': peak_rss_mb(),
+        **extra
+    })
+
+
+def run_rcm_case(path: str, fake_url: str) -> List[Dict]:
+    import io
+    from sox_processor import parse_sox_controls_excel, generate_test_steps
+
+    results: List[Dict] = []
+    with stage(results, 'parse', fake_url) as extra:
+        extra['controls'] = len(parse_sox_controls_excel(path))
+    with stage(results, 'generate', fake_url) as extra:
+        output = io.BytesIO()
+        result = generate_test_steps([path], output=output)
+        extra['controls'] = result['controlsProcessed']
+        extra['templateBytes'] = len(output.getvalue())
+    return results
+
+
+def run_transcript_case(path: str, fake_url: str) -> List[Dict]:
+    from config import AGENDA
+    from transcript_processor import generate_process_flow_doc
+
+    with open(path, 'r', encoding='utf-8') as f:
+        transcript = f.read()
+
+    # System overview questions get short answers, the rest process narratives, as in the UI
+    questions = [
+        (question, 'Normal Response' if section_number == 0 else 'Detailed Process Response')
+        for section_number, section_questions in enumerate(AGENDA.values())
+        for question in section_questions
+    ]
+
+    results: List[Dict] = []
+    with stage(results, 'process-flow', fake_url) as extra:
+        document_path = generate_process_flow_doc(transcript, 'Benchmark Walkthrough', questions)
+        extra['questions'] = len(questions)
+        os.remove(document_path)
+    return results
+
+
+CASE_RUNNERS = {'rcm': run_rcm_case, 'transcript': run_transcript_case}
+
+
+def run_case(kind: str, path: str, fake_url: str, workdir: str) -> List[Dict]:
+    """Run one case in a fresh interpreter pointed at the fake server."""
+    result_path = os.path.join(workdir, 'case_result.json')
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='benchmark',
+        OPENAI_API_BASE=fake_url,
+        OPENAI_CACHE_ENABLED='false',
+        SOX_MANIFEST_ENABLED='false'
+    )
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', kind, path, '--fake-url', fake_url, '--result', result_path],
+        cwd=APP_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{kind} case {os.path.basename(path)} failed:\n{completed.stderr[-2000:]}")
+    with open(result_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(size) for size in value.split(',') if size.strip() and int(size) > 0]
+
+
+def print_table(rows: List[Dict]) -> None:
+    columns = ['case', 'stage', 'wallSeconds', 'calls', 'failedCalls', 'promptTokens', 'completionTokens', 'peakRssMb']
+    widths = {column: max(len(column), *(len(str(row.get(column))) for row in rows)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print('  '.join(str(row.get(column)).ljust(widths[column]) for column in columns))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rcm-sizes', default=DEFAULT_RCM_SIZES, help="Comma-separated control counts")
+    parser.add_argument('--transcript-words', default=DEFAULT_TRANSCRIPT_WORDS, help="Comma-separated transcript lengths")
+    parser.add_argument('--latency', type=float, default=0.2, help="Fake API latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Fake API latency jitter in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of fake API calls failing with 429/503")
+    parser.add_argument('--canned', help="JSON file of fixed response contents by schema name (see fake_azure.py)")
+    parser.add_argument('--na-ratio', type=float, default=0.0, help="Share of synthetic controls with N/A attributes")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0, help="Share of synthetic controls repeating an earlier one")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for synthetic inputs and the fake API")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    parser.add_argument('--case', nargs=2, metavar=('KIND', 'PATH'), help=argparse.SUPPRESS)
+    parser.add_argument('--fake-url', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: run a single case and hand the measurements back through a file
+    if args.case:
+        kind, path = args.case
+        results = CASE_RUNNERS[kind](path, args.fake_url)
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(results, f)
+        return 0
+
+    rows: List[Dict] = []
+    with tempfile.TemporaryDirectory(prefix='sox-benchmark-') as workdir, \
+            FakeAzureOpenAI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            canned=load_canned(args.canned), seed=args.seed) as fake:
+        cases = []
+        for size in parse_sizes(args.rcm_sizes):
+            path = os.path.join(workdir, f"rcm_{size}.xlsx")
+            write_rcm(path, size, args.seed, args.na_ratio, args.duplicate_ratio)
+            cases.append(('rcm', f"rcm-{size}", path))
+        for words in parse_sizes(args.transcript_words):
+            path = os.path.join(workdir, f"transcript_{words}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(make_transcript(words, args.seed))
+            cases.append(('transcript', f"transcript-{words}w", path))
+
+        for kind, name, path in cases:
+            print(f"Running {name}...", file=sys.stderr)
+            for result in run_case(kind, path, fake.url, workdir):
+                rows.append({'case': name, **result})
+
+    print_table(rows)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'settings': {
+                    'latency': args.latency,
+                    'jitter': args.jitter,
+                    'errorRate': args.error_rate,
+                    'seed': args.seed,
+                    'naRatio': args.na_ratio,
+                    'duplicateRatio': args.duplicate_ratio
+                },
+                'results': rows
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Synthetic RCM workbooks and walkthrough transcripts for benchmarks and load tests.
+
+RCMs use the five-column layout read by parse_sox_controls_excel, with lettered A)/B)/C)
+testing attributes, a share of N/A rows (testing, design and evidence left N/A) and a share
+of near-duplicate rows that repeat an earlier control for another entity, as multi-entity
+RCMs do. Transcripts walk through every config.AGENDA question. Output is deterministic for
+a given seed, so benchmark runs stay comparable.
+"""
+
+import random
+from typing import Iterator, List, Optional
+
+CONTROL_HEADERS = ['Ref ID', 'Control Description', 'Testing Attributes', 'Design Attributes', 'Evidence of Control']
+
+PROCESSES = ['Revenue', 'Procure to Pay', 'Payroll', 'Financial Close', 'Treasury', 'Fixed Assets', 'Inventory', 'IT General Controls']
+ROLES = ['Controller', 'AP Manager', 'Payroll Supervisor', 'Treasury Analyst', 'IT Administrator', 'Revenue Accountant']
+ACTIONS = ['reviews and approves', 'reconciles', 'compares', 'investigates variances in', 'signs off on']
+OBJECTS = ['journal entries', 'vendor master changes', 'payroll registers', 'bank reconciliations', 'user access listings', 'revenue cut-off reports']
+FREQUENCIES = ['daily', 'weekly', 'monthly', 'quarterly']
+SYSTEMS = ['SAP', 'Oracle EBS', 'Workday', 'NetSuite', 'BlackLine']
+ENTITIES = ['Northwind US Inc.', 'Northwind UK Ltd', 'Northwind GmbH', 'Northwind Canada Corp.', 'Northwind Japan KK', 'Northwind Brasil Ltda']
+NA_MARKERS = ['N/A', 'NA', '']
+
+ATTRIBUTE_TEMPLATES = [
+    "{role} performed the review on a {frequency} basis",
+    "Items above ${threshold:,} were investigated and resolved",
+    "Evidence of review was retained in {system}",
+    "Review was performed by someone independent of the preparer",
+    "Exceptions were escalated to the Controller",
+    "The {obj} report used was complete and accurate"
+]
+
+ANSWER_SENTENCES = [
+    "We use {system} for that, and the {role} team owns it day to day.",
+    "Requests come in through a ServiceNow ticket and a second person approves them before anything changes.",
+    "The approval stays attached to the ticket, so we can pull it for any sample you select.",
+    "Only the {role} team has that access in {system}; everyone else is read-only.",
+    "Once a quarter the {role} reviews the listing and signs it off, and exceptions get a follow-up ticket.",
+    "If something fails overnight we get an email alert and the on-call administrator reruns it the next morning.",
+    "The vendor pushes patches monthly, and we test them in the sandbox before they reach production.",
+    "We keep the evidence on the shared drive by period, with the reviewer's sign-off on each checklist.",
+    "Honestly that part is still manual, so the {role} keeps a spreadsheet tracker alongside {system}.",
+    "Terminations come from HR in Workday and access is removed in {system} within one business day."
+]
+
+
+def lettered(items: List[str]) -> str:
+    return '\n'.join(f"{chr(ord('A') + position)}) {item}" for position, item in enumerate(items))
+
+
+def control_row(rng: random.Random, number: int, entity: str, na: bool = False) -> List[str]:
+    """One RCM row; the control number appears in the text so distinct rows never count as duplicates."""
+    process, role, action, obj = rng.choice(PROCESSES), rng.choice(ROLES), rng.choice(ACTIONS), rng.choice(OBJECTS)
+    fields = {'role': role, 'obj': obj, 'frequency': rng.choice(FREQUENCIES), 'system': rng.choice(SYSTEMS),
+              'threshold': rng.randrange(5, 500) * 1000}
+    description = (
+        f"On a {fields['frequency']} basis, the {role} of {entity} {action} {obj} in {fields['system']} "
+        f"above ${fields['threshold']:,} and documents the review in checklist {number}."
+    )
+    ref_id = f"{process[:3].upper()}-{number:05d}"
+    if na:
+        return [ref_id, description, rng.choice(NA_MARKERS), rng.choice(NA_MARKERS), rng.choice(NA_MARKERS)]
+
+    attributes = rng.sample(ATTRIBUTE_TEMPLATES, rng.randint(2, 5))
+    return [
+        ref_id,
+        description,
+        lettered([template.format(**fields) for template in attributes]),
+        f"The review covers all {obj} recorded in {fields['system']} for {entity} each period.",
+        f"Signed {obj} review checklist {number} with supporting {fields['system']} report"
+    ]
+
+
+def duplicate_row(row: List[str], number: int, entity: str) -> List[str]:
+    """Repeat a control for another entity: same wording and amounts, new Ref ID and entity name."""
+    original_entity = next((name for name in ENTITIES if name in row[1]), None)
+    fields = [field.replace(original_entity, entity) if original_entity else field for field in row[1:]]
+    return [f"{row[0].split('-')[0]}-{number:05d}"] + fields
+
+
+def rcm_rows(controls: int, seed: int = 0, na_ratio: float = 0.0, duplicate_ratio: float = 0.0) -> Iterator[List[str]]:
+    """Yield RCM rows; about na_ratio of new controls are N/A and duplicate_ratio of rows repeat an earlier one."""
+    rng = random.Random(seed)
+    originals: List[List[str]] = []
+    for number in range(1, controls + 1):
+        if originals and rng.random() < duplicate_ratio:
+            row = duplicate_row(rng.choice(originals), number, rng.choice(ENTITIES))
+        else:
+            row = control_row(rng, number, rng.choice(ENTITIES), na=rng.random() < na_ratio)
+            originals.append(row)
+        yield row
+
+
+def write_rcm(path: str, controls: int, seed: int = 0, na_ratio: float = 0.0, duplicate_ratio: float = 0.0) -> str:
+    """Write an RCM workbook with the given number of controls (write-only, so 10k+ rows stay cheap)."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Controls')
+    ws.append(CONTROL_HEADERS)
+    for row in rcm_rows(controls, seed, na_ratio, duplicate_ratio):
+        ws.append(row)
+    wb.save(path)
+    return path
+
+
+def make_transcript(words: int, seed: int = 0, agenda: Optional[dict] = None) -> str:
+    """A timestamped walkthrough transcript of roughly the given number of words.
+
+    The auditor asks every agenda question in order (config.AGENDA by default) and the
+    client's answers are padded evenly so the whole transcript reaches the requested length.
+    """
+    if agenda is None:
+        from config import AGENDA as agenda
+
+    rng = random.Random(seed)
+    questions = [(section, question) for section, section_questions in agenda.items() for question in section_questions]
+    question_words = sum(len(question.split()) + 2 for _, question in questions)
+    words_per_answer = max(20, (words - question_words) // max(1, len(questions)))
+    system, role = rng.choice(SYSTEMS), rng.choice(ROLES)
+
+    lines = []
+    seconds = 0
+    current_section = None
+    for section, question in questions:
+        if section != current_section:
+            lines.append(f"--- {section} ---")
+            current_section = section
+
+        lines.append(f"[{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}] Auditor: {question}")
+        seconds += rng.randint(5, 20)
+
+        answer, count = [], 0
+        while not answer or count < words_per_answer:
+            sentence = rng.choice(ANSWER_SENTENCES).format(system=system, role=role)
+            if answer and count + len(sentence.split()) > words_per_answer + 5:
+                break
+            answer.append(sentence)
+            count += len(sentence.split())
+        lines.append(f"[{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}] Client: {' '.join(answer)}")
+        seconds += count // 2
+
+    return '\n\n'.join(lines)
@@ -0,0 +1,232 @@
+"""Detection of duplicate and near-duplicate controls in an RCM.
+
+Multi-entity RCMs repeat the same control for every subsidiary with only the entity
+name or Ref ID changed. Controls are grouped into clusters so test steps are generated
+once per cluster and reused, with the wording that differs substituted back, for every
+other member.
+
+Clustering uses an exact hash of the normalized prompt text, then MinHash with LSH
+banding over word shingles; candidate pairs are confirmed with their exact Jaccard
+similarity. Near-duplicates only share a cluster when every difference from the
+representative can be substituted; a member with an extra clause is generated on its own.
+"""
+
+import os
+import re
+import json
+import difflib
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Dedup configuration (override through environment variables)
+DEDUP_ENABLED = os.getenv("SOX_DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+SIMILARITY_THRESHOLD = float(os.getenv("SOX_DEDUP_THRESHOLD", "0.8"))
+
+# Words per shingle and MinHash layout (bands * rows permutations)
+SHINGLE_SIZE = 3
+LSH_BANDS = 16
+LSH_ROWS = 4
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and collapse whitespace."""
+    return ' '.join(text.lower().split())
+
+
+def numbers_in(text: str) -> tuple:
+    """Numbers in order of appearance; controls differing in any amount, threshold or account never cluster."""
+    return tuple(NUMBER_PATTERN.findall(text))
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """Hash every run of size consecutive words into a 32-bit integer."""
+    words = text.split()
+    if len(words) < size:
+        words = words + [''] * (size - len(words))
+    return {
+        int.from_bytes(hashlib.blake2b(' '.join(words[i:i + size]).encode('utf-8'), digest_size=4).digest(), 'little')
+        for i in range(len(words) - size + 1)
+    }
+
+
+@lru_cache(maxsize=1)
+def _permutations() -> Tuple['np.ndarray', 'np.ndarray']:
+    """Fixed-seed universal hash coefficients, so signatures are stable across processes."""
+    import numpy as np
+
+    rng = np.random.RandomState(20240801)
+    perm_a = rng.randint(1, 1 << 31, size=LSH_BANDS * LSH_ROWS).astype(np.uint64)
+    perm_b = rng.randint(0, 1 << 31, size=LSH_BANDS * LSH_ROWS).astype(np.uint64)
+    return perm_a, perm_b
+
+
+def minhash_signature(shingle_set: Set[int]) -> 'np.ndarray':
+    """MinHash signature using LSH_BANDS * LSH_ROWS universal hash permutations."""
+    import numpy as np
+
+    perm_a, perm_b = _permutations()
+    values = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+    hashed = (np.outer(perm_a, values) + perm_b[:, None]) % np.uint64(MERSENNE_PRIME)
+    return hashed.min(axis=1)
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Keep the earliest row as the root so it becomes the cluster representative
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def cluster_texts(texts: Sequence[str], groups: Sequence[object], threshold: float = SIMILARITY_THRESHOLD) -> List[List[int]]:
+    """Cluster texts that are identical or at least threshold-similar, never across groups.
+
+    Args:
+        texts: Normalized text per item
+        groups: Key per item; only items with equal keys (and the same numbers) can share a cluster
+        threshold: Minimum Jaccard similarity of word shingles; >= 1 disables near-duplicate matching
+
+    Returns:
+        Clusters of item indices, each sorted with its earliest item (the representative) first
+    """
+    union_find = _UnionFind(len(texts))
+    groups = [(group, numbers_in(text)) for text, group in zip(texts, groups)]
+
+    # Exact duplicates
+    first_seen: Dict[tuple, int] = {}
+    for i, (text, group) in enumerate(zip(texts, groups)):
+        key = (group, hashlib.sha256(text.encode('utf-8')).digest())
+        if key in first_seen:
+            union_find.union(first_seen[key], i)
+        else:
+            first_seen[key] = i
+
+    # Near duplicates among the distinct texts
+    if threshold < 1:
+        representatives = sorted(set(first_seen.values()))
+        shingle_sets = {i: shingles(texts[i]) for i in representatives}
+        buckets: Dict[tuple, List[int]] = {}
+        for i in representatives:
+            signature = minhash_signature(shingle_sets[i])
+            for band in range(LSH_BANDS):
+                band_key = (groups[i], band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes())
+                buckets.setdefault(band_key, []).append(i)
+
+        checked = set()
+        for members in buckets.values():
+            for position, a in enumerate(members):
+                for b in members[position + 1:]:
+                    if (a, b) in checked or union_find.find(a) == union_find.find(b):
+                        continue
+                    checked.add((a, b))
+                    if jaccard(shingle_sets[a], shingle_sets[b]) >= threshold:
+                        union_find.union(a, b)
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(len(texts)):
+        clusters.setdefault(union_find.find(i), []).append(i)
+    return [sorted(members) for _, members in sorted(clusters.items())]
+
+
+def substitution_spans(source: str, target: str) -> Optional[Dict[str, str]]:
+    """Word spans that differ between two near-identical texts, as {source span: target span}.
+
+    Spans shorter than 3 characters (e.g. "A" in "Subsidiary A") are widened by one word on
+    each side so they do not rewrite unrelated words. Returns None when target cannot be
+    reached by substitution alone: words inserted or deleted (an extra clause or testing
+    attribute), a span still too short to substitute safely, or one span changed two ways.
+    """
+    source_tokens = list(WORD_PATTERN.finditer(source))
+    target_tokens = list(WORD_PATTERN.finditer(target))
+    matcher = difflib.SequenceMatcher(
+        a=[token.group() for token in source_tokens],
+        b=[token.group() for token in target_tokens],
+        autojunk=False
+    )
+
+    substitutions = {}
+    for tag, a_start, a_end, b_start, b_end in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        if tag != 'replace':
+            return None
+        old = source[source_tokens[a_start].start():source_tokens[a_end - 1].end()]
+        if len(old) < 3:
+            if a_start > 0 and b_start > 0:
+                a_start, b_start = a_start - 1, b_start - 1
+            if a_end < len(source_tokens) and b_end < len(target_tokens):
+                a_end, b_end = a_end + 1, b_end + 1
+            old = source[source_tokens[a_start].start():source_tokens[a_end - 1].end()]
+        new = target[target_tokens[b_start].start():target_tokens[b_end - 1].end()]
+        if len(old) < 3 or substitutions.get(old, new) != new:
+            return None
+        substitutions[old] = new
+    return substitutions
+
+
+def text_substitutions(source: str, target: str) -> Dict[str, str]:
+    """Substitutions carrying e.g. a cluster member's entity name into steps generated for the representative.
+
+    Only meaningful for texts split_unsubstitutable kept together; returns {} otherwise.
+    """
+    return substitution_spans(source, target) or {}
+
+
+def split_unsubstitutable(clusters: List[List[int]], texts: Sequence[str]) -> List[List[int]]:
+    """Split clusters so every member differs from its representative only by substitutable spans.
+
+    Members are assigned in row order to the first sub-cluster whose representative they
+    can be derived from; the rest start a sub-cluster of their own and are generated separately.
+    """
+    result = []
+    for cluster in clusters:
+        sub_clusters: List[List[int]] = []
+        for member in cluster:
+            for sub_cluster in sub_clusters:
+                if texts[sub_cluster[0]] == texts[member] or substitution_spans(texts[sub_cluster[0]], texts[member]) is not None:
+                    sub_cluster.append(member)
+                    break
+            else:
+                sub_clusters.append([member])
+        result.extend(sub_clusters)
+    return sorted(result)
+
+
+def apply_substitutions(content: str, substitutions: Dict[str, str]) -> str:
+    """Replace whole-word occurrences of each source span in one pass, escaping replacements for JSON strings."""
+    if not substitutions:
+        return content
+
+    alternatives = '|'.join(re.escape(old) for old in sorted(substitutions, key=len, reverse=True))
+    return re.sub(
+        rf"(?<!\w)(?:{alternatives})(?!\w)",
+        lambda match: json.dumps(substitutions[match.group(0)])[1:-1],
+        content
+    )
@@ -0,0 +1,135 @@
+"""Per-workbook manifest of generated test steps, for incremental re-generation.
+
+For every control of a workbook the manifest stores a hash of the exact request that
+would be sent for it together with the generated response. When the same workbook is
+uploaded again, controls whose hash is unchanged reuse the stored response and only
+added or edited rows are sent to Azure OpenAI.
+
+Different workbooks can share an upload filename (every team's "RCM.xlsx"), so manifests
+are stored per filename and workbook identity. resolve() picks, among the manifests of
+a filename, the one that already holds the most of the upload's (control, hash) pairs,
+i.e. an earlier version of the same workbook; an upload matching none of them gets a new
+identity instead of overwriting another workbook's entries.
+"""
+
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Manifest configuration (override through environment variables)
+MANIFEST_ENABLED = os.getenv("SOX_MANIFEST_ENABLED", "true").lower() in ("1", "true", "yes")
+MANIFEST_PATH = os.getenv(
+    "SOX_MANIFEST_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'control_manifests.sqlite3')
+)
+
+# Separates the upload filename from the workbook identity in the workbook column
+IDENTITY_SEPARATOR = '|'
+
+
+class ManifestStore:
+    """SQLite-backed map of (workbook, control key) to content hash and stored result."""
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS manifest_entries (
+                workbook TEXT NOT NULL,
+                control_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (workbook, control_key)
+            )"""
+        )
+        self._conn.commit()
+
+    def resolve(self, name: str, content_hashes: Dict[str, str]) -> str:
+        """Return the manifest key for an upload named name with {control_key: content_hash}.
+
+        This is the stored manifest of that filename sharing the most (control key, content
+        hash) pairs with the upload, or a new identity derived from the upload when none
+        shares any.
+        """
+        prefix = name + IDENTITY_SEPARATOR
+        # Range scan over the primary key: every workbook column starting with prefix
+        upper = name + chr(ord(IDENTITY_SEPARATOR) + 1)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT workbook, control_key, content_hash FROM manifest_entries WHERE workbook >= ? AND workbook < ?",
+                (prefix, upper)
+            ).fetchall()
+
+        matches: Dict[str, int] = {}
+        for workbook, control_key, content_hash in rows:
+            if content_hashes.get(control_key) == content_hash:
+                matches[workbook] = matches.get(workbook, 0) + 1
+        if matches:
+            return max(sorted(matches), key=matches.get)
+
+        digest = hashlib.sha256(json.dumps(sorted(content_hashes.items())).encode('utf-8')).hexdigest()
+        return prefix + digest[:16]
+
+    def load(self, workbook: str) -> Dict[str, Tuple[str, Dict]]:
+        """Return {control_key: (content_hash, result)} for a workbook."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT control_key, content_hash, result FROM manifest_entries WHERE workbook = ?", (workbook,)
+            ).fetchall()
+        return {control_key: (content_hash, json.loads(result)) for control_key, content_hash, result in rows}
+
+    def save(self, workbook: str, control_key: str, content_hash: str, result: Dict) -> None:
+        """Store (or replace) the result generated for one control."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO manifest_entries (workbook, control_key, content_hash, result, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (workbook, control_key, content_hash, json.dumps(result), time.time())
+            )
+            self._conn.commit()
+
+    def prune(self, workbook: str, keep_keys: Iterable[str]) -> int:
+        """Delete entries for controls no longer present in the workbook; returns the number removed."""
+        keep_keys = set(keep_keys)
+        with self._lock:
+            stored_keys = [row[0] for row in self._conn.execute(
+                "SELECT control_key FROM manifest_entries WHERE workbook = ?", (workbook,)
+            )]
+            removed = [(workbook, key) for key in stored_keys if key not in keep_keys]
+            self._conn.executemany("DELETE FROM manifest_entries WHERE workbook = ? AND control_key = ?", removed)
+            self._conn.commit()
+        return len(removed)
+
+    def forget(self, workbook: str) -> None:
+        """Drop the whole manifest of a workbook, forcing full regeneration next time."""
+        with self._lock:
+            self._conn.execute("DELETE FROM manifest_entries WHERE workbook = ?", (workbook,))
+            self._conn.commit()
+
+
+_manifest_store: Optional[ManifestStore] = None
+_manifest_store_lock = threading.Lock()
+
+
+def get_manifest_store() -> Optional[ManifestStore]:
+    """Return the shared manifest store, or None when incremental re-generation is disabled."""
+    global _manifest_store
+    if not MANIFEST_ENABLED:
+        return None
+
+    with _manifest_store_lock:
+        if _manifest_store is None:
+            _manifest_store = ManifestStore()
+            logger.debug(f"Control manifest opened at {MANIFEST_PATH}")
+        return _manifest_store
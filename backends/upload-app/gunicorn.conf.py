@@ -0,0 +1,58 @@
+"""Gunicorn configuration for serving the backend in production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Requests spend most of their time waiting on Azure OpenAI, so each worker process runs
+several threads. The app is preloaded once in the master, and wsgi.py imports pandas,
+openpyxl, python-docx and openai there, so workers fork with them already loaded. On SIGTERM, workers stop accepting
+connections, finish in-flight requests and wait for running background jobs (up to
+JOB_DRAIN_SECONDS); jobs that did not start are left queued for the next process.
+Workers share their /metrics counters through TELEMETRY_METRICS_DIR, so any worker
+answering a scrape reports the totals of all of them.
+"""
+
+import os
+import tempfile
+import multiprocessing
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '3002')}")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+# Rate limits are enforced per process, so each worker takes an equal share of the
+# OPENAI_REQUESTS_PER_MINUTE / OPENAI_TOKENS_PER_MINUTE quota (read by llm_client on import)
+os.environ.setdefault("OPENAI_RATE_LIMIT_PROCESSES", str(workers))
+# Each worker writes its /metrics counters here and /metrics sums them (read by telemetry on import)
+os.environ.setdefault("TELEMETRY_METRICS_DIR", os.path.join(tempfile.gettempdir(), f"sox-upload-app-metrics-{os.getpid()}"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = True
+
+# Synchronous /generate-test-steps requests last as long as the whole workbook takes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "900"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "300"))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    # Counters from an earlier server using the same directory would otherwise be added in
+    from telemetry import clear_metrics_dir
+    clear_metrics_dir()
+
+
+def post_fork(server, worker):
+    # Job executor threads must be started in the worker, not in the preloading master
+    from job_queue import resume_pending_jobs
+    resume_pending_jobs()
+
+
+def worker_exit(server, worker):
+    from job_queue import drain_jobs, JOB_DRAIN_SECONDS
+    drain_jobs(min(JOB_DRAIN_SECONDS, server.cfg.graceful_timeout))
+
+
+def on_exit(server):
+    from telemetry import clear_metrics_dir
+    clear_metrics_dir()
@@ -0,0 +1,339 @@
+"""Background job queue for long-running SOX test step generation.
+
+Jobs are persisted in a local SQLite store so queued or interrupted runs are
+picked up again when the server restarts.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sox_processor import generate_test_steps
+
+logger = logging.getLogger(__name__)
+
+# Job configuration (override through environment variables)
+JOBS_FOLDER = os.getenv("JOBS_FOLDER", "jobs")
+JOB_STORE_PATH = os.path.join(JOBS_FOLDER, 'jobs.sqlite3')
+JOB_INPUT_FOLDER = os.path.join(JOBS_FOLDER, 'inputs')
+JOB_RESULT_FOLDER = os.path.join(JOBS_FOLDER, 'results')
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 60 * 60)))
+JOB_DRAIN_SECONDS = int(os.getenv("JOB_DRAIN_SECONDS", "240"))
+
+# Job statuses
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+
+def _owner_id() -> str:
+    """Identify the process running a job, so restarts can detect orphaned jobs."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_is_dead(owner: Optional[str]) -> bool:
+    """Return True if the owning process ran on this host and no longer exists."""
+    if not owner or ':' not in owner:
+        return True
+
+    host, pid = owner.rsplit(':', 1)
+    if host != socket.gethostname():
+        return False
+
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return True
+    return False
+
+
+class JobStore:
+    """SQLite-backed persistence for job state and progress."""
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                filename TEXT,
+                input_path TEXT,
+                result_path TEXT,
+                options TEXT,
+                progress_done INTEGER NOT NULL DEFAULT 0,
+                progress_total INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                owner TEXT,
+                usage TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        # Stores created before usage was recorded lack the column
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'usage' not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN usage TEXT")
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def create(self, job_id: str, filename: str, input_path: str, options: Optional[Dict] = None) -> None:
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, filename, input_path, options, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, STATUS_QUEUED, filename, input_path, json.dumps(options or {}), now, now)
+        )
+
+    def create_completed(self, job_id: str, filename: str, result_path: str, total: int, usage: Optional[Dict] = None) -> None:
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, filename, result_path, progress_done, progress_total, usage, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, STATUS_COMPLETED, filename, result_path, total, total, json.dumps(usage) if usage else None, now, now)
+        )
+
+    def get(self, job_id: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def claim(self, job_id: str) -> bool:
+        """Atomically move a queued job to running; returns False if another worker got it."""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, owner = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (STATUS_RUNNING, _owner_id(), time.time(), job_id, STATUS_QUEUED)
+        )
+        return cursor.rowcount == 1
+
+    def update_progress(self, job_id: str, done: int, total: int) -> None:
+        self._execute(
+            "UPDATE jobs SET progress_done = ?, progress_total = ?, updated_at = ? WHERE id = ?",
+            (done, total, time.time(), job_id)
+        )
+
+    def complete(self, job_id: str, result_path: str, usage: Optional[Dict] = None) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, result_path = ?, usage = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (STATUS_COMPLETED, result_path, json.dumps(usage) if usage else None, time.time(), job_id)
+        )
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (STATUS_FAILED, error, time.time(), job_id)
+        )
+
+    def requeue_orphaned(self) -> List[str]:
+        """Return queued jobs plus running jobs whose worker died, reset to queued."""
+        stale_before = time.time() - JOB_STALE_SECONDS
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, status, owner, updated_at FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (STATUS_QUEUED, STATUS_RUNNING)
+            ).fetchall()
+
+            job_ids = []
+            for row in rows:
+                if row['status'] == STATUS_RUNNING:
+                    if not (_owner_is_dead(row['owner']) or row['updated_at'] < stale_before):
+                        continue
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE id = ?",
+                        (STATUS_QUEUED, time.time(), row['id'])
+                    )
+                job_ids.append(row['id'])
+            self._conn.commit()
+            return job_ids
+
+    def purge_expired(self) -> None:
+        """Delete finished jobs (and their files) older than the retention period."""
+        expired_before = time.time() - JOB_RETENTION_SECONDS
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, input_path, result_path FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (STATUS_COMPLETED, STATUS_FAILED, expired_before)
+            ).fetchall()
+            for row in rows:
+                for path in (row['input_path'], row['result_path']):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (row['id'],))
+            self._conn.commit()
+
+        if rows:
+            logger.info(f"Purged {len(rows)} expired jobs")
+
+
+_job_store: Optional[JobStore] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_futures = set()
+_init_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """Return the shared job store, creating the jobs folders on first use."""
+    global _job_store
+    with _init_lock:
+        if _job_store is None:
+            os.makedirs(JOB_INPUT_FOLDER, exist_ok=True)
+            os.makedirs(JOB_RESULT_FOLDER, exist_ok=True)
+            _job_store = JobStore()
+        return _job_store
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _init_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="sox-job")
+        return _executor
+
+
+def _submit(job_id: str) -> None:
+    future = _get_executor().submit(run_job, job_id)
+    with _init_lock:
+        _futures.add(future)
+    future.add_done_callback(lambda done: _futures.discard(done))
+
+
+def drain_jobs(timeout: float = JOB_DRAIN_SECONDS) -> int:
+    """Stop taking jobs and wait up to timeout seconds for running ones; returns the number still running.
+
+    Jobs that have not started stay queued in the store, and jobs still running when the
+    process exits are detected as orphaned, so the next server process resumes both.
+    """
+    with _init_lock:
+        executor = _executor
+        futures = set(_futures)
+    if executor is None:
+        return 0
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    running = [future for future in futures if not future.cancelled()]
+    if running:
+        logger.info(f"Waiting up to {timeout}s for {len(running)} running jobs to finish")
+    _, not_done = wait(running, timeout=timeout)
+    if not_done:
+        logger.warning(f"{len(not_done)} jobs still running at shutdown; they will be resumed on restart")
+    return len(not_done)
+
+
+def job_to_dict(job: sqlite3.Row) -> Dict:
+    """Convert a job row into the JSON shape returned by the API."""
+    return {
+        'jobId': job['id'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'progress': {
+            'completed': job['progress_done'],
+            'total': job['progress_total']
+        },
+        'error': job['error'],
+        'usage': json.loads(job['usage']) if job['usage'] else None,
+        'createdAt': datetime.fromtimestamp(job['created_at']).isoformat(),
+        'updatedAt': datetime.fromtimestamp(job['updated_at']).isoformat()
+    }
+
+
+def run_job(job_id: str) -> None:
+    """Execute a queued job; safe to call for a job another worker already claimed."""
+    store = get_job_store()
+    if not store.claim(job_id):
+        logger.debug(f"Job {job_id} already claimed, skipping")
+        return
+
+    job = store.get(job_id)
+    options = json.loads(job['options'] or '{}')
+    logger.info(f"Running job {job_id} for {job['filename']}")
+
+    try:
+        result = generate_test_steps(
+            [job['input_path']],
+            max_workers=options.get('max_workers'),
+            batch_size=options.get('batch_size'),
+            manifest_key=job['filename'],
+            progress_callback=lambda done, total: store.update_progress(job_id, done, total)
+        )
+
+        result_path = os.path.join(JOB_RESULT_FOLDER, f"{job_id}.xlsx")
+        shutil.move(result['excelTemplatePath'], result_path)
+        store.complete(job_id, result_path, result.get('usage'))
+        logger.info(f"Job {job_id} completed: {result['controlsProcessed']} controls")
+
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        store.fail(job_id, str(e))
+
+    finally:
+        if job['input_path'] and os.path.exists(job['input_path']):
+            os.remove(job['input_path'])
+
+
+def submit_job(upload, filename: str, options: Optional[Dict] = None) -> Dict:
+    """Persist an uploaded workbook, queue it for processing and return the job record.
+
+    Args:
+        upload: Uploaded file object exposing save(path) (e.g. werkzeug FileStorage)
+        filename: Sanitized original filename
+        options: Optional generation options stored with the job
+    """
+    store = get_job_store()
+    store.purge_expired()
+
+    job_id = uuid.uuid4().hex
+    input_path = os.path.join(JOB_INPUT_FOLDER, f"{job_id}{os.path.splitext(filename)[1]}")
+    upload.save(input_path)
+
+    store.create(job_id, filename, input_path, options)
+    _submit(job_id)
+    logger.info(f"Queued job {job_id} for {filename}")
+    return job_to_dict(store.get(job_id))
+
+
+def record_completed_job(filename: str, template_path: str, total: int, usage: Optional[Dict] = None) -> Dict:
+    """Store a template produced outside the queue (e.g. by a streaming request) for download."""
+    store = get_job_store()
+    job_id = uuid.uuid4().hex
+    result_path = os.path.join(JOB_RESULT_FOLDER, f"{job_id}.xlsx")
+    shutil.move(template_path, result_path)
+
+    store.create_completed(job_id, filename, result_path, total, usage)
+    return job_to_dict(store.get(job_id))
+
+
+def get_job(job_id: str) -> Optional[sqlite3.Row]:
+    """Return the stored job row, or None if the job does not exist."""
+    return get_job_store().get(job_id)
+
+
+def resume_pending_jobs() -> int:
+    """Re-queue jobs left queued or orphaned by a previous server process."""
+    job_ids = get_job_store().requeue_orphaned()
+    for job_id in job_ids:
+        _submit(job_id)
+
+    if job_ids:
+        logger.info(f"Resumed {len(job_ids)} pending jobs")
+    return len(job_ids)
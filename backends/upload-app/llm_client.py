@@ -0,0 +1,432 @@
+"""Shared Azure OpenAI client, rate limiting, retry and circuit breaking.
+
+Every chat completion request from sox_processor and transcript_processor is sent with
+the client returned by get_openai_client and goes through call_with_retries, so
+concurrent runs share one connection pool, one requests/min and tokens/min budget, back
+off together when Azure answers 429, and stop hammering the endpoint during an outage.
+These are per process: under gunicorn, the configured limits are split evenly between
+the workers (OPENAI_RATE_LIMIT_PROCESSES), while retries and the circuit breaker stay local.
+"""
+
+import os
+import time
+import importlib.util
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, TypeVar
+from dotenv import load_dotenv
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Load environment variables
+load_dotenv()
+
+# Quota and retry configuration (override through environment variables; 0 disables a limit)
+REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0"))
+TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0"))
+# Processes sharing the deployment's quota (gunicorn.conf.py sets it to the worker count).
+# The token buckets live in each process, so each one gets an equal share of the limits.
+RATE_LIMIT_PROCESSES = max(1, int(os.getenv("OPENAI_RATE_LIMIT_PROCESSES", "1")))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "1"))
+BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "60"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("OPENAI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("OPENAI_CIRCUIT_RESET_SECONDS", "30"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("OPENAI_REQUEST_DEADLINE_SECONDS", "600"))
+
+# Azure OpenAI connection settings shared by every caller
+API_KEY = os.getenv("OPENAI_API_KEY")
+API_BASE = os.getenv("OPENAI_API_BASE")
+API_VERSION = os.getenv("OPENAI_API_VERSION", "2024-08-01-preview")
+
+# Connection pool (one per process, kept alive between requests)
+POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "64"))
+POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "32"))
+POOL_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_POOL_KEEPALIVE_EXPIRY_SECONDS", "120"))
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "10"))
+READ_TIMEOUT_SECONDS = float(os.getenv("OPENAI_READ_TIMEOUT_SECONDS", "300"))
+# auto enables HTTP/2 when the h2 package is installed
+HTTP2_MODE = os.getenv("OPENAI_HTTP2", "auto").lower()
+
+# HTTP statuses and client exception types worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    'APIConnectionError', 'APITimeoutError', 'RateLimitError', 'InternalServerError',
+    'Timeout', 'TryAgain', 'ServiceUnavailableError', 'ConnectionError', 'TimeoutError'
+}
+
+
+class LLMRequestError(Exception):
+    """Raised when a request fails permanently or exhausts its retries."""
+
+
+class CircuitOpenError(LLMRequestError):
+    """Raised when the circuit breaker stays open past the request deadline."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at capacity_per_minute / 60 per second."""
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = capacity_per_minute
+        self.tokens = float(capacity_per_minute)
+        self.rate = capacity_per_minute / 60.0
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        """Block until amount tokens are available, then take them."""
+        if self.capacity <= 0:
+            return
+
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait_seconds = (amount - self.tokens) / self.rate
+
+            time.sleep(wait_seconds)
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets a single trial request through per reset window."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """Seconds the caller must wait before sending a request; 0 means go ahead."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self.trial_in_progress:
+                return min(1.0, self.reset_seconds)
+
+            self.trial_in_progress = True
+            return 0
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Circuit breaker closed after successful trial request")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.trial_in_progress = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if self.trial_in_progress else 'open'
+
+
+def per_process_limit(limit_per_minute: int) -> int:
+    """This process's share of a deployment-wide per-minute limit (0 stays unlimited)."""
+    if limit_per_minute <= 0:
+        return 0
+    return max(1, limit_per_minute // RATE_LIMIT_PROCESSES)
+
+
+_request_bucket = TokenBucket(per_process_limit(REQUESTS_PER_MINUTE))
+_token_bucket = TokenBucket(per_process_limit(TOKENS_PER_MINUTE))
+_circuit_breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+
+# Set when Azure answers 429 so every caller pauses, not just the one that was throttled
+_pause_until = 0.0
+_pause_lock = threading.Lock()
+
+_openai_client = None
+_async_openai_client = None
+_client_lock = threading.Lock()
+
+
+def _http2_enabled() -> bool:
+    if HTTP2_MODE == 'auto':
+        return importlib.util.find_spec('h2') is not None
+    return HTTP2_MODE in ('1', 'true', 'yes')
+
+
+def _openai_httpx():
+    """The httpx module the installed openai package is built on.
+
+    openai's DefaultHttpxClient subclasses that module's Client, which is not necessarily
+    the top-level httpx importable here, so pool limits are built from the same module.
+    """
+    import importlib
+    from openai import DefaultHttpxClient
+
+    return importlib.import_module(DefaultHttpxClient.__bases__[0].__module__.partition('.')[0])
+
+
+def _http_client_options() -> Dict:
+    """Pool limits and protocol for the httpx clients behind the OpenAI clients."""
+    httpx = _openai_httpx()
+
+    return {
+        'limits': httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        'http2': _http2_enabled()
+    }
+
+
+def _client_options() -> Dict:
+    if not API_KEY:
+        logger.error("OpenAI API key not configured.")
+        raise ValueError("OpenAI API key not configured. Please set OPENAI_API_KEY environment variable.")
+
+    from openai import Timeout
+
+    # Retries are handled by call_with_retries so they share the rate limiter and circuit breaker.
+    # The timeout goes to the OpenAI client, which passes it to every request it sends.
+    return {
+        'api_key': API_KEY,
+        'api_version': API_VERSION,
+        'azure_endpoint': API_BASE,
+        'max_retries': 0,
+        'timeout': Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+    }
+
+
+def get_openai_client():
+    """Return the process-wide AzureOpenAI client, creating it (and its connection pool) on first use.
+
+    The client is thread-safe; sharing it lets concurrent requests reuse kept-alive (and,
+    with HTTP/2, multiplexed) connections instead of opening a new TLS session per call.
+    Under gunicorn it is created in each worker after fork, never in the preloading master.
+    """
+    global _openai_client
+    with _client_lock:
+        if _openai_client is None:
+            from openai import AzureOpenAI, DefaultHttpxClient
+
+            http_options = _http_client_options()
+            _openai_client = AzureOpenAI(**_client_options(), http_client=DefaultHttpxClient(**http_options))
+            logger.info(
+                f"Azure OpenAI client created: pool of {POOL_MAX_CONNECTIONS} connections, "
+                f"HTTP/2 {'enabled' if http_options['http2'] else 'disabled'}"
+            )
+        return _openai_client
+
+
+def get_async_openai_client():
+    """Async counterpart of get_openai_client (AsyncAzureOpenAI with the same pool settings)."""
+    global _async_openai_client
+    with _client_lock:
+        if _async_openai_client is None:
+            from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+            _async_openai_client = AsyncAzureOpenAI(
+                **_client_options(), http_client=DefaultAsyncHttpxClient(**_http_client_options())
+            )
+        return _async_openai_client
+
+
+def build_messages(system_prompt: str, user_prompt: str, shared_context: Optional[str] = None) -> List[Dict]:
+    """Order chat messages so the longest content shared between requests comes first.
+
+    Azure OpenAI caches prompt prefixes (1024+ tokens) and bills cached input tokens at a
+    discount, but only for byte-identical prefixes. shared_context (e.g. a transcript reused
+    by every question) therefore leads, followed by the static system prompt, with only the
+    per-request user prompt varying at the end.
+    """
+    messages = []
+    if shared_context:
+        messages.append({"role": "system", "content": shared_context})
+    messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+
+def _field(obj, name: str):
+    """Read a field from an openai>=1 response model or a legacy dict-like OpenAIObject."""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def record_usage(response, model: str, latency: float) -> Dict[str, int]:
+    """Report the response's token usage (including prompt-cache hits) and latency to telemetry."""
+    usage = _field(response, 'usage')
+    details = _field(usage, 'prompt_tokens_details')
+    tokens = {
+        'prompt': _field(usage, 'prompt_tokens') or 0,
+        'cached': _field(details, 'cached_tokens') or 0,
+        'completion': _field(usage, 'completion_tokens') or 0
+    }
+    telemetry.record_request(model, tokens, latency)
+
+    logger.debug(
+        f"OpenAI usage: {tokens['prompt']} prompt ({tokens['cached']} cached), "
+        f"{tokens['completion']} completion tokens in {latency:.2f}s"
+    )
+    return tokens
+
+
+def estimate_request_tokens(messages: List[Dict], max_tokens: int) -> int:
+    """Approximate the tokens Azure charges against TPM: prompt (~4 chars/token) plus max_tokens."""
+    prompt_chars = sum(len(message.get('content') or '') for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """Extract the HTTP status from openai>=1 (status_code) or legacy openai (http_status) errors."""
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read retry-after-ms / retry-after from the error's response headers, if present."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+
+    try:
+        retry_after_ms = headers.get('retry-after-ms')
+        if retry_after_ms:
+            return float(retry_after_ms) / 1000
+
+        retry_after = headers.get('retry-after')
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Return True for throttling, server-side and connection errors."""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _wait_for_pause() -> None:
+    with _pause_lock:
+        remaining = _pause_until - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+def _pause_all(seconds: float) -> None:
+    global _pause_until
+    with _pause_lock:
+        _pause_until = max(_pause_until, time.monotonic() + seconds)
+
+
+def call_with_retries(request_fn: Callable[[], T], estimated_tokens: int = 0) -> T:
+    """Run request_fn under the shared rate limits, retrying throttled and transient failures.
+
+    Args:
+        request_fn: Zero-argument callable performing one chat completion request
+        estimated_tokens: Tokens to reserve from the tokens/min budget (see estimate_request_tokens)
+
+    Returns:
+        Whatever request_fn returns
+
+    Raises:
+        LLMRequestError: On a non-retryable error or once retries are exhausted
+        CircuitOpenError: If the circuit breaker stays open past the request deadline
+    """
+    deadline = time.monotonic() + REQUEST_DEADLINE_SECONDS
+    attempt = 0
+
+    while True:
+        circuit_wait = _circuit_breaker.wait_time()
+        if circuit_wait > 0:
+            if time.monotonic() + circuit_wait > deadline:
+                raise CircuitOpenError("Azure OpenAI circuit breaker is open; giving up on request")
+            time.sleep(circuit_wait)
+            continue
+
+        _wait_for_pause()
+        _request_bucket.acquire(1)
+        _token_bucket.acquire(estimated_tokens)
+
+        try:
+            result = request_fn()
+        except Exception as e:
+            if not is_retryable_error(e):
+                # The request itself is bad; it says nothing about the endpoint's health
+                _circuit_breaker.record_success()
+                raise LLMRequestError(f"OpenAI request failed: {str(e)}") from e
+
+            _circuit_breaker.record_failure()
+            if attempt >= MAX_RETRIES:
+                raise LLMRequestError(f"OpenAI request failed after {attempt + 1} attempts: {str(e)}") from e
+
+            retry_after = _retry_after_seconds(e)
+            delay = retry_after if retry_after is not None else backoff_seconds(attempt)
+            if _status_code(e) == 429:
+                _pause_all(delay)
+
+            attempt += 1
+            telemetry.record_retry(str(_status_code(e) or type(e).__name__))
+            logger.warning(f"OpenAI request failed ({str(e)[:200]}); retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        _circuit_breaker.record_success()
+        return result
+
+
+def get_client_state() -> Dict:
+    """Return the circuit breaker state and configured limits for health reporting."""
+    return {
+        'circuit_breaker': _circuit_breaker.state,
+        'requests_per_minute': REQUESTS_PER_MINUTE,
+        'tokens_per_minute': TOKENS_PER_MINUTE,
+        'rate_limit_processes': RATE_LIMIT_PROCESSES,
+        'process_requests_per_minute': _request_bucket.capacity,
+        'process_tokens_per_minute': _token_bucket.capacity,
+        'max_retries': MAX_RETRIES,
+        'connection_pool': {
+            'max_connections': POOL_MAX_CONNECTIONS,
+            'max_keepalive': POOL_MAX_KEEPALIVE,
+            'http2': _http2_enabled()
+        }
+    }
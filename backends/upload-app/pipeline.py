@@ -0,0 +1,113 @@
+"""Minimal threaded pipeline stages connected by bounded queues, plus a window for in-order consumers."""
+
+import queue
+import logging
+import threading
+import contextvars
+from typing import Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _StageError:
+    """Carries an exception raised inside a stage to the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def run_stage(source: Iterable, transform: Optional[Callable] = None, maxsize: int = 32, name: str = 'stage') -> Iterator:
+    """Consume source on a background thread, apply transform, and yield the results in order.
+
+    At most maxsize results wait in the queue; when the consumer falls behind, the stage
+    blocks, which in turn stops it pulling from source. Exceptions raised by source or
+    transform are re-raised in the consumer. Closing the returned generator stops the
+    stage and closes source. The stage thread runs in a copy of the caller's context, so
+    contextvars (e.g. the telemetry run) carry over.
+    """
+    output: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work() -> None:
+        iterator = iter(source)
+        try:
+            for item in iterator:
+                if not put(transform(item) if transform else item):
+                    break
+            else:
+                put(_DONE)
+        except BaseException as e:
+            put(_StageError(e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(work,), name=f"pipeline-{name}", daemon=True
+    )
+    thread.start()
+
+    try:
+        while True:
+            item = output.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+class ReorderWindow:
+    """Bounds how far a producer may run ahead of a consumer that writes results in index order.
+
+    Results finishing out of order have to wait in the consumer's reorder buffer until every
+    earlier index has arrived. The consumer calls advance() with the next index it needs; the
+    producer only starts work for indices below limit(), so the buffer holds about size
+    results (a batch started in the window may reach past it) however long one early
+    result takes. close() tells the producer to stop (and
+    wakes it if it is waiting) when the consumer stops early.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.next_index = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def limit(self) -> int:
+        """First index the producer may not start yet."""
+        with self._condition:
+            return self.next_index + self.size
+
+    def allows(self, index: int) -> bool:
+        return index < self.limit()
+
+    def advance(self, next_index: int) -> None:
+        with self._condition:
+            if next_index > self.next_index:
+                self.next_index = next_index
+                self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def wait_for(self, index: int, timeout: Optional[float] = None) -> bool:
+        """Block until index is allowed or the window is closed; returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.closed or index < self.next_index + self.size, timeout)
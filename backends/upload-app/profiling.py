@@ -0,0 +1,88 @@
+"""Opt-in per-request profiling, requested with an X-Profile header.
+
+With PROFILE_REQUESTS_ENABLED set, a request carrying `X-Profile: cprofile` (or
+`pyinstrument`, if installed) is profiled from the start of the request until its
+response has been sent, including streamed bodies. The profile is written to
+PROFILE_FOLDER and its file name returned in the X-Profile-File response header.
+
+Only the request thread is profiled; time spent waiting on the worker pool shows up
+as waits, and per-stage timings of the workers are in the result's timings block.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Profiling configuration (override through environment variables)
+PROFILE_REQUESTS_ENABLED = os.getenv("PROFILE_REQUESTS_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_FOLDER = os.getenv("PROFILE_FOLDER", "profiles")
+
+PROFILE_HEADER = 'X-Profile'
+PROFILERS = ('cprofile', 'pyinstrument')
+
+_counter_lock = threading.Lock()
+_counter = 0
+
+
+class RequestProfile:
+    """A running profiler and the file its results are written to."""
+
+    def __init__(self, kind: str, profiler, path: str):
+        self.kind = kind
+        self.profiler = profiler
+        self.path = path
+
+    def stop(self) -> None:
+        """Stop profiling and write the profile (.prof for cProfile, .html for pyinstrument)."""
+        try:
+            if self.kind == 'cprofile':
+                self.profiler.disable()
+                self.profiler.dump_stats(self.path)
+            else:
+                self.profiler.stop()
+                with open(self.path, 'w', encoding='utf-8') as f:
+                    f.write(self.profiler.output_html())
+            logger.info(f"Request profile written to {self.path}")
+        except Exception as e:
+            logger.warning(f"Could not write request profile {self.path}: {str(e)}")
+
+
+def start_profile(requested: Optional[str], endpoint: str) -> Optional[RequestProfile]:
+    """Start profiling the current request if enabled and requested; returns None otherwise."""
+    global _counter
+    if not PROFILE_REQUESTS_ENABLED or not requested:
+        return None
+
+    kind = requested.strip().lower()
+    if kind not in PROFILERS:
+        kind = 'cprofile'
+
+    with _counter_lock:
+        _counter += 1
+        number = _counter
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+    extension = 'prof' if kind == 'cprofile' else 'html'
+    path = os.path.join(PROFILE_FOLDER, f"{time.strftime('%Y%m%d_%H%M%S')}_{number}_{endpoint}.{extension}")
+
+    try:
+        if kind == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+    except ImportError:
+        logger.warning(f"{kind} is not installed; request not profiled")
+        return None
+    except ValueError as e:
+        # Only one profiler can be active at a time (e.g. a concurrent profiled request)
+        logger.warning(f"Request not profiled: {str(e)}")
+        return None
+
+    return RequestProfile(kind, profiler, path)
@@ -0,0 +1,150 @@
+"""Persistent, content-addressed cache for Azure OpenAI chat completion responses."""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration (override through environment variables)
+CACHE_ENABLED = os.getenv("OPENAI_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_PATH = os.getenv(
+    "OPENAI_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'openai_responses.sqlite3')
+)
+CACHE_TTL_SECONDS = int(os.getenv("OPENAI_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60)))  # 30 days
+CACHE_MAX_BYTES = int(os.getenv("OPENAI_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+
+def make_cache_key(model: str, messages: List[Dict], config: Dict) -> str:
+    """Hash the full request (model, messages and sampling parameters) into a cache key."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "config": config},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response store with TTL expiry and size-based LRU eviction."""
+
+    def __init__(self, path: str = CACHE_PATH, ttl_seconds: int = CACHE_TTL_SECONDS, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_accessed ON responses (last_accessed)")
+        self._conn.commit()
+
+    def get(self, model: str, messages: List[Dict], config: Dict) -> Optional[str]:
+        """Return the cached response for this request, or None on a miss."""
+        key = make_cache_key(model, messages, config)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        logger.debug(f"Response cache hit: {key[:12]}")
+        return row[0]
+
+    def set(self, model: str, messages: List[Dict], config: Dict, response: str) -> None:
+        """Store a response and evict least recently used entries beyond the size budget."""
+        key = make_cache_key(model, messages, config)
+        now = time.time()
+        size = len(response.encode('utf-8'))
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._evict_lru()
+            self._conn.commit()
+
+    def _evict_lru(self) -> None:
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        freed = 0
+        evict_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_accessed ASC"):
+            if total_bytes - freed <= self.max_bytes:
+                break
+            evict_keys.append((key,))
+            freed += size
+
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+        logger.info(f"Response cache evicted {len(evict_keys)} entries ({freed} bytes)")
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current cache size."""
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': total_bytes
+        }
+
+    def clear(self) -> None:
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the shared response cache, or None when caching is disabled."""
+    global _response_cache
+    if not CACHE_ENABLED:
+        return None
+
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+            logger.debug(f"Response cache opened at {CACHE_PATH}")
+        return _response_cache
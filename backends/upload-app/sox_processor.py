@@ -1,16 +1,30 @@
 import os
-from openai import AzureOpenAI
-from docx import Document
+import sys
+import time
 import logging
 import tempfile
-import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, NamedTuple, Optional, Callable, Iterator, Sequence, Tuple, Union, BinaryIO, TYPE_CHECKING
 from datetime import datetime
-import pandas as pd
-import openpyxl
-from openpyxl import Workbook
+from dataclasses import dataclass
 import json
+import heapq
+import hashlib
+from response_cache import get_response_cache
+import telemetry
+from control_manifest import get_manifest_store
+from pipeline import run_stage, ReorderWindow
+from control_dedup import (
+    DEDUP_ENABLED, normalize_text, cluster_texts, split_unsubstitutable, text_substitutions, apply_substitutions
+)
+from llm_client import (
+    call_with_retries, estimate_request_tokens, build_messages, record_usage, get_openai_client, LLMRequestError
+)
+
+# pandas and openpyxl are imported where they are used, keeping app startup fast
+if TYPE_CHECKING:
+    from openpyxl import Workbook
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,24 +34,11 @@ logger.setLevel(logging.DEBUG)
 # Load environment variables
 load_dotenv()
 
-# Configure Azure OpenAI Client
-api_key = os.getenv("OPENAI_API_KEY")
+# Azure OpenAI deployment (the client itself is shared, see llm_client.get_openai_client)
 api_base = os.getenv("OPENAI_API_BASE")
 api_version = os.getenv("OPENAI_API_VERSION", "2024-08-01-preview")
 engine = os.getenv("OPENAI_ENGINE", "gpt-4o")
 
-# Validate configuration
-if not api_key:
-    logger.error("OpenAI API key not configured.")
-    raise ValueError("OpenAI API key not configured. Please set OPENAI_API_KEY environment variable.")
-
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    api_key=api_key,
-    api_version=api_version,
-    azure_endpoint=api_base
-)
-
 logger.debug(f"SOX Processor - API base: {api_base}")
 logger.debug(f"SOX Processor - API version: {api_version}")
 logger.debug(f"SOX Processor - Engine: {engine}")
@@ -51,79 +52,232 @@ API_CONFIG = {
     "presence_penalty": 0
 }
 
-def make_openai_request(system_prompt: str, user_prompt: str, max_tokens: int = None) -> str:
-    """Centralized OpenAI API request handler with error handling and logging."""
+# Maximum number of controls sent to Azure OpenAI at the same time
+MAX_CONCURRENT_REQUESTS = int(os.getenv("SOX_MAX_CONCURRENT_REQUESTS", "8"))
+
+# Number of controls packed into one request in batch mode (1 disables batching)
+BATCH_SIZE = int(os.getenv("SOX_BATCH_SIZE", "1"))
+BATCH_MAX_TOKENS = 16000
+
+# Workbooks larger than this are parsed lazily with openpyxl read-only mode instead of pandas
+STREAMING_PARSE_THRESHOLD_BYTES = int(os.getenv("SOX_STREAMING_PARSE_THRESHOLD_MB", "5")) * 1024 * 1024
+
+# Results that may wait between pipeline stages (generate -> parse response -> write rows)
+PIPELINE_QUEUE_SIZE = int(os.getenv("SOX_PIPELINE_QUEUE_SIZE", "32"))
+
+# Input layout: Ref ID (A), Control Description (B), Testing Attributes (C), Design Attributes (D), Evidence of Control (E)
+CONTROL_COLUMNS = ['Ref ID', 'Control Description', 'Testing Attributes', 'Design Attributes', 'Evidence of Control']
+CONTROL_FIELDS = ['ref_id', 'control_description', 'testing_attributes', 'design_attributes', 'evidence_of_control']
+
+# Strings pd.read_excel treats as missing by default; the streaming parser blanks them the same way
+PANDAS_NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
+
+# Response format for test step generation: "json_schema" (structured outputs, validated by the
+# service), "json_object" (any JSON) or "text" for deployments that support neither
+RESPONSE_FORMAT_MODE = os.getenv("SOX_RESPONSE_FORMAT", "json_schema").lower()
+
+# Schema of one generated test step; every field is required by structured outputs
+TEST_STEP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "control_id": {"type": "string"},
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+        "attribute_name": {"type": "string"},
+        "attribute_description": {"type": "string"}
+    },
+    "required": ["control_id", "name", "description", "attribute_name", "attribute_description"],
+    "additionalProperties": False
+}
+
+TEST_STEPS_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "test_steps": {"type": "array", "items": TEST_STEP_SCHEMA}
+    },
+    "required": ["test_steps"],
+    "additionalProperties": False
+}
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "controls": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "control_id": {"type": "string"},
+                    "test_steps": {"type": "array", "items": TEST_STEP_SCHEMA}
+                },
+                "required": ["control_id", "test_steps"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["controls"],
+    "additionalProperties": False
+}
+
+# Longest invalid response echoed back in a repair request
+REPAIR_RESPONSE_MAX_CHARS = 6000
+
+# Output template layout
+TEMPLATE_SHEET_TITLE = "SOX Test Steps Template"
+TEMPLATE_HEADERS = [
+    'Control ID',
+    'Test Step Name',
+    'Test Step Description',
+    'Attribute Name',
+    'Attribute Description'
+]
+
+# Batch output layouts: all rows in one template sheet, or one template sheet per source sheet
+BATCH_LAYOUTS = ('combined', 'sheets')
+SOURCE_SHEET_HEADER = 'Source Sheet'
+
+def make_openai_request(system_prompt: str, user_prompt: str, max_tokens: int = None, use_cache: bool = True,
+                        response_format: Optional[Dict] = None) -> str:
+    """Centralized OpenAI API request handler with caching, rate limiting, retries and logging.
+
+    response_format is passed through to the API (see build_response_format). Raises
+    LLMRequestError when the request ultimately fails, rather than returning an error
+    string that would silently turn into generic fallback test steps.
+    """
     config = API_CONFIG.copy()
     if max_tokens:
         config["max_tokens"] = max_tokens
+    if response_format:
+        config["response_format"] = response_format
+
+    messages = build_messages(system_prompt, user_prompt)
+
+    cache = get_response_cache() if use_cache else None
+    if cache:
+        cached_response = cache.get(engine, messages, config)
+        if cached_response is not None:
+            telemetry.record_response_cache_hit()
+            return cached_response
         
     try:
         logger.debug(f"Making OpenAI request with {len(user_prompt)} character prompt")
-        response = client.chat.completions.create(
-            model=engine,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            **config
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
+        started_at = time.monotonic()
+        with telemetry.span('llm_request', model=engine):
+            response = call_with_retries(
+                lambda: get_openai_client().chat.completions.create(
+                    model=engine,
+                    messages=messages,
+                    **config
+                ),
+                estimate_request_tokens(messages, config["max_tokens"])
+            )
+    except LLMRequestError as e:
+        telemetry.record_failure(engine)
         logger.error(f"OpenAI API error: {str(e)}")
-        logger.error(traceback.format_exc())
-        return f"Error processing request: {str(e)}"
+        raise
+
+    record_usage(response, engine, time.monotonic() - started_at)
+    content = (response.choices[0].message.content or '').strip()
+    if cache:
+        cache.set(engine, messages, config, content)
+    return content
+
+def cell_text(value) -> str:
+    """str() of a cell value, writing whole-number floats without '.0' (Ref ID 1, not 1.0).
+
+    pandas reads a numeric column with blanks as floats while openpyxl returns ints, so
+    both parsers format numbers through this to produce the same text.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def clean_cell_value(value) -> str:
+    """Convert a cell value to a stripped string, treating empty cells and NA markers as ''."""
+    if value is None or (isinstance(value, str) and value in PANDAS_NA_STRINGS):
+        return ''
+    text = cell_text(value).strip()
+    return '' if text.lower() == 'nan' else text
+
+def iter_sox_controls_excel(source: Union[str, BinaryIO]) -> Iterator[Dict]:
+    """Lazily yield control dicts from the first sheet using openpyxl read-only mode.
+
+    source is a path or a binary file object (e.g. an upload stream).
+
+    Produces the same controls as parse_sox_controls_excel without loading the sheet into
+    memory.
+    """
+    import openpyxl
 
-def parse_sox_controls_excel(file_path: str) -> List[Dict]:
-    """Parse the uploaded Excel file with SOX control information."""
-    logger.info(f"Parsing SOX controls Excel file: {file_path}")
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        yield from iter_sheet_controls(wb.worksheets[0])
+    finally:
+        wb.close()
+
+def iter_sheet_controls(ws) -> Iterator[Dict]:
+    """Yield the controls of one read-only worksheet; raises ValueError if its columns cannot be mapped."""
+    rows = ws.iter_rows(values_only=True)
+    header = list(next(rows, ()))
+    while header and header[-1] is None:
+        header.pop()
+
+    # Same column mapping as the pandas path: by name if all present, otherwise by position
+    if all(col in header for col in CONTROL_COLUMNS):
+        positions = [header.index(col) for col in CONTROL_COLUMNS]
+    elif len(header) > len(CONTROL_COLUMNS):
+        raise ValueError(f"Length mismatch: expected at most {len(CONTROL_COLUMNS)} columns, got {len(header)}")
+    else:
+        positions = list(range(len(header))) + [None] * (len(CONTROL_COLUMNS) - len(header))
+
+    skipped = 0
+    for row in rows:
+        control = {
+            field: clean_cell_value(row[position]) if position is not None and position < len(row) else ''
+            for field, position in zip(CONTROL_FIELDS, positions)
+        }
+
+        # Only yield if we have meaningful data (ref_id and control_description)
+        if control['ref_id'] and control['control_description']:
+            yield control
+        else:
+            skipped += 1
+
+    logger.debug(f"Skipped {skipped} rows missing ref_id or control_description")
+
+def source_size(source: Union[str, BinaryIO]) -> int:
+    """Size in bytes of a path or a seekable file object (its position is left unchanged)."""
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+def parse_sox_controls_excel(source: Union[str, BinaryIO], filename: Optional[str] = None) -> List[Dict]:
+    """Parse the uploaded Excel file with SOX control information.
+
+    source is a path or a seekable binary file object such as an in-memory upload, in which
+    case filename (the original name) tells .xlsx from .xls. Large .xlsx files are streamed
+    through iter_sox_controls_excel; everything else is read with pandas and cleaned column-wise.
+    """
+    filename = filename or (source if isinstance(source, str) else '')
+    logger.info(f"Parsing SOX controls Excel file: {filename}")
     
     try:
+        import pandas as pd
+
+        if filename.lower().endswith('.xlsx') and source_size(source) > STREAMING_PARSE_THRESHOLD_BYTES:
+            controls = list(iter_sox_controls_excel(source))
+            logger.info(f"Parsed {len(controls)} controls from Excel file (streaming)")
+            return controls
+
         # Read the Excel file
-        df = pd.read_excel(file_path)
-        
-        # Expected columns: Ref ID (A), Control Description (B), Testing Attributes (C), Design Attributes (D), Evidence of Control (E)
-        expected_columns = ['Ref ID', 'Control Description', 'Testing Attributes', 'Design Attributes', 'Evidence of Control']
-        
-        # If columns don't match exactly, try to map them
-        if not all(col in df.columns for col in expected_columns):
-            # Map column positions (assuming A, B, C, D, E structure)
-            df.columns = expected_columns[:len(df.columns)]
-        
-        controls = []
-        for index, row in df.iterrows():
-            # Convert all values to string and handle NaN/None values
-            ref_id = str(row.get('Ref ID', '')).strip()
-            control_desc = str(row.get('Control Description', '')).strip()
-            testing_attrs = str(row.get('Testing Attributes', '')).strip()
-            design_attrs = str(row.get('Design Attributes', '')).strip()
-            evidence_ctrl = str(row.get('Evidence of Control', '')).strip()
-            
-            # Replace 'nan' with empty string (pandas NaN converts to 'nan' when cast to string)
-            if ref_id.lower() == 'nan':
-                ref_id = ''
-            if control_desc.lower() == 'nan':
-                control_desc = ''
-            if testing_attrs.lower() == 'nan':
-                testing_attrs = ''
-            if design_attrs.lower() == 'nan':
-                design_attrs = ''
-            if evidence_ctrl.lower() == 'nan':
-                evidence_ctrl = ''
-                
-            control = {
-                'ref_id': ref_id,
-                'control_description': control_desc,
-                'testing_attributes': testing_attrs,
-                'design_attributes': design_attrs,
-                'evidence_of_control': evidence_ctrl
-            }
-            
-            # Only add if we have meaningful data (ref_id and control_description)
-            if control['ref_id'] and control['control_description']:
-                logger.debug(f"Adding control: {control['ref_id']} - {control['control_description'][:50]}...")
-                controls.append(control)
-            else:
-                logger.debug(f"Skipping row {index} - missing ref_id or control_description")
+        df = pd.read_excel(source)
+        controls = controls_from_dataframe(df)
         
         logger.info(f"Parsed {len(controls)} controls from Excel file")
         return controls
@@ -132,22 +286,8 @@ def parse_sox_controls_excel(file_path: str) -> List[Dict]:
         logger.error(f"Error parsing Excel file: {str(e)}")
         raise
 
-def generate_test_steps_from_control(control_data: Dict) -> Dict:
-    """Generate test steps and attributes for a single control."""
-    
-    # Check if this is an N/A scenario (only Control Description available)
-    testing_attrs = control_data.get('testing_attributes', '').strip().upper()
-    design_attrs = control_data.get('design_attributes', '').strip().upper()
-    evidence_ctrl = control_data.get('evidence_of_control', '').strip().upper()
-    
-    # Enhanced N/A detection - check for various forms of empty/N/A values
-    is_na_scenario = (testing_attrs in ['N/A', 'NA', '', 'NAN', 'NULL'] or 
-                     design_attrs in ['N/A', 'NA', '', 'NAN', 'NULL'] or 
-                     evidence_ctrl in ['N/A', 'NA', '', 'NAN', 'NULL'])
-    
-    if is_na_scenario:
-        # Enhanced creative prompt for N/A scenarios - extrapolate from Control Description
-        system_prompt = """You are a SOX compliance specialist creating test steps for a control where only the Control Description is available.
+# System prompt for controls where only the Control Description is available
+NA_SCENARIO_SYSTEM_PROMPT = """You are a SOX compliance specialist creating test steps for a control where only the Control Description is available.
 
 You must CREATIVELY EXTRAPOLATE appropriate test steps and evidence based SOLELY on the Control Description provided.
 
@@ -216,22 +356,8 @@ Create 4-6 test steps that would logically test this control:
 - Create test steps that mirror the ACTUAL CONTROL ACTIVITIES described
 - Ensure each test step validates a KEY ASPECT of the control described"""
 
-        user_prompt = f"""CREATIVELY ANALYZE this SOX control and extrapolate realistic test steps and evidence:
-
-Control ID: {control_data['ref_id']}
-Control Description: {control_data['control_description']}
-
-Based SOLELY on this control description, you must:
-1. Identify what specific evidence would logically be created by this control process
-2. List that evidence in the "Obtain Evidence" step as A), B), C), D) items
-3. Create realistic test steps that would validate the key elements mentioned in the description
-4. Generate meaningful attributes that test the control's effectiveness
-
-Be as SPECIFIC and REALISTIC as possible - think like an experienced SOX auditor who understands what evidence would actually exist for this type of control."""
-
-    else:
-        # Enhanced detailed prompt for controls with full information
-        system_prompt = """You are a SOX compliance specialist creating detailed test steps and test attributes.
+# System prompt for controls with full testing attribute and evidence information
+FULL_CONTROL_SYSTEM_PROMPT = """You are a SOX compliance specialist creating detailed test steps and test attributes.
 
 ## CRITICAL: DO NOT COPY TESTING ATTRIBUTES VERBATIM
 You must TRANSFORM and REWRITE the testing attributes into proper test step format. 
@@ -329,15 +455,20 @@ Return ONLY a JSON structure:
 - All attribute descriptions must be in past tense from tester perspective
 - Focus on creating ACTIONABLE test steps that auditors can actually perform"""
 
-        user_prompt = f"""TRANSFORM the following SOX control testing attributes into proper test step format:
+# Values treated as an empty/N/A column when deciding how to prompt for a control
+NA_VALUES = ['N/A', 'NA', '', 'NAN', 'NULL']
 
-Control ID: {control_data['ref_id']}
-Control Description: {control_data['control_description']}
-Testing Attributes: {control_data['testing_attributes']}
-Design Attributes: {control_data['design_attributes']}
-Evidence of Control: {control_data['evidence_of_control']}
+# Static instructions for N/A scenario prompts (sent in the system message, see NA_SCENARIO_SYSTEM_MESSAGE)
+NA_SCENARIO_INSTRUCTIONS = """Based SOLELY on the control description provided, you must:
+1. Identify what specific evidence would logically be created by this control process
+2. List that evidence in the "Obtain Evidence" step as A), B), C), D) items
+3. Create realistic test steps that would validate the key elements mentioned in the description
+4. Generate meaningful attributes that test the control's effectiveness
+
+Be as SPECIFIC and REALISTIC as possible - think like an experienced SOX auditor who understands what evidence would actually exist for this type of control."""
 
-CRITICAL INSTRUCTIONS:
+# Static instructions for full control prompts (sent in the system message, see FULL_CONTROL_SYSTEM_MESSAGE)
+FULL_CONTROL_INSTRUCTIONS = """CRITICAL INSTRUCTIONS:
 1. DO NOT copy any testing attribute text verbatim
 2. TRANSFORM each testing attribute (A, B, C, D, E) into a proper test step
 3. Create concise test step names (2-4 words) that capture the core action
@@ -347,291 +478,1065 @@ CRITICAL INSTRUCTIONS:
 
 Example transformation for your reference:
 - Testing Attribute: "Staff obtains statements from sponsors"
-- Becomes Test Step: Name="Inspect Statement Procurement", Description="Inspect evidence that statements were obtained from equity method sponsors for the selected period."
+- Becomes Test Step: Name="Inspect Statement Procurement", Description="Inspect evidence that statements were obtained from equity method sponsors for the selected period.\""""
 
-Now transform ALL the testing attributes for this control following these rules."""
+# Appended to the system prompt when several controls are sent in one request
+BATCH_SYSTEM_PROMPT_SUFFIX = """
+
+## BATCH MODE:
+This request contains several controls, each introduced by a "### Control" heading. Apply every rule above to EACH control independently - never merge or share test steps between controls.
+
+Return ONLY a JSON structure with one entry per control, in the order given:
+```json
+{
+  "controls": [
+    {
+      "control_id": "[Use the Ref ID]",
+      "test_steps": [
+        {
+          "control_id": "[Use the Ref ID]",
+          "name": "Test Step Name",
+          "description": "Detailed description",
+          "attribute_name": "Attribute Name or N/A",
+          "attribute_description": "Detailed attribute description or N/A"
+        }
+      ]
+    }
+  ]
+}
+```"""
+
+# Everything static goes into the system message and only control data into the user message, so
+# every request of a type shares one byte-identical prefix that Azure OpenAI can serve from its
+# prompt cache. Batch prompts extend the same prefix.
+NA_SCENARIO_SYSTEM_MESSAGE = f"{NA_SCENARIO_SYSTEM_PROMPT}\n\n{NA_SCENARIO_INSTRUCTIONS}"
+FULL_CONTROL_SYSTEM_MESSAGE = f"{FULL_CONTROL_SYSTEM_PROMPT}\n\n{FULL_CONTROL_INSTRUCTIONS}"
+
+def controls_from_dataframe(df) -> List[Dict]:
+    """Map a sheet read by pandas to control dicts; raises ValueError if its columns cannot be mapped."""
+    import pandas as pd
+
+    # If columns don't match exactly, try to map them
+    if not all(col in df.columns for col in CONTROL_COLUMNS):
+        # Map column positions (assuming A, B, C, D, E structure)
+        df.columns = CONTROL_COLUMNS[:len(df.columns)]
+    
+    # Convert whole columns to stripped strings; NaN becomes 'nan' when cast, so blank it out
+    cleaned = pd.DataFrame(index=df.index)
+    for column, field in zip(CONTROL_COLUMNS, CONTROL_FIELDS):
+        if column not in df.columns:
+            cleaned[field] = ''
+            continue
+        values = df[column].map(cell_text).str.strip()
+        cleaned[field] = values.mask(values.str.lower() == 'nan', '')
+    
+    # Only keep rows with meaningful data (ref_id and control_description)
+    has_data = (cleaned['ref_id'] != '') & (cleaned['control_description'] != '')
+    logger.debug(f"Skipped {int((~has_data).sum())} rows missing ref_id or control_description")
+    return cleaned[has_data].to_dict('records')
+
+def parse_sox_controls_workbook(source: Union[str, BinaryIO], filename: Optional[str] = None) -> List[Tuple[str, List[Dict]]]:
+    """Parse every sheet of an RCM workbook into (sheet name, controls) pairs.
+
+    Used for RCMs split across sheets (e.g. one per process cycle). Sheets whose columns do
+    not fit the RCM layout (e.g. an instructions tab) are skipped with a warning.
+    """
+    filename = filename or (source if isinstance(source, str) else '')
+    logger.info(f"Parsing every sheet of SOX controls Excel file: {filename}")
+
+    sheets = []
+    if filename.lower().endswith('.xlsx') and source_size(source) > STREAMING_PARSE_THRESHOLD_BYTES:
+        import openpyxl
+
+        wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        try:
+            for ws in wb.worksheets:
+                try:
+                    sheets.append((ws.title, list(iter_sheet_controls(ws))))
+                except ValueError as e:
+                    logger.warning(f"Skipping sheet '{ws.title}' of {filename}: {e}")
+        finally:
+            wb.close()
+    else:
+        import pandas as pd
+
+        for sheet_name, df in pd.read_excel(source, sheet_name=None).items():
+            try:
+                sheets.append((str(sheet_name), controls_from_dataframe(df)))
+            except ValueError as e:
+                logger.warning(f"Skipping sheet '{sheet_name}' of {filename}: {e}")
+
+    logger.info(f"Parsed {sum(len(controls) for _, controls in sheets)} controls from {len(sheets)} sheets of {filename}")
+    return sheets
+
+def is_na_scenario_control(control_data: Dict) -> bool:
+    """Return True if the control lacks testing attributes, design attributes or evidence."""
+    testing_attrs = control_data.get('testing_attributes', '').strip().upper()
+    design_attrs = control_data.get('design_attributes', '').strip().upper()
+    evidence_ctrl = control_data.get('evidence_of_control', '').strip().upper()
+    
+    # Enhanced N/A detection - check for various forms of empty/N/A values
+    return (testing_attrs in NA_VALUES or 
+            design_attrs in NA_VALUES or 
+            evidence_ctrl in NA_VALUES)
+
+def format_control_details(control_data: Dict, is_na_scenario: bool, include_id: bool = True) -> str:
+    """Format the control fields included in a prompt (only the description for N/A scenarios)."""
+    lines = [f"Control ID: {control_data['ref_id']}"] if include_id else []
+    lines.append(f"Control Description: {control_data['control_description']}")
+    if not is_na_scenario:
+        lines.extend([
+            f"Testing Attributes: {control_data['testing_attributes']}",
+            f"Design Attributes: {control_data['design_attributes']}",
+            f"Evidence of Control: {control_data['evidence_of_control']}"
+        ])
+    return '\n'.join(lines)
+
+def build_control_prompts(control_data: Dict) -> Tuple[str, str, bool]:
+    """Build the (system_prompt, user_prompt, is_na_scenario) triple for a single control.
 
-    response = make_openai_request(system_prompt, user_prompt, max_tokens=2500)
+    The system prompt is constant per scenario type; the user prompt carries only the control.
+    """
+    is_na_scenario = is_na_scenario_control(control_data)
     
-    return {
-        'control_id': control_data['ref_id'],
-        'control_description': control_data['control_description'],
-        'ai_generated_content': response,
-        'original_testing_attributes': control_data['testing_attributes'],
-        'original_design_attributes': control_data['design_attributes'],
-        'original_evidence': control_data['evidence_of_control'],
-        'is_na_scenario': is_na_scenario
+    if is_na_scenario:
+        # Enhanced creative prompt for N/A scenarios - extrapolate from Control Description
+        user_prompt = f"""CREATIVELY ANALYZE this SOX control and extrapolate realistic test steps and evidence:
+
+{format_control_details(control_data, is_na_scenario)}"""
+        return NA_SCENARIO_SYSTEM_MESSAGE, user_prompt, is_na_scenario
+
+    # Enhanced detailed prompt for controls with full information
+    user_prompt = f"""TRANSFORM the following SOX control testing attributes into proper test step format:
+
+{format_control_details(control_data, is_na_scenario)}
+
+Now transform ALL the testing attributes for this control following these rules."""
+    return FULL_CONTROL_SYSTEM_MESSAGE, user_prompt, is_na_scenario
+
+@dataclass
+class ProcessedControl:
+    """A parsed control and the AI response generated for it, until its test steps are parsed.
+
+    References the control's row dict instead of copying its fields, and uses __slots__, so
+    the results queued between pipeline stages stay small on 10k-control workbooks.
+    """
+    __slots__ = ('control', 'ai_generated_content', 'is_na_scenario', 'duplicate_of', 'reused')
+
+    control: Dict
+    ai_generated_content: str
+    is_na_scenario: bool
+    # Ref ID of the cluster representative whose response this reuses, if any
+    duplicate_of: Optional[str]
+    # Taken from the workbook's manifest rather than generated in this run
+    reused: bool
+
+    @property
+    def control_id(self) -> str:
+        return self.control['ref_id']
+
+def build_processed_control(control_data: Dict, ai_generated_content: str, is_na_scenario: bool) -> ProcessedControl:
+    """Combine a parsed control with the AI response generated for it."""
+    return ProcessedControl(control_data, ai_generated_content, is_na_scenario, None, False)
+
+def processed_control_from_dict(data: Dict) -> ProcessedControl:
+    """Rebuild a ProcessedControl from its JSON form (as sent back to /export-test-plan)."""
+    control = {
+        'ref_id': data.get('control_id', ''),
+        'control_description': data.get('control_description', ''),
+        'testing_attributes': data.get('original_testing_attributes', ''),
+        'design_attributes': data.get('original_design_attributes', ''),
+        'evidence_of_control': data.get('original_evidence', '')
     }
+    return ProcessedControl(
+        control, data.get('ai_generated_content', ''), data.get('is_na_scenario', False), data.get('duplicate_of'), False
+    )
+
+def build_response_format(name: str, schema: Dict) -> Optional[Dict]:
+    """Build the API response_format for RESPONSE_FORMAT_MODE, or None for plain text."""
+    if RESPONSE_FORMAT_MODE == 'json_schema':
+        return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+    if RESPONSE_FORMAT_MODE == 'json_object':
+        return {"type": "json_object"}
+    return None
+
+def build_repair_prompt(user_prompt: str, response: str, error: Exception) -> str:
+    """Re-ask for a control whose response failed validation, quoting the response and the problem."""
+    return f"""{user_prompt}
+
+Your previous response to this request could not be used: {error}
+
+Previous response:
+{response[:REPAIR_RESPONSE_MAX_CHARS]}
+
+Return ONLY the corrected JSON object with a non-empty "test_steps" array in which every test step has a name and a description."""
 
-def create_excel_template(processed_controls: List[Dict]) -> str:
-    """Create an Excel template with the processed test steps and attributes."""
+def generate_test_steps_from_control(control_data: Dict) -> ProcessedControl:
+    """Generate test steps and attributes for a single control.
+
+    A response that fails validation gets one repair request for this control only; if that
+    also fails, the control falls back to generic steps when rows are written.
+    """
+    system_prompt, user_prompt, is_na_scenario = build_control_prompts(control_data)
+    response_format = build_response_format("test_steps", TEST_STEPS_RESPONSE_SCHEMA)
+    response = make_openai_request(system_prompt, user_prompt, max_tokens=2500, response_format=response_format)
+
+    try:
+        parse_test_steps_response(response)
+    except ValueError as e:
+        logger.warning(f"Invalid response for control {control_data['ref_id']} ({e}); requesting a repair")
+        response = make_openai_request(
+            system_prompt, build_repair_prompt(user_prompt, response, e),
+            max_tokens=2500, response_format=response_format
+        )
+
+    return build_processed_control(control_data, response, is_na_scenario)
+
+def build_batch_prompts(batch: List[Dict], is_na_scenario: bool) -> Tuple[str, str]:
+    """Build one (system_prompt, user_prompt) pair covering several controls of the same scenario type."""
+    control_sections = "\n\n".join(
+        f"### Control {position}\n{format_control_details(control_data, is_na_scenario)}"
+        for position, control_data in enumerate(batch, 1)
+    )
+
+    if is_na_scenario:
+        system_prompt = NA_SCENARIO_SYSTEM_MESSAGE + BATCH_SYSTEM_PROMPT_SUFFIX
+        user_prompt = f"""CREATIVELY ANALYZE each of the following {len(batch)} SOX controls and extrapolate realistic test steps and evidence:
+
+{control_sections}
+
+Return one "controls" entry for EVERY Control ID above."""
+        return system_prompt, user_prompt
+
+    system_prompt = FULL_CONTROL_SYSTEM_MESSAGE + BATCH_SYSTEM_PROMPT_SUFFIX
+    user_prompt = f"""TRANSFORM the testing attributes of each of the following {len(batch)} SOX controls into proper test step format:
+
+{control_sections}
+
+Now transform ALL the testing attributes for EVERY control following these rules and return one "controls" entry per Control ID."""
+    return system_prompt, user_prompt
+
+def generate_test_steps_for_batch(batch: List[Dict]) -> List[ProcessedControl]:
+    """Generate test steps for several controls of the same scenario type in a single request.
+
+    If the response cannot be parsed or is missing a control, the batch is split in half and
+    each half retried; a single control falls back to the per-control prompt.
+    """
+    if len(batch) == 1:
+        return [generate_test_steps_from_control(batch[0])]
+
+    is_na_scenario = is_na_scenario_control(batch[0])
+    system_prompt, user_prompt = build_batch_prompts(batch, is_na_scenario)
+    response = make_openai_request(
+        system_prompt, user_prompt, max_tokens=min(2500 * len(batch), BATCH_MAX_TOKENS),
+        response_format=build_response_format("batch_test_steps", BATCH_RESPONSE_SCHEMA)
+    )
+
+    try:
+        parsed_data = load_json_response(response)
+        steps_by_control = {
+            str(entry['control_id']).strip(): validate_test_steps(entry['test_steps'])
+            for entry in parsed_data['controls']
+        }
+        missing_controls = [control['ref_id'] for control in batch if control['ref_id'] not in steps_by_control]
+        if missing_controls:
+            raise ValueError(f"response is missing controls {missing_controls}")
+
+    except (json.JSONDecodeError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Could not parse batch response for {len(batch)} controls ({e}); splitting and retrying")
+        middle = len(batch) // 2
+        return generate_test_steps_for_batch(batch[:middle]) + generate_test_steps_for_batch(batch[middle:])
+
+    return [
+        build_processed_control(
+            control_data,
+            json.dumps({'test_steps': steps_by_control[control_data['ref_id']]}),
+            is_na_scenario
+        )
+        for control_data in batch
+    ]
+
+def group_controls_into_batches(indexed_controls: List[Tuple[int, Dict]], batch_size: int) -> List[List[Tuple[int, Dict]]]:
+    """Group (index, control) pairs into batches of up to batch_size sharing the same scenario type.
+
+    A batch never holds two controls with the same Ref ID, since responses are keyed by control_id.
+    """
+    batches = []
+    open_batches = {}
+    for index, control in indexed_controls:
+        is_na_scenario = is_na_scenario_control(control)
+        batch = open_batches.setdefault(is_na_scenario, [])
+
+        if any(batched['ref_id'] == control['ref_id'] for _, batched in batch):
+            batches.append(batch)
+            batch = open_batches[is_na_scenario] = []
+
+        batch.append((index, control))
+        if len(batch) >= batch_size:
+            batches.append(open_batches.pop(is_na_scenario))
+
+    batches.extend(batch for batch in open_batches.values() if batch)
+    return batches
+
+def prompt_text_without_id(control_data: Dict) -> str:
+    """The control details sent to the model, minus the Control ID line."""
+    return format_control_details(control_data, is_na_scenario_control(control_data), include_id=False)
+
+def cluster_duplicate_controls(controls: List[Dict]) -> List[List[int]]:
+    """Group controls whose prompts are identical or near-identical apart from the Ref ID.
+
+    Returns clusters of control indices with the representative (earliest row) first.
+    Controls are only clustered with others of the same scenario type, and only when their
+    differences from the representative can be substituted into its test steps.
+    """
+    texts = [prompt_text_without_id(control) for control in controls]
+    groups = [is_na_scenario_control(control) for control in controls]
+    clusters = cluster_texts([normalize_text(text) for text in texts], groups)
+    return split_unsubstitutable(clusters, texts)
+
+def build_duplicate_control(processed_control: ProcessedControl, source_control: Dict, member_control: Dict) -> ProcessedControl:
+    """Reuse the test steps generated for a cluster representative for another member.
+
+    Wording that differs between the two controls (e.g. the entity name) and the Ref ID
+    itself, wherever the steps mention it, are substituted into the generated content; the
+    member's Ref ID also replaces the representative's in each step's control_id when rows
+    are written (see extract_test_steps).
+    """
+    substitutions = text_substitutions(prompt_text_without_id(source_control), prompt_text_without_id(member_control))
+    # Ref IDs under 3 characters (e.g. "1") are left alone, as they would rewrite unrelated numbers
+    if len(source_control['ref_id']) >= 3:
+        substitutions[source_control['ref_id']] = member_control['ref_id']
+    content = apply_substitutions(processed_control.ai_generated_content, substitutions)
+
+    duplicate = build_processed_control(member_control, content, processed_control.is_na_scenario)
+    duplicate.duplicate_of = source_control['ref_id']
+    return duplicate
+
+def iter_processed_controls(controls: List[Dict], max_workers: Optional[int] = None,
+                            batch_size: Optional[int] = None, ready: Optional[Dict[int, ProcessedControl]] = None,
+                            window: Optional[ReorderWindow] = None) -> Iterator[Tuple[int, ProcessedControl]]:
+    """Yield (index, processed_control) pairs in completion order using a bounded thread pool.
+
+    With batch_size > 1, controls are sent in batches of the same scenario type. At most
+    max_workers requests are in flight; the next one is only submitted once a finished
+    result has been handed to the caller. When dedup is enabled, only one control per
+    cluster of duplicates is sent; the other members are yielded once it is done.
+
+    ready holds results already known by index (e.g. from the manifest), which are yielded
+    without a request. With a window, requests are submitted and ready or duplicate results
+    yielded only for indices the window allows, so an in-order consumer's reorder buffer
+    stays bounded; the generator returns early once the window is closed.
+    """
+    if not controls:
+        return
+
+    ready = ready or {}
+    pending = [index for index in range(len(controls)) if index not in ready]
+    # Results waiting for the window: (index, processed_control, index of the control it duplicates or None)
+    waiting: List[Tuple[int, ProcessedControl, Optional[int]]] = [(index, ready[index], None) for index in sorted(ready)]
+
+    members_by_index: Dict[int, List[int]] = {}
+    if DEDUP_ENABLED and pending:
+        with telemetry.span('dedup', controls=len(pending)):
+            clusters = [[pending[i] for i in cluster] for cluster in cluster_duplicate_controls([controls[i] for i in pending])]
+        members_by_index = {cluster[0]: cluster[1:] for cluster in clusters if len(cluster) > 1}
+        if members_by_index:
+            logger.info(f"Dedup: {len(pending)} controls reduced to {len(clusters)} distinct prompts")
+        unique_controls = [(cluster[0], controls[cluster[0]]) for cluster in clusters]
+    else:
+        unique_controls = [(index, controls[index]) for index in pending]
+
+    batch_size = max(1, batch_size or BATCH_SIZE)
+    if batch_size > 1:
+        work_units = group_controls_into_batches(unique_controls, batch_size)
+    else:
+        work_units = [[indexed_control] for indexed_control in unique_controls]
+    # Submit in row order, so the row an in-order consumer waits for is never queued behind later ones
+    work_units.sort(key=lambda unit: unit[0][0])
+
+    workers = max(1, min(max_workers or MAX_CONCURRENT_REQUESTS, len(work_units) or 1))
+    logger.info(f"Processing {len(pending)} controls in {len(work_units)} requests with up to {workers} concurrent requests")
+    def process_unit(unit: List[Tuple[int, Dict]]) -> List[Tuple[int, ProcessedControl]]:
+        indices = [index for index, _ in unit]
+        unit_controls = [control for _, control in unit]
+
+        if len(unit_controls) == 1:
+            logger.info(f"Processing control: {unit_controls[0]['ref_id']}")
+            with telemetry.call_label(unit_controls[0]['ref_id']), telemetry.span('control', control_id=unit_controls[0]['ref_id']):
+                return [(indices[0], generate_test_steps_from_control(unit_controls[0]))]
+
+        ref_ids = ', '.join(c['ref_id'] for c in unit_controls)
+        logger.info(f"Processing batch of {len(unit_controls)} controls: {ref_ids}")
+        with telemetry.call_label(f"batch: {ref_ids}"), telemetry.span('control_batch', control_ids=ref_ids):
+            return list(zip(indices, generate_test_steps_for_batch(unit_controls)))
+
+    def allowed(index: int) -> bool:
+        return window is None or window.allows(index)
+
+    next_unit = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sox-control") as executor:
+        in_flight = set()
+
+        while True:
+            if window is not None and window.closed:
+                for future in in_flight:
+                    future.cancel()
+                return
+
+            while waiting and allowed(waiting[0][0]):
+                index, processed_control, source_index = heapq.heappop(waiting)
+                if source_index is not None:
+                    processed_control = build_duplicate_control(processed_control, controls[source_index], controls[index])
+                yield index, processed_control
+
+            while len(in_flight) < workers and next_unit < len(work_units) and allowed(work_units[next_unit][0][0]):
+                in_flight.add(telemetry.submit_with_context(executor, process_unit, work_units[next_unit]))
+                next_unit += 1
+
+            if not in_flight:
+                if next_unit == len(work_units) and not waiting:
+                    return
+                # Everything allowed so far has been handed over; wait for the consumer to catch up
+                first_blocked = min(work_units[next_unit][0][0] if next_unit < len(work_units) else len(controls),
+                                    waiting[0][0] if waiting else len(controls))
+                window.wait_for(first_blocked, timeout=0.5)
+                continue
+
+            # Poll while a window is set, so requests it allows meanwhile are not held back by a slow one
+            done, _ = wait(in_flight, timeout=0.1 if window is not None else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                for index, processed_control in future.result():
+                    yield index, processed_control
+                    for member_index in members_by_index.get(index, []):
+                        heapq.heappush(waiting, (member_index, processed_control, index))
+
+def control_request_hash(control_data: Dict) -> str:
+    """Hash the model and exact prompts a control would be sent with; any edit or prompt change alters it."""
+    system_prompt, user_prompt, _ = build_control_prompts(control_data)
+    payload = json.dumps([engine, system_prompt, user_prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def manifest_control_keys(controls: List[Dict]) -> List[str]:
+    """Key each control by Ref ID, numbering repeated Ref IDs (R1, R1#2, ...) so every row has its own entry.
+
+    Controls from a batch carry their source sheet, which prefixes the key (Payroll!R1).
+    """
+    seen: Dict[str, int] = {}
+    keys = []
+    for control in controls:
+        key = f"{control['source_sheet']}!{control['ref_id']}" if control.get('source_sheet') else control['ref_id']
+        seen[key] = seen.get(key, 0) + 1
+        keys.append(key if seen[key] == 1 else f"{key}#{seen[key]}")
+    return keys
+
+def iter_processed_controls_incremental(controls: List[Dict], manifest_key: Optional[str],
+                                        max_workers: Optional[int] = None, batch_size: Optional[int] = None,
+                                        window: Optional[ReorderWindow] = None) -> Iterator[Tuple[int, ProcessedControl]]:
+    """iter_processed_controls that reuses results stored for unchanged rows of a re-uploaded workbook.
+
+    manifest_key is the upload's filename; the manifest used is the one of that filename
+    that matches the upload best (see ManifestStore.resolve), so unrelated workbooks with
+    the same name keep separate manifests. Controls whose request hash matches it are
+    yielded straight from the store; only added or edited controls are sent to the model.
+    Each new result is saved as soon as it arrives, so an interrupted run resumes where it
+    stopped. Without a manifest_key (or with the manifest disabled) every control is generated.
+    """
+    manifest = get_manifest_store() if manifest_key else None
+    if manifest is None:
+        yield from iter_processed_controls(controls, max_workers, batch_size, window=window)
+        return
+
+    control_keys = manifest_control_keys(controls)
+    content_hashes = [control_request_hash(control) for control in controls]
+    manifest_key = manifest.resolve(manifest_key, dict(zip(control_keys, content_hashes)))
+    stored = manifest.load(manifest_key)
+
+    reused = {}
+    for index, control in enumerate(controls):
+        previous = stored.get(control_keys[index])
+        if previous and previous[0] == content_hashes[index]:
+            result = previous[1]
+            processed_control = build_processed_control(control, result['ai_generated_content'], result['is_na_scenario'])
+            processed_control.duplicate_of = result.get('duplicate_of')
+            processed_control.reused = True
+            reused[index] = processed_control
+    logger.info(f"Manifest '{manifest_key}': reusing {len(reused)} unchanged controls, generating {len(controls) - len(reused)}")
+
+    for index, processed_control in iter_processed_controls(controls, max_workers, batch_size, reused, window):
+        if not processed_control.reused:
+            # Unparseable responses would otherwise be frozen into fallback steps on every re-upload
+            try:
+                parse_test_steps_response(processed_control.ai_generated_content)
+                manifest.save(manifest_key, control_keys[index], content_hashes[index], {
+                    'ai_generated_content': processed_control.ai_generated_content,
+                    'is_na_scenario': processed_control.is_na_scenario,
+                    'duplicate_of': processed_control.duplicate_of
+                })
+            except ValueError:
+                logger.warning(f"Not storing unparseable response for control {processed_control.control_id} in manifest")
+        yield index, processed_control
+
+    removed = manifest.prune(manifest_key, control_keys)
+    if removed:
+        logger.info(f"Manifest '{manifest_key}': removed {removed} controls no longer in the workbook")
+
+def extract_json_content(ai_content: str) -> str:
+    """Extract the JSON payload from an AI response, with or without a ```json fence."""
+    if '```json' in ai_content:
+        json_start = ai_content.find('```json') + 7
+        json_end = ai_content.find('```', json_start)
+        return ai_content[json_start:json_end].strip()
+
+    # Try to find JSON structure in the response
+    json_start = ai_content.find('{')
+    json_end = ai_content.rfind('}') + 1
+    return ai_content[json_start:json_end]
+
+def load_json_response(ai_content: str):
+    """Parse a response as JSON: directly for structured output, else from a fence or the outermost braces."""
+    try:
+        return json.loads(ai_content)
+    except json.JSONDecodeError:
+        return json.loads(extract_json_content(ai_content))
+
+def validate_test_steps(test_steps) -> List[Dict]:
+    """Check that test_steps is a non-empty list of steps with a name and description.
+
+    Raises:
+        ValueError: Describing the first problem found (used verbatim in repair requests)
+    """
+    if not isinstance(test_steps, list) or not test_steps:
+        raise ValueError('"test_steps" must be a non-empty array')
+
+    for number, step in enumerate(test_steps, 1):
+        if not isinstance(step, dict):
+            raise ValueError(f"test step {number} is not an object")
+        missing = [field for field in ('name', 'description') if not str(step.get(field) or '').strip()]
+        if missing:
+            raise ValueError(f"test step {number} has no {' or '.join(missing)}")
+    return test_steps
+
+def parse_test_steps_response(ai_content: str) -> List[Dict]:
+    """Parse and validate a single-control response into its list of test steps.
+
+    Raises:
+        ValueError: If the response is not JSON or fails validate_test_steps
+    """
+    parsed_data = load_json_response(ai_content)
+    if not isinstance(parsed_data, dict):
+        raise ValueError("response is not a JSON object")
+    return validate_test_steps(parsed_data.get('test_steps'))
+
+def extract_test_steps(processed_control: ProcessedControl) -> List['TestStep']:
+    """Parse the test steps out of a processed control's AI response, falling back to generic steps."""
+    control = processed_control.control
+    control_id = processed_control.control_id
+    ai_content = processed_control.ai_generated_content
+    
+    # Try to parse the JSON response from AI
+    test_steps = []
+
+    try:
+        test_steps = parse_test_steps_response(ai_content)
+
+        # Steps reused from a duplicate control carry the representative's Ref ID
+        if processed_control.duplicate_of:
+            for step in test_steps:
+                step['control_id'] = control_id
+
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.warning(f"Could not parse AI JSON response for control {control_id}: {e}")
+
+        # Check if this was an N/A scenario
+        is_na_scenario = processed_control.is_na_scenario
+
+        if is_na_scenario:
+            # Fallback for N/A scenarios - generic but professional test steps
+            test_steps = [
+                {
+                    'control_id': control_id,
+                    'name': 'Obtain Evidence',
+                    'description': f"For a sample period, obtain evidence of the control described as: {control['control_description'][:100]}...",
+                    'attribute_name': 'N/A',
+                    'attribute_description': 'N/A'
+                },
+                {
+                    'control_id': control_id,
+                    'name': 'Inspect Control Design',
+                    'description': 'Inspect the design of the control to understand the control objective and how it operates.',
+                    'attribute_name': 'Control Design Understanding',
+                    'attribute_description': 'Verified that the control design is appropriate to address the identified risk and achieve the control objective.'
+                },
+                {
+                    'control_id': control_id,
+                    'name': 'Inspect Control Operation',
+                    'description': 'Inspect evidence that the control operated effectively during the period.',
+                    'attribute_name': 'Operating Effectiveness',
+                    'attribute_description': 'Verified that the control operated as designed throughout the testing period by examining supporting documentation.'
+                },
+                {
+                    'control_id': control_id,
+                    'name': 'Verify Control Performance',
+                    'description': 'Verify that the control performer has appropriate authority and competence to execute the control.',
+                    'attribute_name': 'Control Performer Competence',
+                    'attribute_description': 'Verified that the control performer has the appropriate authority, training, and competence to effectively perform the control.'
+                },
+                {
+                    'control_id': control_id,
+                    'name': 'Inspect Documentation',
+                    'description': 'Inspect the completeness and accuracy of documentation supporting the control.',
+                    'attribute_name': 'Documentation Completeness',
+                    'attribute_description': 'Verified that supporting documentation is complete, accurate, and provides sufficient evidence of control performance.'
+                }
+            ]
+        else:
+            # Enhanced fallback for normal scenarios with full control information
+            # Try to extract some basic test steps from the testing attributes
+            original_testing_attrs = control.get('testing_attributes', '')
+            original_evidence = control.get('evidence_of_control', '')
+
+            test_steps = [
+                {
+                    'control_id': control_id,
+                    'name': 'Obtain Evidence',
+                    'description': f"For a sample month, obtain the following evidence: {original_evidence[:200]}{'...' if len(original_evidence) > 200 else ''}",
+                    'attribute_name': 'N/A',
+                    'attribute_description': 'N/A'
+                }
+            ]
+
+            # Try to create basic test steps from testing attributes if available
+            if original_testing_attrs and len(original_testing_attrs.strip()) > 0:
+                # Split by letter markers (A), B), C), etc.)
+                import re
+                attr_pattern = r'[A-Z]\)\s*'
+                attr_items = re.split(attr_pattern, original_testing_attrs)
+                attr_items = [item.strip() for item in attr_items if item.strip()]
+
+                for i, attr_text in enumerate(attr_items[:5]):  # Limit to 5 items
+                    # Extract key action words to create test step names
+                    if 'obtain' in attr_text.lower() or 'receive' in attr_text.lower():
+                        step_name = 'Inspect Document Procurement'
+                        description = 'Inspect evidence that required documents were obtained from appropriate sources.'
+                        attr_name = 'Document Completeness'
+                        attr_desc = 'Verified that all required documents were obtained and are complete.'
+                    elif 'calculat' in attr_text.lower() or 'comput' in attr_text.lower():
+                        step_name = 'Inspect Calculation Process'
+                        description = 'Inspect calculation methodology and verify computational accuracy.'
+                        attr_name = 'Calculation Accuracy'
+                        attr_desc = 'Verified calculation accuracy by reperforming calculations and comparing results.'
+                    elif 'reconcil' in attr_text.lower():
+                        step_name = 'Inspect Reconciliation'
+                        description = 'Inspect the reconciliation process and verify completeness of reconciling items.'
+                        attr_name = 'Reconciliation Completeness'
+                        attr_desc = 'Verified that reconciliation was complete and all variances were appropriately addressed.'
+                    elif 'review' in attr_text.lower() or 'approv' in attr_text.lower():
+                        step_name = 'Inspect Review Evidence'
+                        description = 'Inspect evidence of management review and approval.'
+                        attr_name = 'Management Review'
+                        attr_desc = 'Verified that appropriate management review and approval was performed and documented.'
+                    elif 'verif' in attr_text.lower() or 'validat' in attr_text.lower() or 'ipe' in attr_text.lower():
+                        step_name = 'Inspect Verification Process'
+                        description = 'Inspect evidence of data verification and validation procedures.'
+                        attr_name = 'Data Verification'
+                        attr_desc = 'Verified that data verification procedures were performed and documented appropriately.'
+                    else:
+                        step_name = f'Inspect Control Activity {i+1}'
+                        description = f'Inspect evidence of control activity performance for the selected period.'
+                        attr_name = f'Control Activity {i+1}'
+                        attr_desc = 'Verified that control activity was performed as designed and documented appropriately.'
+
+                    test_steps.append({
+                        'control_id': control_id,
+                        'name': step_name,
+                        'description': description,
+                        'attribute_name': attr_name,
+                        'attribute_description': attr_desc
+                    })
+            else:
+                # Generic fallback test steps when no testing attributes available
+                test_steps.extend([
+                    {
+                        'control_id': control_id,
+                        'name': 'Inspect Control Design',
+                        'description': 'Inspect the design of the control to understand the control objective and how it operates.',
+                        'attribute_name': 'Control Design Understanding',
+                        'attribute_description': 'Verified that the control design is appropriate to address the identified risk and achieve the control objective.'
+                    },
+                    {
+                        'control_id': control_id,
+                        'name': 'Inspect Control Operation',
+                        'description': 'Inspect evidence that the control operated effectively during the period.',
+                        'attribute_name': 'Operating Effectiveness',
+                        'attribute_description': 'Verified that the control operated as designed throughout the testing period by examining supporting documentation.'
+                    },
+                    {
+                        'control_id': control_id,
+                        'name': 'Verify Control Performance',
+                        'description': 'Verify that the control performer has appropriate authority and competence to execute the control.',
+                        'attribute_name': 'Control Performer Competence',
+                        'attribute_description': 'Verified that the control performer has the appropriate authority, training, and competence to effectively perform the control.'
+                    },
+                    {
+                        'control_id': control_id,
+                        'name': 'Inspect Documentation',
+                        'description': 'Inspect the completeness and accuracy of documentation supporting the control.',
+                        'attribute_name': 'Documentation Completeness',
+                        'attribute_description': 'Verified that supporting documentation is complete, accurate, and provides sufficient evidence of control performance.'
+                    }
+                ])
+    
+    return compact_test_steps(test_steps, control_id)
+
+class TestStep(NamedTuple):
+    """One template row; a tuple, so thousands of buffered steps cost no per-step dict."""
+    control_id: str
+    name: str
+    description: str
+    attribute_name: str
+    attribute_description: str
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+def compact_test_steps(test_steps: List[Dict], control_id: str) -> List[TestStep]:
+    """Convert parsed step dicts to TestSteps, dropping any other keys the model returned.
+
+    Ref IDs, step names and attribute texts repeat across controls (and fallback steps are
+    identical), so they are interned; descriptions are mostly unique and kept as they are.
+    """
+    return [
+        TestStep(
+            _intern(step.get('control_id', control_id)),
+            _intern(step.get('name', '')),
+            step.get('description', ''),
+            _intern(step.get('attribute_name', '')),
+            _intern(step.get('attribute_description', ''))
+        )
+        for step in test_steps
+    ]
+
+def create_template_workbook() -> Tuple['Workbook', object]:
+    """Create a write-only workbook with the template sheet and header row."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    return wb, add_template_sheet(wb)
+
+def add_template_sheet(wb, title: str = TEMPLATE_SHEET_TITLE, extra_headers: Sequence[str] = ()):
+    """Add a template sheet with its header row (plus any extra columns) to a write-only workbook."""
+    ws = wb.create_sheet(title)
+    ws.append(TEMPLATE_HEADERS + list(extra_headers))
+    return ws
+
+def template_sheet_titles(names: List[str]) -> List[str]:
+    """Turn source sheet names into unique, valid Excel sheet titles (max 31 characters, no []:*?/\\)."""
+    titles = []
+    used = set()
+    for name in names:
+        base = ''.join('_' if char in '[]:*?/\\' else char for char in name).strip("' ")[:31] or 'Sheet'
+        title, counter = base, 1
+        while title.lower() in used:
+            counter += 1
+            suffix = f" ({counter})"
+            title = base[:31 - len(suffix)] + suffix
+        used.add(title.lower())
+        titles.append(title)
+    return titles
+
+def append_test_step_rows(ws, test_steps: List[TestStep], extra_values: Sequence = ()) -> None:
+    """Append one template row per test step, followed by any extra column values."""
+    for step in test_steps:
+        ws.append([*step, *extra_values])
+
+def save_template_workbook(wb, output: Optional[BinaryIO] = None) -> Optional[str]:
+    """Save the workbook into output (rewound afterwards), or into a new temporary file whose path is returned."""
+    with telemetry.span('save_workbook'):
+        if output is not None:
+            wb.save(output)
+            output.seek(0)
+            return None
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
+            output_path = temp_file.name
+        wb.save(output_path)
+        return output_path
+
+def create_excel_template(processed_controls: List[ProcessedControl], output: Optional[BinaryIO] = None) -> Union[str, BinaryIO]:
+    """Create an Excel template with the processed test steps and attributes.
+
+    Rows are streamed into a write-only workbook, so memory stays flat regardless of row count.
+    The workbook is written into output (and output returned) when given, otherwise into a
+    temporary file whose path is returned.
+    """
     logger.info("Creating Excel template with processed controls")
     
     try:
-        # Create a new workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "SOX Test Steps Template"
-        
-        # Set up headers to match the expected output format
-        headers = [
-            'Control ID',
-            'Test Step Name', 
-            'Test Step Description',
-            'Attribute Name',
-            'Attribute Description'
-        ]
-        
-        # Write headers
-        for col, header in enumerate(headers, 1):
-            ws.cell(row=1, column=col, value=header)
+        wb, ws = create_template_workbook()
         
         # Process each control and extract test steps
-        current_row = 2
-        
         for control in processed_controls:
-            control_id = control['control_id']
-            ai_content = control['ai_generated_content']
-            
-            # Try to parse the JSON response from AI
-            test_steps = []
-            
-            try:
-                # Extract JSON from the AI response
-                if '```json' in ai_content:
-                    json_start = ai_content.find('```json') + 7
-                    json_end = ai_content.find('```', json_start)
-                    json_content = ai_content[json_start:json_end].strip()
-                else:
-                    # Try to find JSON structure in the response
-                    json_start = ai_content.find('{')
-                    json_end = ai_content.rfind('}') + 1
-                    json_content = ai_content[json_start:json_end]
-                
-                parsed_data = json.loads(json_content)
-                test_steps = parsed_data.get('test_steps', [])
-                
-            except (json.JSONDecodeError, ValueError) as e:
-                logger.warning(f"Could not parse AI JSON response for control {control_id}: {e}")
-                
-                # Check if this was an N/A scenario
-                is_na_scenario = control.get('is_na_scenario', False)
-                
-                if is_na_scenario:
-                    # Fallback for N/A scenarios - generic but professional test steps
-                    test_steps = [
-                        {
-                            'control_id': control_id,
-                            'name': 'Obtain Evidence',
-                            'description': f"For a sample period, obtain evidence of the control described as: {control['control_description'][:100]}...",
-                            'attribute_name': 'N/A',
-                            'attribute_description': 'N/A'
-                        },
-                        {
-                            'control_id': control_id,
-                            'name': 'Inspect Control Design',
-                            'description': 'Inspect the design of the control to understand the control objective and how it operates.',
-                            'attribute_name': 'Control Design Understanding',
-                            'attribute_description': 'Verified that the control design is appropriate to address the identified risk and achieve the control objective.'
-                        },
-                        {
-                            'control_id': control_id,
-                            'name': 'Inspect Control Operation',
-                            'description': 'Inspect evidence that the control operated effectively during the period.',
-                            'attribute_name': 'Operating Effectiveness',
-                            'attribute_description': 'Verified that the control operated as designed throughout the testing period by examining supporting documentation.'
-                        },
-                        {
-                            'control_id': control_id,
-                            'name': 'Verify Control Performance',
-                            'description': 'Verify that the control performer has appropriate authority and competence to execute the control.',
-                            'attribute_name': 'Control Performer Competence',
-                            'attribute_description': 'Verified that the control performer has the appropriate authority, training, and competence to effectively perform the control.'
-                        },
-                        {
-                            'control_id': control_id,
-                            'name': 'Inspect Documentation',
-                            'description': 'Inspect the completeness and accuracy of documentation supporting the control.',
-                            'attribute_name': 'Documentation Completeness',
-                            'attribute_description': 'Verified that supporting documentation is complete, accurate, and provides sufficient evidence of control performance.'
-                        }
-                    ]
-                else:
-                    # Enhanced fallback for normal scenarios with full control information
-                    # Try to extract some basic test steps from the testing attributes
-                    original_testing_attrs = control.get('original_testing_attributes', '')
-                    original_evidence = control.get('original_evidence', '')
-                    
-                    test_steps = [
-                        {
-                            'control_id': control_id,
-                            'name': 'Obtain Evidence',
-                            'description': f"For a sample month, obtain the following evidence: {original_evidence[:200]}{'...' if len(original_evidence) > 200 else ''}",
-                            'attribute_name': 'N/A',
-                            'attribute_description': 'N/A'
-                        }
-                    ]
-                    
-                    # Try to create basic test steps from testing attributes if available
-                    if original_testing_attrs and len(original_testing_attrs.strip()) > 0:
-                        # Split by letter markers (A), B), C), etc.)
-                        import re
-                        attr_pattern = r'[A-Z]\)\s*'
-                        attr_items = re.split(attr_pattern, original_testing_attrs)
-                        attr_items = [item.strip() for item in attr_items if item.strip()]
-                        
-                        for i, attr_text in enumerate(attr_items[:5]):  # Limit to 5 items
-                            # Extract key action words to create test step names
-                            if 'obtain' in attr_text.lower() or 'receive' in attr_text.lower():
-                                step_name = 'Inspect Document Procurement'
-                                description = 'Inspect evidence that required documents were obtained from appropriate sources.'
-                                attr_name = 'Document Completeness'
-                                attr_desc = 'Verified that all required documents were obtained and are complete.'
-                            elif 'calculat' in attr_text.lower() or 'comput' in attr_text.lower():
-                                step_name = 'Inspect Calculation Process'
-                                description = 'Inspect calculation methodology and verify computational accuracy.'
-                                attr_name = 'Calculation Accuracy'
-                                attr_desc = 'Verified calculation accuracy by reperforming calculations and comparing results.'
-                            elif 'reconcil' in attr_text.lower():
-                                step_name = 'Inspect Reconciliation'
-                                description = 'Inspect the reconciliation process and verify completeness of reconciling items.'
-                                attr_name = 'Reconciliation Completeness'
-                                attr_desc = 'Verified that reconciliation was complete and all variances were appropriately addressed.'
-                            elif 'review' in attr_text.lower() or 'approv' in attr_text.lower():
-                                step_name = 'Inspect Review Evidence'
-                                description = 'Inspect evidence of management review and approval.'
-                                attr_name = 'Management Review'
-                                attr_desc = 'Verified that appropriate management review and approval was performed and documented.'
-                            elif 'verif' in attr_text.lower() or 'validat' in attr_text.lower() or 'ipe' in attr_text.lower():
-                                step_name = 'Inspect Verification Process'
-                                description = 'Inspect evidence of data verification and validation procedures.'
-                                attr_name = 'Data Verification'
-                                attr_desc = 'Verified that data verification procedures were performed and documented appropriately.'
-                            else:
-                                step_name = f'Inspect Control Activity {i+1}'
-                                description = f'Inspect evidence of control activity performance for the selected period.'
-                                attr_name = f'Control Activity {i+1}'
-                                attr_desc = 'Verified that control activity was performed as designed and documented appropriately.'
-                            
-                            test_steps.append({
-                                'control_id': control_id,
-                                'name': step_name,
-                                'description': description,
-                                'attribute_name': attr_name,
-                                'attribute_description': attr_desc
-                            })
-                    else:
-                        # Generic fallback test steps when no testing attributes available
-                        test_steps.extend([
-                            {
-                                'control_id': control_id,
-                                'name': 'Inspect Control Design',
-                                'description': 'Inspect the design of the control to understand the control objective and how it operates.',
-                                'attribute_name': 'Control Design Understanding',
-                                'attribute_description': 'Verified that the control design is appropriate to address the identified risk and achieve the control objective.'
-                            },
-                            {
-                                'control_id': control_id,
-                                'name': 'Inspect Control Operation',
-                                'description': 'Inspect evidence that the control operated effectively during the period.',
-                                'attribute_name': 'Operating Effectiveness',
-                                'attribute_description': 'Verified that the control operated as designed throughout the testing period by examining supporting documentation.'
-                            },
-                            {
-                                'control_id': control_id,
-                                'name': 'Verify Control Performance',
-                                'description': 'Verify that the control performer has appropriate authority and competence to execute the control.',
-                                'attribute_name': 'Control Performer Competence',
-                                'attribute_description': 'Verified that the control performer has the appropriate authority, training, and competence to effectively perform the control.'
-                            },
-                            {
-                                'control_id': control_id,
-                                'name': 'Inspect Documentation',
-                                'description': 'Inspect the completeness and accuracy of documentation supporting the control.',
-                                'attribute_name': 'Documentation Completeness',
-                                'attribute_description': 'Verified that supporting documentation is complete, accurate, and provides sufficient evidence of control performance.'
-                            }
-                        ])
-            
-            # Add each test step to the Excel
-            for step in test_steps:
-                # Use control_id from step if available, otherwise use the control_id from the loop
-                step_control_id = step.get('control_id', control_id)
-                ws.cell(row=current_row, column=1, value=step_control_id)
-                ws.cell(row=current_row, column=2, value=step.get('name', ''))
-                ws.cell(row=current_row, column=3, value=step.get('description', ''))
-                ws.cell(row=current_row, column=4, value=step.get('attribute_name', ''))
-                ws.cell(row=current_row, column=5, value=step.get('attribute_description', ''))
-                current_row += 1
+            with telemetry.span('parse_response'):
+                test_steps = extract_test_steps(control)
+            with telemetry.span('write_rows'):
+                append_test_step_rows(ws, test_steps)
         
         # Save the workbook
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-            output_path = temp_file.name
-        
-        wb.save(output_path)
-        logger.info(f"Excel template created: {output_path}")
-        return output_path
+        output_path = save_template_workbook(wb, output)
+        logger.info(f"Excel template created: {output_path or 'in memory'}")
+        return output_path or output
         
     except Exception as e:
         logger.error(f"Error creating Excel template: {str(e)}")
         raise
 
-def generate_test_steps(file_paths: List[str], template: str = '') -> Dict:
-    """Main function to process Excel file with SOX controls and generate test steps."""
-    logger.info(f"Processing SOX controls Excel file: {file_paths[0]}")
+def parse_processed_control(result: Tuple[int, ProcessedControl]) -> Tuple[int, str, List[TestStep], bool]:
+    """Pipeline stage: turn (index, processed_control) into (index, control_id, test_steps, reused).
+
+    The raw AI response is dropped here, so it is only held until its steps are parsed.
+    """
+    index, processed_control = result
+    with telemetry.span('parse_response'):
+        test_steps = extract_test_steps(processed_control)
+    return index, processed_control.control_id, test_steps, processed_control.reused
+
+def iter_parsed_controls(controls: List[Dict], max_workers: Optional[int] = None, batch_size: Optional[int] = None,
+                         manifest_key: Optional[str] = None,
+                         window: Optional[ReorderWindow] = None) -> Iterator[Tuple[int, str, List[TestStep], bool]]:
+    """Yield parse_processed_control results in completion order.
+
+    Generation and response parsing run as separate stages on their own threads, connected
+    by queues of at most PIPELINE_QUEUE_SIZE results. A slow consumer blocks the parse
+    stage, which stops the generate stage from submitting further requests. A consumer
+    writing rows in order passes a window it advances as it writes, so results waiting
+    behind a slow early control are bounded too.
+    """
+    generated = run_stage(
+        iter_processed_controls_incremental(controls, manifest_key, max_workers, batch_size, window),
+        maxsize=PIPELINE_QUEUE_SIZE, name='generate'
+    )
+    return run_stage(generated, parse_processed_control, maxsize=PIPELINE_QUEUE_SIZE, name='parse-response')
+
+def generate_test_steps(file_paths: List[Union[str, BinaryIO]], template: str = '', max_workers: Optional[int] = None,
+                        progress_callback: Optional[Callable[[int, int], None]] = None,
+                        batch_size: Optional[int] = None, manifest_key: Optional[str] = None,
+                        filename: Optional[str] = None, output: Optional[BinaryIO] = None) -> Dict:
+    """Main function to process Excel file with SOX controls and generate test steps.
+
+    Runs the same pipeline as stream_test_steps, so template rows are written as responses
+    arrive. manifest_key names the workbook (normally its original filename) for incremental
+    re-generation: only controls changed since its last upload are sent to the model.
+    file_paths entries may be file objects and output a file object for the template, as in
+    stream_test_steps; the result only carries excelTemplatePath when output is not given.
+    """
+    logger.info(f"Processing SOX controls Excel file: {filename or file_paths[0]}")
     
     try:
         # Only process the first file (should be Excel)
         excel_file_path = file_paths[0]
         
-        # Parse the Excel file to extract control information
-        controls = parse_sox_controls_excel(excel_file_path)
-        
-        if not controls:
-            raise ValueError("No controls found in the Excel file")
-        
-        # Process each control to generate test steps
-        processed_controls = []
-        for control in controls:
-            logger.info(f"Processing control: {control['ref_id']}")
-            processed_control = generate_test_steps_from_control(control)
-            processed_controls.append(processed_control)
-        
-        # Create Excel template with all processed controls
-        excel_template_path = create_excel_template(processed_controls)
-        
-        # Return structured response
-        result = {
-            'id': datetime.now().strftime('%Y%m%d_%H%M%S'),
-            'controlName': f'SOX Controls Processing - {len(controls)} controls',
-            'controlsProcessed': len(controls),
-            'excelTemplatePath': excel_template_path,
-            'processedControls': processed_controls,
-            'createdAt': datetime.now().isoformat()
-        }
-        
-        logger.info(f"Successfully processed {len(controls)} controls")
-        return result
+        events = stream_test_steps(excel_file_path, max_workers, batch_size, manifest_key, filename, output)
+        return collect_test_steps_result(events, progress_callback)
         
     except Exception as e:
         logger.error(f"Error processing SOX controls: {str(e)}")
         raise
 
-def export_test_plan_to_word(test_plan_data: Dict) -> str:
-    """Export processed controls as Excel file (not Word for this use case)."""
+def generate_test_steps_batch(uploads: List[Tuple[Union[str, BinaryIO], str]], layout: str = 'combined',
+                              max_workers: Optional[int] = None,
+                              progress_callback: Optional[Callable[[int, int], None]] = None,
+                              batch_size: Optional[int] = None, manifest_key: Optional[str] = None,
+                              output: Optional[BinaryIO] = None) -> Dict:
+    """Process every sheet of every uploaded workbook as one run (see stream_batch_test_steps)."""
+    logger.info(f"Processing batch of {len(uploads)} SOX controls Excel files")
+
+    try:
+        events = stream_batch_test_steps(uploads, layout, max_workers, batch_size, manifest_key, output)
+        return collect_test_steps_result(events, progress_callback)
+
+    except Exception as e:
+        logger.error(f"Error processing SOX controls batch: {str(e)}")
+        raise
+
+def collect_test_steps_result(events: Iterator[Dict], progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict:
+    """Drain a stream of test step events into the result dict returned by generate_test_steps."""
+    for event in events:
+        if event['event'] == 'start':
+            sheets = event['sheets']
+            if progress_callback:
+                progress_callback(0, event['total'])
+        elif event['event'] == 'control' and progress_callback:
+            progress_callback(event['completed'], event['total'])
+        elif event['event'] == 'complete':
+            complete = event
+    
+    controls_processed = complete['controlsProcessed']
+    result = {
+        'id': datetime.now().strftime('%Y%m%d_%H%M%S'),
+        'controlName': f'SOX Controls Processing - {controls_processed} controls',
+        'controlsProcessed': controls_processed,
+        'controlsReused': complete['controlsReused'],
+        'sheets': sheets,
+        'usage': complete['usage'],
+        'timings': complete['timings'],
+        'createdAt': datetime.now().isoformat()
+    }
+    if 'excelTemplatePath' in complete:
+        result['excelTemplatePath'] = complete['excelTemplatePath']
+    
+    logger.info(f"Successfully processed {controls_processed} controls")
+    return result
+
+def stream_test_steps(file_path: Union[str, BinaryIO], max_workers: Optional[int] = None,
+                      batch_size: Optional[int] = None, manifest_key: Optional[str] = None,
+                      filename: Optional[str] = None, output: Optional[BinaryIO] = None) -> Iterator[Dict]:
+    """Generate test steps and yield an event for each control as soon as its response is parsed.
+
+    Events are yielded in completion order. Rows are appended to a write-only workbook in the
+    original RCM order through a reorder buffer, so only parsed steps of out-of-order results
+    are held in memory. manifest_key enables incremental re-generation as in generate_test_steps.
+
+    file_path may also be a file object holding the upload, with filename its original name.
+    The template is written into output when given; otherwise the final 'complete' event
+    carries the path of the saved Excel template.
+    """
+    filename = filename or (os.path.basename(file_path) if isinstance(file_path, str) else 'upload')
+    logger.info(f"Streaming SOX test steps for Excel file: {filename}")
+
+    with telemetry.track_run('workbook', filename) as run:
+        with telemetry.span('parse_workbook'):
+            controls = parse_sox_controls_excel(file_path, filename)
+        if not controls:
+            raise ValueError("No controls found in the Excel file")
+
+        yield from stream_sheet_test_steps([(filename, controls)], run, max_workers, batch_size, manifest_key, output)
+
+def stream_batch_test_steps(uploads: List[Tuple[Union[str, BinaryIO], str]], layout: str = 'combined',
+                            max_workers: Optional[int] = None, batch_size: Optional[int] = None,
+                            manifest_key: Optional[str] = None, output: Optional[BinaryIO] = None) -> Iterator[Dict]:
+    """stream_test_steps for every sheet of every uploaded workbook, processed as one run.
+
+    uploads are (path or file object, original filename) pairs. All controls share one
+    worker pool, dedup pass and manifest (keyed per source sheet), so a batch of small
+    workbooks keeps every worker busy instead of running file by file. layout 'combined'
+    writes all rows to one template sheet with a Source Sheet column; 'sheets' writes one
+    template sheet per source sheet.
+    """
+    if layout not in BATCH_LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}', expected one of {', '.join(BATCH_LAYOUTS)}")
+
+    with telemetry.track_run('batch', ', '.join(filename for _, filename in uploads)) as run:
+        sheets = []
+        for source, filename in uploads:
+            with telemetry.span('parse_workbook', filename=filename):
+                workbook_sheets = parse_sox_controls_workbook(source, filename)
+            for sheet_name, controls in workbook_sheets:
+                if not controls:
+                    continue
+                # Prefix sheet names with their workbook once several workbooks are combined
+                name = sheet_name if len(uploads) == 1 else f"{os.path.splitext(filename)[0]} - {sheet_name}"
+                for control in controls:
+                    control['source_sheet'] = name
+                sheets.append((name, controls))
+
+        if not sheets:
+            raise ValueError("No controls found in the uploaded Excel files")
+
+        yield from stream_sheet_test_steps(sheets, run, max_workers, batch_size, manifest_key, output, layout)
+
+def stream_sheet_test_steps(sheets: List[Tuple[str, List[Dict]]], run: telemetry.RunStats,
+                            max_workers: Optional[int] = None, batch_size: Optional[int] = None,
+                            manifest_key: Optional[str] = None, output: Optional[BinaryIO] = None,
+                            layout: str = 'combined') -> Iterator[Dict]:
+    """Generate test steps for the controls of one or more (sheet name, controls) pairs and yield events.
+
+    Shared by stream_test_steps (a single sheet) and stream_batch_test_steps. Rows are written
+    in sheet and row order through a reorder buffer, into one template sheet ('combined',
+    with a Source Sheet column when there are several sheets) or one per sheet ('sheets').
+    """
+    from openpyxl import Workbook
+
+    controls = [control for _, sheet_controls in sheets for control in sheet_controls]
+    sheet_of = [position for position, (_, sheet_controls) in enumerate(sheets) for _ in sheet_controls]
+
+    total = len(controls)
+    yield {
+        'event': 'start',
+        'total': total,
+        'sheets': [{'name': name, 'controls': len(sheet_controls)} for name, sheet_controls in sheets]
+    }
+
+    wb = Workbook(write_only=True)
+    if layout == 'sheets':
+        titles = template_sheet_titles([name for name, _ in sheets])
+        targets = [(add_template_sheet(wb, title), ()) for title in titles]
+    elif len(sheets) > 1:
+        ws = add_template_sheet(wb, extra_headers=[SOURCE_SHEET_HEADER])
+        targets = [(ws, (name,)) for name, _ in sheets]
+    else:
+        targets = [(add_template_sheet(wb), ())]
+
+    # Controls are only started up to SOX_PIPELINE_QUEUE_SIZE rows (or one round of requests)
+    # past the next row to write, so a slow early control cannot make the buffer grow unbounded
+    window = ReorderWindow(max(PIPELINE_QUEUE_SIZE, (max_workers or MAX_CONCURRENT_REQUESTS) * max(1, batch_size or BATCH_SIZE)))
+    buffered_rows = {}
+    next_index = 0
+    reused = 0
+    results = iter_parsed_controls(controls, max_workers, batch_size, manifest_key, window)
+    try:
+        for completed, (index, control_id, test_steps, was_reused) in enumerate(results, 1):
+            reused += 1 if was_reused else 0
+
+            yield {
+                'event': 'control',
+                'index': index,
+                'completed': completed,
+                'total': total,
+                'controlId': control_id,
+                'testSteps': [step._asdict() for step in test_steps]
+            }
+
+            # Flush every contiguous result starting at the next row we expect to write
+            buffered_rows[index] = test_steps
+            with telemetry.span('write_rows'):
+                while next_index in buffered_rows:
+                    ws, extra_values = targets[sheet_of[next_index]]
+                    append_test_step_rows(ws, buffered_rows.pop(next_index), extra_values)
+                    next_index += 1
+            window.advance(next_index)
+    finally:
+        window.close()
+
+    output_path = save_template_workbook(wb, output)
+    logger.info(f"Streamed Excel template created: {output_path or 'in memory'}")
+
+    complete = {
+        'event': 'complete',
+        'controlsProcessed': total,
+        'controlsReused': reused,
+        'usage': run.summary(),
+        'timings': run.timings()
+    }
+    if output_path:
+        complete['excelTemplatePath'] = output_path
+    yield complete
+
+def export_test_plan_to_word(test_plan_data: Dict, output: BinaryIO) -> BinaryIO:
+    """Export processed controls as Excel file (not Word for this use case).
+
+    The template is always rebuilt from processedControls and written into output; paths
+    sent by the client are never read.
+    """
     logger.info("Exporting test plan as Excel template")
     
     try:
-        # If we already have an Excel template path, return it
-        if 'excelTemplatePath' in test_plan_data:
-            return test_plan_data['excelTemplatePath']
-        
-        # Otherwise, recreate the Excel template
         if 'processedControls' in test_plan_data:
-            return create_excel_template(test_plan_data['processedControls'])
+            processed_controls = [processed_control_from_dict(control) for control in test_plan_data['processedControls']]
+            return create_excel_template(processed_controls, output)
         
         raise ValueError("No processed controls data found")
         
     except Exception as e:
         logger.error(f"Error exporting test plan: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
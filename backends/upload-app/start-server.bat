@@ -36,7 +36,7 @@ if not exist "venv\" (
 
     echo Installing required packages...
     "%PYTHON_PATH%" -m pip install python-dotenv flask flask-cors python-docx openpyxl
-    "%PYTHON_PATH%" -m pip install openai==0.28 --force-reinstall
+    "%PYTHON_PATH%" -m pip install "openai>=1.17,<4" h2
 
     :: Show updated package list
     echo.
@@ -0,0 +1,454 @@
+"""Token, latency and retry telemetry for Azure OpenAI calls.
+
+Every request is recorded twice: into process-wide counters exposed at /metrics in
+Prometheus text format, and into the RunStats of the run it belongs to (one uploaded
+workbook or transcript), which is summarized in the run's result.
+
+With TELEMETRY_METRICS_DIR set (gunicorn.conf.py sets it for its workers), each process
+also writes its counters to <pid>.json in that directory and /metrics sums the files of
+all processes, so every worker serves the same totals. Files of exited workers are kept,
+so the totals do not drop when a worker is replaced.
+
+The current run and call label travel in contextvars; use submit_with_context when
+handing work to a thread pool so worker threads report into the caller's run.
+
+Stages of a run are timed with span(). Span durations are summed per name into the run's
+timings; with TELEMETRY_TRACE_PATH set, every span is also appended to that file as an
+OpenTelemetry-style JSON line, and with TELEMETRY_OTEL enabled it is forwarded to the
+opentelemetry tracer when that package is installed.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager, ExitStack
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Span configuration (override through environment variables)
+SPANS_ENABLED = os.getenv("TELEMETRY_SPANS_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACE_PATH = os.getenv("TELEMETRY_TRACE_PATH", "")
+OTEL_ENABLED = os.getenv("TELEMETRY_OTEL", "false").lower() in ("1", "true", "yes")
+SERVICE_NAME = os.getenv("TELEMETRY_SERVICE_NAME", "sox-upload-app")
+
+# Directory shared by the worker processes for /metrics (empty: this process only)
+METRICS_DIR = os.getenv("TELEMETRY_METRICS_DIR", "")
+
+# Upper bounds (seconds) of the request duration histogram buckets
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# Number of slowest calls kept per run
+SLOWEST_CALLS_KEPT = 5
+
+TOKEN_TYPES = ('prompt', 'cached', 'completion')
+
+
+class RunStats:
+    """Usage and latency accumulated by the calls of one run."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.response_cache_hits = 0
+        self.tokens = {token_type: 0 for token_type in TOKEN_TYPES}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.models = set()
+        self.slowest_calls: List[Tuple[float, str]] = []
+        self.trace_id = os.urandom(16).hex()
+        # Span name -> [count, total seconds, max seconds]
+        self.spans: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add_request(self, model: str, tokens: Dict[str, int], latency: float, label: Optional[str]) -> None:
+        with self._lock:
+            self.requests += 1
+            self.models.add(model)
+            for token_type in TOKEN_TYPES:
+                self.tokens[token_type] += tokens.get(token_type, 0)
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+            if label:
+                self.slowest_calls.append((latency, label))
+                self.slowest_calls.sort(reverse=True)
+                del self.slowest_calls[SLOWEST_CALLS_KEPT:]
+
+    def add_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def add_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def add_response_cache_hit(self) -> None:
+        with self._lock:
+            self.response_cache_hits += 1
+
+    def add_span(self, name: str, seconds: float) -> None:
+        with self._lock:
+            totals = self.spans.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+    def timings(self) -> Dict:
+        """Return time spent per span name; spans of concurrent work (e.g. llm_request) can add up to more than the wall time."""
+        with self._lock:
+            return {
+                'wallSeconds': round(time.monotonic() - self.started_at, 3),
+                'spans': {
+                    name: {'count': count, 'totalSeconds': round(total, 3), 'maxSeconds': round(longest, 3)}
+                    for name, (count, total, longest) in sorted(self.spans.items(), key=lambda item: -item[1][1])
+                }
+            }
+
+    def summary(self) -> Dict:
+        """Return the run's usage in the camelCase shape used by API results."""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'failedRequests': self.failures,
+                'retries': self.retries,
+                'responseCacheHits': self.response_cache_hits,
+                'promptTokens': self.tokens['prompt'],
+                'cachedPromptTokens': self.tokens['cached'],
+                'completionTokens': self.tokens['completion'],
+                'models': sorted(self.models),
+                'wallSeconds': round(time.monotonic() - self.started_at, 3),
+                'averageLatencySeconds': round(self.latency_total / self.requests, 3) if self.requests else 0,
+                'maxLatencySeconds': round(self.latency_max, 3),
+                'slowestCalls': [
+                    {'label': label, 'latencySeconds': round(latency, 3)}
+                    for latency, label in self.slowest_calls
+                ]
+            }
+
+
+class _ProcessMetrics:
+    """Process-wide counters and latency histogram rendered by render_prometheus."""
+
+    def __init__(self):
+        self.requests: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self.retries: Dict[str, int] = {}
+        self.tokens: Dict[Tuple[str, str], int] = {}
+        self.latency_buckets: Dict[str, List[int]] = {}
+        self.latency_sum: Dict[str, float] = {}
+        self.response_cache_hits = 0
+        self.runs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Dict:
+        """Return the counters as a JSON-serializable dict; call with _lock held."""
+        return {
+            'requests': dict(self.requests),
+            'failures': dict(self.failures),
+            'retries': dict(self.retries),
+            'tokens': [[model, token_type, n] for (model, token_type), n in self.tokens.items()],
+            'latencyBuckets': {model: list(buckets) for model, buckets in self.latency_buckets.items()},
+            'latencySum': dict(self.latency_sum),
+            'responseCacheHits': self.response_cache_hits,
+            'runs': dict(self.runs)
+        }
+
+    def merge(self, snapshot: Dict) -> None:
+        """Add the counters of another process's snapshot to these."""
+        for name, totals in (('requests', self.requests), ('failures', self.failures),
+                             ('retries', self.retries), ('latencySum', self.latency_sum), ('runs', self.runs)):
+            for key, n in snapshot.get(name, {}).items():
+                totals[key] = totals.get(key, 0) + n
+        for model, token_type, n in snapshot.get('tokens', []):
+            self.tokens[(model, token_type)] = self.tokens.get((model, token_type), 0) + n
+        for model, counts in snapshot.get('latencyBuckets', {}).items():
+            buckets = self.latency_buckets.setdefault(model, [0] * len(LATENCY_BUCKETS))
+            for i, count in enumerate(counts[:len(buckets)]):
+                buckets[i] += count
+        self.response_cache_hits += snapshot.get('responseCacheHits', 0)
+
+
+_metrics = _ProcessMetrics()
+# Serializes snapshot writes so the newest snapshot is always the one left on disk
+_metrics_write_lock = threading.Lock()
+_current_run: contextvars.ContextVar[Optional[RunStats]] = contextvars.ContextVar('telemetry_run', default=None)
+_current_label: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('telemetry_label', default=None)
+# (trace id, span id) of the innermost open span
+_current_span: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar('telemetry_span', default=None)
+
+
+class _SpanFileExporter:
+    """Appends finished spans to a file, one OTLP/JSON-style span object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, record: Dict) -> None:
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+_span_exporter: Optional[_SpanFileExporter] = _SpanFileExporter(TRACE_PATH) if TRACE_PATH else None
+_otel_tracer = None
+_otel_checked = False
+
+
+def _get_otel_tracer():
+    """The opentelemetry tracer when TELEMETRY_OTEL is on and opentelemetry-api is installed, else None."""
+    global _otel_tracer, _otel_checked
+    if not OTEL_ENABLED or _otel_checked:
+        return _otel_tracer
+
+    _otel_checked = True
+    try:
+        from opentelemetry import trace
+        _otel_tracer = trace.get_tracer(SERVICE_NAME)
+    except ImportError:
+        logger.warning("TELEMETRY_OTEL is enabled but opentelemetry-api is not installed; spans are not forwarded")
+    return _otel_tracer
+
+
+@contextmanager
+def track_run(kind: str, name: str = '') -> Iterator[RunStats]:
+    """Collect every call made inside the block (and threads started with submit_with_context) into one RunStats."""
+    stats = RunStats(name or kind)
+    token = _current_run.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_run.reset(token)
+        with _metrics._lock:
+            _metrics.runs[kind] = _metrics.runs.get(kind, 0) + 1
+        _publish_metrics()
+        summary = stats.summary()
+        logger.info(
+            f"{kind} run '{stats.name}': {summary['requests']} requests, {summary['promptTokens']} prompt "
+            f"({summary['cachedPromptTokens']} cached) / {summary['completionTokens']} completion tokens, "
+            f"{summary['retries']} retries, {summary['wallSeconds']}s"
+        )
+        spans = stats.timings()['spans']
+        if spans:
+            logger.info(f"{kind} run '{stats.name}' timings: " + ', '.join(
+                f"{name} {timing['totalSeconds']}s/{timing['count']}" for name, timing in spans.items()
+            ))
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    """Time the block as a named stage of the current run (e.g. parse_workbook, llm_request).
+
+    Spans nest through contextvars, so spans opened in threads started with
+    submit_with_context get the caller's span as parent. Outside a run, and with no trace
+    file or OpenTelemetry export configured, this does nothing.
+    """
+    run = _current_run.get()
+    tracer = _get_otel_tracer()
+    if not SPANS_ENABLED or (run is None and _span_exporter is None and tracer is None):
+        yield
+        return
+
+    parent = _current_span.get()
+    trace_id = parent[0] if parent else (run.trace_id if run else os.urandom(16).hex())
+    span_id = os.urandom(8).hex()
+    token = _current_span.set((trace_id, span_id))
+    started_ns = time.time_ns()
+    started = time.perf_counter()
+    status = 'OK'
+    try:
+        with ExitStack() as stack:
+            if tracer is not None:
+                stack.enter_context(tracer.start_as_current_span(name, attributes=attributes))
+            yield
+    except BaseException:
+        status = 'ERROR'
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _current_span.reset(token)
+        if run is not None:
+            run.add_span(name, duration)
+        if _span_exporter is not None:
+            _span_exporter.export({
+                'traceId': trace_id,
+                'spanId': span_id,
+                'parentSpanId': parent[1] if parent else '',
+                'name': name,
+                'startTimeUnixNano': started_ns,
+                'endTimeUnixNano': started_ns + int(duration * 1e9),
+                'resource': {'service.name': SERVICE_NAME},
+                'attributes': {'run.name': run.name if run else '', **attributes},
+                'status': {'code': status}
+            })
+
+
+@contextmanager
+def call_label(label: str) -> Iterator[None]:
+    """Attribute calls made inside the block to label (e.g. a control ID) for slow-call reporting."""
+    token = _current_label.set(label)
+    try:
+        yield
+    finally:
+        _current_label.reset(token)
+
+
+def submit_with_context(executor, fn: Callable, *args, **kwargs):
+    """executor.submit that runs fn in a copy of the caller's context, keeping the current run."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def current_run() -> Optional[RunStats]:
+    return _current_run.get()
+
+
+def _publish_metrics() -> None:
+    """Write this process's counters to TELEMETRY_METRICS_DIR for the other workers' /metrics."""
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    try:
+        with _metrics_write_lock:
+            with _metrics._lock:
+                snapshot = _metrics.snapshot()
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {path}: {e}")
+
+
+def clear_metrics_dir() -> None:
+    """Remove the counters left in TELEMETRY_METRICS_DIR by an earlier server; call before workers start."""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        if filename.endswith(('.json', '.tmp')):
+            try:
+                os.remove(os.path.join(METRICS_DIR, filename))
+            except OSError:
+                pass
+
+
+def _collect_metrics() -> _ProcessMetrics:
+    """Sum the snapshots of every process in TELEMETRY_METRICS_DIR, or return this process's counters."""
+    if not METRICS_DIR:
+        return _metrics
+
+    _publish_metrics()
+    totals = _ProcessMetrics()
+    try:
+        filenames = sorted(os.listdir(METRICS_DIR))
+    except OSError:
+        filenames = []
+    for filename in filenames:
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename), encoding='utf-8') as f:
+                totals.merge(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics file {filename}: {e}")
+    return totals
+
+
+def record_request(model: str, tokens: Dict[str, int], latency: float) -> None:
+    """Record one successful chat completion request."""
+    with _metrics._lock:
+        _metrics.requests[model] = _metrics.requests.get(model, 0) + 1
+        for token_type in TOKEN_TYPES:
+            key = (model, token_type)
+            _metrics.tokens[key] = _metrics.tokens.get(key, 0) + tokens.get(token_type, 0)
+
+        buckets = _metrics.latency_buckets.setdefault(model, [0] * len(LATENCY_BUCKETS))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                buckets[i] += 1
+        _metrics.latency_sum[model] = _metrics.latency_sum.get(model, 0.0) + latency
+    _publish_metrics()
+
+    run = _current_run.get()
+    if run:
+        run.add_request(model, tokens, latency, _current_label.get())
+
+
+def record_retry(reason: str) -> None:
+    """Record a retried attempt; reason is the HTTP status or error type."""
+    with _metrics._lock:
+        _metrics.retries[reason] = _metrics.retries.get(reason, 0) + 1
+    _publish_metrics()
+    run = _current_run.get()
+    if run:
+        run.add_retry()
+
+
+def record_failure(model: str) -> None:
+    """Record a request that failed permanently."""
+    with _metrics._lock:
+        _metrics.failures[model] = _metrics.failures.get(model, 0) + 1
+    _publish_metrics()
+    run = _current_run.get()
+    if run:
+        run.add_failure()
+
+
+def record_response_cache_hit() -> None:
+    """Record a request answered from the local response cache without calling the API."""
+    with _metrics._lock:
+        _metrics.response_cache_hits += 1
+    _publish_metrics()
+    run = _current_run.get()
+    if run:
+        run.add_response_cache_hit()
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus() -> str:
+    """Render metrics in the Prometheus text exposition format, summed across workers when TELEMETRY_METRICS_DIR is set."""
+    lines = []
+
+    def metric(name: str, metric_type: str, help_text: str, samples: List[Tuple[str, object]]) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+
+    metrics = _collect_metrics()
+    with metrics._lock:
+        metric('llm_requests_total', 'counter', 'Successful chat completion requests.',
+               [(f'{{model="{_escape(m)}"}}', n) for m, n in sorted(metrics.requests.items())])
+        metric('llm_request_failures_total', 'counter', 'Chat completion requests that failed permanently.',
+               [(f'{{model="{_escape(m)}"}}', n) for m, n in sorted(metrics.failures.items())])
+        metric('llm_request_retries_total', 'counter', 'Retried chat completion attempts by reason.',
+               [(f'{{reason="{_escape(r)}"}}', n) for r, n in sorted(metrics.retries.items())])
+        metric('llm_tokens_total', 'counter', 'Tokens reported by the API (cached is a subset of prompt).',
+               [(f'{{model="{_escape(m)}",type="{t}"}}', n) for (m, t), n in sorted(metrics.tokens.items())])
+        metric('llm_response_cache_hits_total', 'counter', 'Requests answered from the local response cache.',
+               [('', metrics.response_cache_hits)])
+        metric('llm_runs_total', 'counter', 'Completed runs (workbooks or transcripts processed) by kind.',
+               [(f'{{kind="{_escape(k)}"}}', n) for k, n in sorted(metrics.runs.items())])
+
+        lines.append('# HELP llm_request_duration_seconds Chat completion latency including retries.')
+        lines.append('# TYPE llm_request_duration_seconds histogram')
+        for model, buckets in sorted(metrics.latency_buckets.items()):
+            label = _escape(model)
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f'llm_request_duration_seconds_bucket{{model="{label}",le="{bound}"}} {count}')
+            lines.append(f'llm_request_duration_seconds_bucket{{model="{label}",le="+Inf"}} {metrics.requests.get(model, 0)}')
+            lines.append(f'llm_request_duration_seconds_sum{{model="{label}"}} {round(metrics.latency_sum[model], 6)}')
+            lines.append(f'llm_request_duration_seconds_count{{model="{label}"}} {metrics.requests.get(model, 0)}')
+
+    return '\n'.join(lines) + '\n'
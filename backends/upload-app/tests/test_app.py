@@ -0,0 +1,14 @@
+import os
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+import app as app_module
+
+
+def test_export_test_plan_ignores_client_supplied_path():
+    client = app_module.app.test_client()
+
+    response = client.post('/export-test-plan', json={'excelTemplatePath': '/etc/passwd'})
+
+    assert response.status_code == 500
+    assert b'root:' not in response.data
@@ -0,0 +1,42 @@
+import json
+
+import sox_processor
+from control_manifest import ManifestStore
+
+
+def control(ref_id, description):
+    return {
+        'ref_id': ref_id,
+        'control_description': description,
+        'testing_attributes': f"A) {description} was evidenced",
+        'design_attributes': 'Performed monthly by the control owner.',
+        'evidence_of_control': 'Signed sign-off'
+    }
+
+
+def run(controls, manifest_key):
+    return list(sox_processor.iter_processed_controls_incremental(controls, manifest_key, max_workers=1, batch_size=1))
+
+
+def test_workbooks_sharing_a_filename_keep_separate_manifests(tmp_path, monkeypatch):
+    requests = []
+
+    def fake_request(system_prompt, user_prompt, **kwargs):
+        requests.append(user_prompt)
+        return json.dumps({'test_steps': [{'control_id': 'x', 'name': 'Inspect', 'description': 'Inspect evidence',
+                                           'attribute_name': 'A', 'attribute_description': 'Evidence exists'}]})
+
+    monkeypatch.setattr(sox_processor, 'make_openai_request', fake_request)
+    monkeypatch.setattr(sox_processor, 'get_manifest_store', lambda: ManifestStore(str(tmp_path / 'manifest.sqlite3')))
+    treasury = [control('C1', 'Bank reconciliations are reviewed'), control('C2', 'Wire transfers are approved')]
+    payroll = [control('C1', 'Payroll changes are approved'), control('C2', 'Terminated employees are removed')]
+
+    run(treasury, 'RCM.xlsx')
+    run(payroll, 'RCM.xlsx')
+    assert len(requests) == 4
+
+    # Re-uploading either workbook reuses its own results, with one edited row regenerated
+    treasury[1] = control('C2', 'Wire transfers over $10k are approved')
+    results = run(treasury, 'RCM.xlsx') + run(payroll, 'RCM.xlsx')
+    assert [processed.reused for _, processed in results] == [True, False, True, True]
+    assert len(requests) == 5
@@ -0,0 +1,35 @@
+import json
+
+from sox_processor import build_duplicate_control, build_processed_control, extract_test_steps
+
+
+def control(ref_id, entity):
+    return {
+        'ref_id': ref_id,
+        'control_description': f"The Treasury Analyst of {entity} reconciles bank accounts monthly.",
+        'testing_attributes': f"A) Bank reconciliations for {entity} were reviewed",
+        'design_attributes': 'The review covers all bank accounts.',
+        'evidence_of_control': f"Signed reconciliation for {entity}"
+    }
+
+
+def test_duplicate_control_replaces_representative_ref_id_in_step_text():
+    source = control('TRE-00002', 'Northwind US Inc.')
+    member = control('TRE-00003', 'Northwind GmbH')
+    content = json.dumps({'test_steps': [{
+        'control_id': 'TRE-00002',
+        'name': 'Inspect Reconciliation',
+        'description': 'Inspected the reconciliation performed under control TRE-00002 for Northwind US Inc.',
+        'attribute_name': 'Reconciliation Review',
+        'attribute_description': 'Verified that control TRE-00002 operated as designed.'
+    }]})
+
+    duplicate = build_duplicate_control(build_processed_control(source, content, False), source, member)
+    steps = extract_test_steps(duplicate)
+
+    assert steps
+    for step in steps:
+        assert step.control_id == 'TRE-00003'
+        assert not any('TRE-00002' in field for field in step)
+        assert 'TRE-00003' in step.description or 'TRE-00003' in step.attribute_description
+    assert 'Northwind GmbH' in steps[0].description
@@ -0,0 +1,22 @@
+import json
+
+import telemetry
+
+
+def test_metrics_are_summed_across_worker_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(telemetry, '_metrics', telemetry._ProcessMetrics())
+    other_worker = telemetry._ProcessMetrics()
+    other_worker.requests['gpt-4o'] = 2
+    other_worker.tokens[('gpt-4o', 'prompt')] = 300
+    other_worker.latency_buckets['gpt-4o'] = [1] * len(telemetry.LATENCY_BUCKETS)
+    other_worker.latency_sum['gpt-4o'] = 0.75
+    (tmp_path / '999999.json').write_text(json.dumps(other_worker.snapshot()))
+
+    telemetry.record_request('gpt-4o', {'prompt': 100, 'completion': 20}, 1.5)
+    metrics = telemetry.render_prometheus()
+
+    assert 'llm_requests_total{model="gpt-4o"} 3' in metrics
+    assert 'llm_tokens_total{model="gpt-4o",type="prompt"} 400' in metrics
+    assert 'llm_request_duration_seconds_bucket{model="gpt-4o",le="2"} 2' in metrics
+    assert 'llm_request_duration_seconds_sum{model="gpt-4o"} 2.25' in metrics
@@ -0,0 +1,42 @@
+import transcript_processor
+from transcript_retrieval import MAX_CONTEXT_CHARS
+
+
+def record_requests(monkeypatch):
+    requests = []
+
+    def fake_request(system_prompt, user_prompt, max_tokens=None, use_cache=True, shared_context=None):
+        requests.append((user_prompt, shared_context))
+        return "No additional topics identified."
+
+    monkeypatch.setattr(transcript_processor, 'make_openai_request', fake_request)
+    return requests
+
+
+def test_other_topics_sends_short_transcript_and_answers_whole(monkeypatch):
+    requests = record_requests(monkeypatch)
+
+    def no_index(*args, **kwargs):
+        raise AssertionError("a transcript that fits in context should not be indexed")
+
+    monkeypatch.setattr(transcript_processor, 'TranscriptIndex', no_index)
+
+    transcript = "Auditor: How are users provisioned?\nClient: Through a ServiceNow ticket approved by IT."
+    answers = "\n\n".join(f"Q{i}: Question {i}\nA: " + "covered detail " * 300 for i in range(1, 36))
+    transcript_processor.get_other_topics(transcript, answers)
+
+    user_prompt, shared_context = requests[0]
+    assert answers in user_prompt
+    assert transcript in shared_context
+
+
+def test_other_topics_stays_within_budget_for_long_transcript(monkeypatch):
+    requests = record_requests(monkeypatch)
+
+    transcript = "\n".join(f"Client: Step {i} of the payroll process is reviewed by the supervisor." for i in range(5000))
+    answers = "Q1: Payroll\nA: " + "reviewed " * 10000
+    transcript_processor.get_other_topics(transcript, answers)
+
+    user_prompt, shared_context = requests[0]
+    assert len(shared_context) < MAX_CONTEXT_CHARS + 200
+    assert len(user_prompt) < MAX_CONTEXT_CHARS + 100
@@ -1,15 +1,21 @@
 import os
-import openai
 from docx import Document # python-docx library
+import time
 import logging
 import tempfile
-import traceback
 import re # <--- Add import
 from dotenv import load_dotenv
 from typing import List, Tuple, Dict, Optional
 from dataclasses import dataclass
 from enum import Enum
 from datetime import datetime
+from response_cache import get_response_cache
+import telemetry
+from llm_client import (
+    call_with_retries, estimate_request_tokens, build_messages, record_usage, get_openai_client, LLMRequestError
+)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from transcript_retrieval import TranscriptIndex, MAX_CONTEXT_CHARS, needs_retrieval
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,23 +25,19 @@ logger.setLevel(logging.DEBUG) # Set to DEBUG for more verbose output during dev
 # Load environment variables
 load_dotenv()
 
-# Configure OpenAI for Azure (ensure these env vars are set correctly)
-openai.api_type = os.getenv("OPENAI_API_TYPE", "azure")
-openai.api_base = os.getenv("OPENAI_API_BASE")
-openai.api_version = os.getenv("OPENAI_API_VERSION", "2024-08-01-preview")
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Azure OpenAI deployment (the client itself is shared, see llm_client.get_openai_client)
 OPENAI_ENGINE = os.getenv("OPENAI_ENGINE", "gpt-4o") # Specify your deployment name/engine
 
-# Validate configuration
-if not openai.api_key:
-    logger.error("OpenAI API key not configured.")
-    raise ValueError("OpenAI API key not configured. Please set OPENAI_API_KEY environment variable.")
+# Map-reduce answering for Detailed Process questions on transcripts larger than the context budget
+TRANSCRIPT_MAP_REDUCE = os.getenv("TRANSCRIPT_MAP_REDUCE", "false").lower() in ("1", "true", "yes")
+TRANSCRIPT_MAP_WORKERS = int(os.getenv("TRANSCRIPT_MAP_WORKERS", "4"))
 
-logger.debug(f"Transcript_processor.py - API type: {openai.api_type}")
-logger.debug(f"Transcript_processor.py - API base: {openai.api_base}")
-logger.debug(f"Transcript_processor.py - API version: {openai.api_version}")
+# Agenda questions answered in parallel by generate_process_flow_doc
+TRANSCRIPT_QUESTION_WORKERS = int(os.getenv("TRANSCRIPT_QUESTION_WORKERS", "6"))
+
+logger.debug(f"Transcript_processor.py - API base: {os.getenv('OPENAI_API_BASE')}")
 logger.debug(f"Transcript_processor.py - Engine: {OPENAI_ENGINE}")
-logger.debug(f"Transcript_processor.py - API Key Loaded: {bool(openai.api_key)}")
+logger.debug(f"Transcript_processor.py - API Key Loaded: {bool(os.getenv('OPENAI_API_KEY'))}")
 
 # Response types enum for better type safety
 class ResponseType(Enum):
@@ -140,6 +142,15 @@ RULES:
 
 Extract maximum detail for each topic found."""
 
+TRANSCRIPT_NOTES_SYSTEM_PROMPT = """You are a SOX compliance specialist extracting facts from one excerpt of a longer walkthrough transcript.
+
+RULES:
+1. Extract ONLY facts from the excerpt that help answer the question
+2. Keep exact names of people, roles, systems, documents, thresholds and timings
+3. Preserve the order in which steps are described
+4. Use short bullet points, no commentary
+5. If the excerpt contains nothing relevant, output ONLY: NONE"""
+
 # --- End Define System Prompts ---
 
 # Centralized OpenAI API configuration
@@ -151,42 +162,74 @@ API_CONFIG = {
     "presence_penalty": 0
 }
 
-def make_openai_request(system_prompt: str, user_prompt: str, max_tokens: Optional[int] = None) -> str:
-    """Centralized OpenAI API request handler with error handling and logging.
+def make_openai_request(system_prompt: str, user_prompt: str, max_tokens: Optional[int] = None, use_cache: bool = True,
+                        shared_context: Optional[str] = None) -> str:
+    """Centralized OpenAI API request handler with caching, rate limiting, retries and logging.
     
     Args:
         system_prompt: The system prompt defining the AI's role
         user_prompt: The user's query/prompt
         max_tokens: Optional override for max tokens
+        use_cache: Set to False to bypass the persistent response cache
+        shared_context: Optional large context reused across requests (e.g. the transcript),
+            sent first so consecutive requests share a cacheable prompt prefix
         
     Returns:
-        The AI's response text or error message
+        The AI's response text
+        
+    Raises:
+        LLMRequestError: If the request fails permanently or exhausts its retries
     """
     config = API_CONFIG.copy()
     if max_tokens:
         config["max_tokens"] = max_tokens
+
+    messages = build_messages(system_prompt, user_prompt, shared_context)
+
+    cache = get_response_cache() if use_cache else None
+    if cache:
+        cached_response = cache.get(OPENAI_ENGINE, messages, config)
+        if cached_response is not None:
+            telemetry.record_response_cache_hit()
+            return cached_response
         
     try:
         logger.debug(f"Making OpenAI request with {len(user_prompt)} character prompt")
-        response = openai.ChatCompletion.create(
-            engine=OPENAI_ENGINE,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            **config
-        )
-        return response.choices[0].message['content'].strip()
-    except Exception as e:
+        started_at = time.monotonic()
+        with telemetry.span('llm_request', model=OPENAI_ENGINE):
+            response = call_with_retries(
+                lambda: get_openai_client().chat.completions.create(
+                    model=OPENAI_ENGINE,
+                    messages=messages,
+                    **config
+                ),
+                estimate_request_tokens(messages, config["max_tokens"])
+            )
+    except LLMRequestError as e:
+        telemetry.record_failure(OPENAI_ENGINE)
         logger.error(f"OpenAI API error: {str(e)}")
-        logger.error(traceback.format_exc())
-        return f"Error processing request: {str(e)}"
+        raise
+
+    record_usage(response, OPENAI_ENGINE, time.monotonic() - started_at)
+    content = (response.choices[0].message.content or '').strip()
+    if cache:
+        cache.set(OPENAI_ENGINE, messages, config, content)
+    return content
+
+def format_transcript_context(transcript: str) -> str:
+    """Wrap the transcript (or excerpt) in the leading message shared by every question about it."""
+    return f"""The following walkthrough transcript is the only source of information for this conversation.
 
-def format_process_prompt(transcript: str, question: str, response_type: ResponseType) -> Tuple[str, str]:
+Transcript:
+{transcript}"""
+
+def format_process_prompt(question: str, response_type: ResponseType) -> Tuple[str, str]:
     """Formats prompts based on response type for consistency.
     
+    The transcript is not part of these prompts; it is sent ahead of them as shared context
+    (see format_transcript_context) so every question reuses the same prompt prefix.
+    
     Args:
-        transcript: The meeting transcript
         question: The question to answer
         response_type: The type of response needed
         
@@ -196,24 +239,74 @@ def format_process_prompt(transcript: str, question: str, response_type: Respons
     prompt_templates = {
         ResponseType.NORMAL: {
             "system": NORMAL_RESPONSE_SYSTEM_PROMPT,
-            "user": f"""Transcript:\n{transcript}\n\nQuestion: {question}\n\nAnswer:"""
+            "user": f"""Question: {question}\n\nAnswer:"""
         },
         ResponseType.DETAILED_PROCESS: {
             "system": DETAILED_PROCESS_RESPONSE_SYSTEM_PROMPT,
-            "user": f"""Transcript:\n{transcript}\n\nQuestion: {question}\n\nDetailed Process Documentation:"""
+            "user": f"""Question: {question}\n\nDetailed Process Documentation:"""
         }
     }
     
     template = prompt_templates.get(response_type, prompt_templates[ResponseType.DETAILED_PROCESS])
     return template["system"], template["user"]
 
-def get_answer_from_transcript(transcript: str, question: str, question_type: str) -> str:
+def extract_notes(excerpt: str, question: str) -> str:
+    """Map step: pull the facts relevant to a question out of one transcript excerpt.
+    
+    Args:
+        excerpt: A transcript segment or previously extracted notes
+        question: The question being answered
+        
+    Returns:
+        Bullet-point notes, or an empty string if nothing in the excerpt is relevant
+    """
+    user_prompt = f"""Transcript Excerpt:\n{excerpt}\n\nQuestion: {question}\n\nRelevant Facts:"""
+    notes = make_openai_request(TRANSCRIPT_NOTES_SYSTEM_PROMPT, user_prompt, max_tokens=800)
+    return '' if notes.strip().upper() == 'NONE' else notes
+
+def collect_process_notes(transcript_index: TranscriptIndex, question: str) -> str:
+    """Map-reduce a question over every relevant transcript segment into notes that fit the context budget.
+    
+    Args:
+        transcript_index: Index of the transcript segments
+        question: The question being answered
+        
+    Returns:
+        Combined notes in transcript order, at most MAX_CONTEXT_CHARS long
+    """
+    chunk_ids = sorted(transcript_index.relevant_chunks(question)) or list(range(len(transcript_index.chunks)))
+    logger.info(f"Map-reduce over {len(chunk_ids)}/{len(transcript_index.chunks)} segments for: {question[:50]}...")
+
+    with ThreadPoolExecutor(max_workers=max(1, TRANSCRIPT_MAP_WORKERS)) as executor:
+        futures = [telemetry.submit_with_context(executor, extract_notes, transcript_index.chunks[i], question) for i in chunk_ids]
+        notes = [n for n in (future.result() for future in futures) if n]
+
+    # Condense groups of notes until everything fits in a single prompt
+    while len("\n\n".join(notes)) > MAX_CONTEXT_CHARS and len(notes) > 1:
+        groups: List[List[str]] = [[]]
+        for note in notes:
+            if groups[-1] and len("\n\n".join(groups[-1] + [note])) > MAX_CONTEXT_CHARS:
+                groups.append([])
+            groups[-1].append(note)
+        if len(groups) == len(notes):
+            # Every note fills the budget on its own; pair them up so the loop makes progress
+            groups = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+        notes = [n for n in (extract_notes("\n\n".join(group), question) for group in groups) if n]
+
+    return "\n\n".join(notes)[:MAX_CONTEXT_CHARS]
+
+def get_answer_from_transcript(transcript: str, question: str, question_type: str,
+                               transcript_index: Optional[TranscriptIndex] = None) -> str:
     """Optimized function to get answers from transcript using appropriate response type.
     
+    Long transcripts are narrowed to the segments relevant to the question (see
+    transcript_retrieval), so the prompt stays bounded regardless of transcript length.
+    
     Args:
         transcript: The full text of the meeting transcript
         question: The specific question to answer
         question_type: The type of question as string
+        transcript_index: Optional prebuilt index of the transcript, shared across questions
         
     Returns:
         The formatted answer string or error message
@@ -227,9 +320,22 @@ def get_answer_from_transcript(transcript: str, question: str, question_type: st
     
     response_type = response_type_map.get(question_type, ResponseType.DETAILED_PROCESS)
     logger.info(f"Processing {response_type.value} for question: {question[:50]}...")
-    
-    system_prompt, user_prompt = format_process_prompt(transcript, question, response_type)
-    return make_openai_request(system_prompt, user_prompt)
+
+    with telemetry.span('answer_question', question=question[:80]):
+        context = transcript
+        if needs_retrieval(transcript):
+            if transcript_index is None:
+                transcript_index = TranscriptIndex(transcript)
+            with telemetry.span('retrieve_context'):
+                if response_type == ResponseType.DETAILED_PROCESS and TRANSCRIPT_MAP_REDUCE:
+                    context = collect_process_notes(transcript_index, question)
+                else:
+                    context = transcript_index.build_context(question)
+            logger.debug(f"Narrowed transcript from {len(transcript)} to {len(context)} chars")
+        
+        system_prompt, user_prompt = format_process_prompt(question, response_type)
+        with telemetry.call_label(question[:80]):
+            return make_openai_request(system_prompt, user_prompt, shared_context=format_transcript_context(context))
 
 def clean_formatting(text: str) -> str:
     """Enhanced text cleaning to ensure consistent formatting.
@@ -257,19 +363,33 @@ def clean_formatting(text: str) -> str:
     
     return text
 
-def get_other_topics(transcript: str, provided_answers: str) -> str:
+def get_other_topics(transcript: str, provided_answers: str, transcript_index: Optional[TranscriptIndex] = None) -> str:
     """Optimized function to identify uncovered topics.
     
+    Transcripts that need retrieval are narrowed to the segments least covered by the
+    answers (see TranscriptIndex.build_uncovered_context), and the answers are clipped to
+    MAX_CONTEXT_CHARS. Transcripts that fit are sent whole with every answer, as before.
+    
     Args:
         transcript: Full transcript text
         provided_answers: Combined answers already provided
+        transcript_index: Optional prebuilt index of the transcript
         
     Returns:
         Formatted list of additional topics or standard message
     """
-    user_prompt = f"""Transcript:\n{transcript}\n\nAlready Covered:\n{provided_answers}\n\nAdditional Topics:"""
-    
-    response = make_openai_request(OTHER_TOPICS_SYSTEM_PROMPT, user_prompt, max_tokens=1000)
+    with telemetry.span('other_topics'):
+        context = transcript
+        if needs_retrieval(transcript):
+            if transcript_index is None:
+                transcript_index = TranscriptIndex(transcript)
+            context = transcript_index.build_uncovered_context(provided_answers)
+            provided_answers = provided_answers[:MAX_CONTEXT_CHARS]
+            logger.debug(f"Narrowed transcript from {len(transcript)} to {len(context)} chars for other topics")
+
+        user_prompt = f"""Already Covered:\n{provided_answers}\n\nAdditional Topics:"""
+        response = make_openai_request(OTHER_TOPICS_SYSTEM_PROMPT, user_prompt, max_tokens=1000,
+                                       shared_context=format_transcript_context(context))
     return clean_formatting(response)
 
 def generate_process_flow_doc(transcript_text: str, title: str, questions: List[Tuple[str, str]]) -> str:
@@ -288,7 +408,12 @@ def generate_process_flow_doc(transcript_text: str, title: str, questions: List[
     """
     if not questions:
         raise ValueError("Question list cannot be empty")
-        
+
+    with telemetry.track_run('transcript', title):
+        return _build_process_flow_doc(transcript_text, title, questions)
+
+def _build_process_flow_doc(transcript_text: str, title: str, questions: List[Tuple[str, str]]) -> str:
+    """Body of generate_process_flow_doc, run inside its telemetry run."""
     logger.info(f"Generating '{title}' with {len(questions)} questions")
     
     # Initialize document with professional styling
@@ -303,63 +428,98 @@ def generate_process_flow_doc(transcript_text: str, title: str, questions: List[
     document.add_paragraph(f"Total Questions: {len(questions)}")
     document.add_page_break()
     
-    # Track all answers for other topics analysis
-    all_answers = []
-    
-    # Process each question
-    for i, (question_text, question_type) in enumerate(questions, 1):
-        logger.info(f"Processing Q{i}/{len(questions)} ({question_type}): {question_text[:50]}...")
-        
-        # Add question heading
-        q_heading = document.add_heading(f"Question {i}", level=1)
-        
-        # Add question text with safe style handling
+    # Index a transcript too long to send whole once; each question retrieves its own segments from it
+    transcript_index = None
+    if needs_retrieval(transcript_text):
+        with telemetry.span('index_transcript'):
+            transcript_index = TranscriptIndex(transcript_text)
+
+    # Answers are independent of each other, so fetch them concurrently and lay them out in question order
+    with ThreadPoolExecutor(max_workers=max(1, TRANSCRIPT_QUESTION_WORKERS), thread_name_prefix="transcript-q") as executor:
+        future_to_index = {}
+        for i, (question_text, question_type) in enumerate(questions, 1):
+            logger.info(f"Queueing Q{i}/{len(questions)} ({question_type}): {question_text[:50]}...")
+            future = telemetry.submit_with_context(
+                executor, get_answer_from_transcript, transcript_text, question_text, question_type, transcript_index
+            )
+            future_to_index[future] = i
+
+        cleaned_answers: Dict[int, str] = {}
         try:
-            document.add_paragraph(question_text, style='Intense Quote')
-        except:
-            # Fallback if style doesn't exist
-            p = document.add_paragraph(question_text)
-            p.runs[0].italic = True
-        
-        # Get and clean the answer
-        answer = get_answer_from_transcript(transcript_text, question_text, question_type)
-        cleaned_answer = clean_formatting(answer)
-        
-        # Add answer with appropriate formatting
-        if question_type == "Normal Response":
-            document.add_heading("Response:", level=2)
-            document.add_paragraph(cleaned_answer)
-        else:
-            document.add_heading("Process Documentation:", level=2)
-            # Split answer into sections for better formatting
-            for line in cleaned_answer.split('\n'):
-                if line.strip():
-                    if line.startswith('Step ') or line.startswith('Control '):
-                        try:
-                            p = document.add_paragraph(line, style='List Number')
-                        except:
-                            p = document.add_paragraph(line)
-                            p.runs[0].bold = True
-                    elif line.startswith('•') or line.startswith('-'):
-                        try:
-                            p = document.add_paragraph(line, style='List Bullet')
-                        except:
-                            p = document.add_paragraph(line)
-                    else:
-                        document.add_paragraph(line)
-        
-        # Store answer for other topics analysis
-        all_answers.append(f"Q{i}: {question_text}\nA: {cleaned_answer}")
-        
-        # Add spacing between questions (but not after the last one)
-        if i < len(questions):
-            document.add_paragraph()  # Empty paragraph for spacing
-            document.add_paragraph()  # Another for more visual separation
-    
-    # Identify and add other topics
-    logger.info("Identifying additional topics not covered")
-    combined_answers = "\n\n".join(all_answers)
-    other_topics = get_other_topics(transcript_text, combined_answers)
+            for future in as_completed(future_to_index):
+                i = future_to_index[future]
+                cleaned_answers[i] = clean_formatting(future.result())
+                logger.info(f"Answered Q{i} ({len(cleaned_answers)}/{len(questions)})")
+        except Exception:
+            for pending in future_to_index:
+                pending.cancel()
+            raise
+
+        # Track all answers for other topics analysis
+        all_answers = [
+            f"Q{i}: {question_text}\nA: {cleaned_answers[i]}"
+            for i, (question_text, _) in enumerate(questions, 1)
+        ]
+        combined_answers = "\n\n".join(all_answers)
+
+        # With retrieval in use, clip each answer when all of them would not fit the context budget
+        if transcript_index is not None and len(combined_answers) > MAX_CONTEXT_CHARS:
+            answer_chars = max(200, MAX_CONTEXT_CHARS // len(questions))
+            combined_answers = "\n\n".join(
+                f"Q{i}: {question_text}\nA: {cleaned_answers[i][:answer_chars]}"
+                for i, (question_text, _) in enumerate(questions, 1)
+            )
+
+        # Start the other-topics request as soon as the last answer lands; the document is built meanwhile
+        logger.info("Identifying additional topics not covered")
+        other_topics_future = telemetry.submit_with_context(
+            executor, get_other_topics, transcript_text, combined_answers, transcript_index
+        )
+
+        for i, (question_text, question_type) in enumerate(questions, 1):
+            # Add question heading
+            q_heading = document.add_heading(f"Question {i}", level=1)
+            
+            # Add question text with safe style handling
+            try:
+                document.add_paragraph(question_text, style='Intense Quote')
+            except:
+                # Fallback if style doesn't exist
+                p = document.add_paragraph(question_text)
+                p.runs[0].italic = True
+            
+            cleaned_answer = cleaned_answers[i]
+            
+            # Add answer with appropriate formatting
+            if question_type == "Normal Response":
+                document.add_heading("Response:", level=2)
+                document.add_paragraph(cleaned_answer)
+            else:
+                document.add_heading("Process Documentation:", level=2)
+                # Split answer into sections for better formatting
+                for line in cleaned_answer.split('\n'):
+                    if line.strip():
+                        if line.startswith('Step ') or line.startswith('Control '):
+                            try:
+                                p = document.add_paragraph(line, style='List Number')
+                            except:
+                                p = document.add_paragraph(line)
+                                p.runs[0].bold = True
+                        elif line.startswith('•') or line.startswith('-'):
+                            try:
+                                p = document.add_paragraph(line, style='List Bullet')
+                            except:
+                                p = document.add_paragraph(line)
+                        else:
+                            document.add_paragraph(line)
+            
+            # Add spacing between questions (but not after the last one)
+            if i < len(questions):
+                document.add_paragraph()  # Empty paragraph for spacing
+                document.add_paragraph()  # Another for more visual separation
+
+        with telemetry.span('wait_other_topics'):
+            other_topics = other_topics_future.result()
     
     document.add_page_break()  # Keep this page break before Additional Topics section
     document.add_heading("Additional Topics Identified", level=1)
@@ -393,7 +553,8 @@ def generate_process_flow_doc(transcript_text: str, title: str, questions: List[
         with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as temp_file:
             output_path = temp_file.name
             
-        document.save(output_path)
+        with telemetry.span('save_document'):
+            document.save(output_path)
         logger.info(f"Document generated successfully: {output_path}")
         return output_path
         
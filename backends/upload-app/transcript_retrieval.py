@@ -0,0 +1,227 @@
+"""Chunking and BM25 retrieval over long walkthrough transcripts.
+
+Used by transcript_processor to keep per-question prompts bounded: instead of
+embedding the whole transcript, only the segments most relevant to the question
+are sent, in their original order.
+"""
+
+import os
+import re
+import math
+import logging
+from collections import Counter
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Retrieval configuration (override through environment variables)
+# TRANSCRIPT_RETRIEVAL_MODE: "auto" (retrieve only when the transcript exceeds the context budget),
+# "chunked" (always retrieve) or "full" (always send the whole transcript)
+RETRIEVAL_MODE = os.getenv("TRANSCRIPT_RETRIEVAL_MODE", "auto").lower()
+CHUNK_CHARS = int(os.getenv("TRANSCRIPT_CHUNK_CHARS", "4000"))
+CHUNK_OVERLAP_CHARS = int(os.getenv("TRANSCRIPT_CHUNK_OVERLAP_CHARS", "400"))
+MAX_CONTEXT_CHARS = int(os.getenv("TRANSCRIPT_MAX_CONTEXT_CHARS", "24000"))
+
+# Separator placed between non-adjacent segments so the model knows text was skipped
+SEGMENT_SEPARATOR = "\n[...]\n"
+
+# BM25 parameters (standard defaults)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'do', 'does', 'for', 'from', 'has', 'have',
+    'how', 'if', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'so', 'that', 'the', 'their', 'there',
+    'these', 'this', 'to', 'was', 'were', 'what', 'when', 'where', 'which', 'who', 'why', 'will',
+    'with', 'you', 'your', 'e', 'g', 'any', 'all', 'can', 'please', 'provide'
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _split_long_line(line: str, chunk_chars: int) -> List[str]:
+    """Split a line longer than chunk_chars at sentence boundaries, falling back to hard cuts."""
+    pieces = []
+    current = ''
+    for sentence in re.split(r'(?<=[.!?])\s+', line):
+        while len(sentence) > chunk_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(sentence[:chunk_chars])
+            sentence = sentence[chunk_chars:]
+        if current and len(current) + len(sentence) + 1 > chunk_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_transcript(transcript: str, chunk_chars: int = CHUNK_CHARS, overlap_chars: int = CHUNK_OVERLAP_CHARS) -> List[str]:
+    """Split a transcript into overlapping segments of at most roughly chunk_chars characters.
+
+    Segments break on line boundaries (speaker turns) where possible, and each segment
+    repeats the trailing lines of the previous one (up to overlap_chars) so an answer
+    spanning a boundary is still retrievable from a single segment.
+
+    Args:
+        transcript: The full transcript text
+        chunk_chars: Target maximum segment size in characters
+        overlap_chars: Characters of trailing context carried into the next segment
+
+    Returns:
+        List of transcript segments in original order
+    """
+    lines = []
+    for line in transcript.splitlines():
+        if not line.strip():
+            continue
+        lines.extend(_split_long_line(line, chunk_chars) if len(line) > chunk_chars else [line])
+
+    chunks = []
+    current: List[str] = []
+    current_size = 0
+    for line in lines:
+        if current and current_size + len(line) + 1 > chunk_chars:
+            chunks.append('\n'.join(current))
+
+            # Carry trailing lines forward as overlap
+            overlap: List[str] = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) + 1 > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 1
+            current, current_size = overlap, overlap_size
+
+        current.append(line)
+        current_size += len(line) + 1
+
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def needs_retrieval(transcript: str, max_chars: int = MAX_CONTEXT_CHARS) -> bool:
+    """Return True if the transcript should be narrowed before prompting under RETRIEVAL_MODE.
+
+    Checked before building a TranscriptIndex, so transcripts sent whole are never indexed.
+    """
+    if RETRIEVAL_MODE == 'full':
+        return False
+    if RETRIEVAL_MODE == 'chunked':
+        return True
+    return len(transcript) > max_chars
+
+
+class BM25Index:
+    """Okapi BM25 ranking over a fixed list of documents."""
+
+    def __init__(self, documents: List[str]):
+        self.doc_tokens = [Counter(tokenize(document)) for document in documents]
+        self.doc_lengths = [sum(tokens.values()) for tokens in self.doc_tokens]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0
+
+        document_frequency: Counter = Counter()
+        for tokens in self.doc_tokens:
+            document_frequency.update(tokens.keys())
+        total = len(documents)
+        self.idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """Return the BM25 score of every document for the query."""
+        query_terms = set(tokenize(query))
+        results = []
+        for tokens, length in zip(self.doc_tokens, self.doc_lengths):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length) if self.avg_length else BM25_K1
+            for term in query_terms:
+                frequency = tokens.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+            results.append(score)
+        return results
+
+    def search(self, query: str) -> List[Tuple[int, float]]:
+        """Return (document index, score) pairs, best first; ties keep document order."""
+        scored = list(enumerate(self.scores(query)))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored
+
+
+class TranscriptIndex:
+    """Segments of one transcript plus a BM25 index, built once and reused for every question."""
+
+    def __init__(self, transcript: str, chunk_chars: int = CHUNK_CHARS, overlap_chars: int = CHUNK_OVERLAP_CHARS):
+        self.transcript = transcript
+        self.chunks = chunk_transcript(transcript, chunk_chars, overlap_chars)
+        self.index = BM25Index(self.chunks)
+        logger.debug(f"Indexed transcript of {len(transcript)} chars into {len(self.chunks)} segments")
+
+    def relevant_chunks(self, question: str) -> List[int]:
+        """Return indices of segments sharing at least one term with the question, best first."""
+        return [i for i, score in self.index.search(question) if score > 0]
+
+    def build_context(self, question: str, max_chars: int = MAX_CONTEXT_CHARS) -> str:
+        """Select the best-scoring segments that fit in max_chars and join them in transcript order.
+
+        Args:
+            question: The question being answered
+            max_chars: Upper bound on the returned context size
+
+        Returns:
+            Transcript excerpt to embed in the prompt
+        """
+        return self._join_within(self.index.search(question), max_chars)
+
+    def build_uncovered_context(self, covered: str, max_chars: int = MAX_CONTEXT_CHARS) -> str:
+        """Select the segments least covered by text already written (e.g. the answers so far).
+
+        Segments are ranked by the share of their terms that do not appear in covered, so
+        parts of the walkthrough no question asked about are sent first.
+
+        Args:
+            covered: Text whose topics are already documented
+            max_chars: Upper bound on the returned context size
+
+        Returns:
+            Transcript excerpt to embed in the prompt
+        """
+        covered_terms = set(tokenize(covered))
+        ranked = []
+        for i, tokens in enumerate(self.index.doc_tokens):
+            total = sum(tokens.values())
+            uncovered = sum(count for term, count in tokens.items() if term not in covered_terms)
+            ranked.append((i, uncovered / total if total else 0.0))
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return self._join_within(ranked, max_chars)
+
+    def _join_within(self, ranked: List[Tuple[int, float]], max_chars: int) -> str:
+        """Take segments in ranked order while they fit in max_chars, then join them in transcript order."""
+        selected = []
+        used = 0
+        for i, _ in ranked:
+            size = len(self.chunks[i]) + len(SEGMENT_SEPARATOR)
+            if used + size > max_chars:
+                continue
+            selected.append(i)
+            used += size
+
+        selected.sort()
+        return SEGMENT_SEPARATOR.join(self.chunks[i] for i in selected)
+
+    def needs_retrieval(self, max_chars: int = MAX_CONTEXT_CHARS) -> bool:
+        """Return True if the transcript should be narrowed before prompting under RETRIEVAL_MODE."""
+        return needs_retrieval(self.transcript, max_chars)
@@ -0,0 +1,19 @@
+"""WSGI entry point for production serving, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+`import app` leaves pandas, openpyxl, python-docx and openai to load on first use (see
+benchmarks/check_import_time.py). Under gunicorn's preload_app this module is imported once
+in the master, so they are imported here instead and every forked worker starts with them
+already loaded rather than paying for them on its first upload. The OpenAI client itself is
+still created in each worker (see llm_client.get_openai_client).
+"""
+
+import pandas  # noqa: F401
+import openpyxl  # noqa: F401
+import docx  # noqa: F401
+import openai  # noqa: F401
+
+import sox_processor  # noqa: F401
+import transcript_processor  # noqa: F401
+from app import app, run_startup_checks
+
+run_startup_checks()
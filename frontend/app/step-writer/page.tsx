@@ -3,9 +3,27 @@
 import React, { useState } from 'react';
 import Link from 'next/link';
 
+const BACKEND_URL = 'http://localhost:3002';
+
+interface TestStep {
+  control_id?: string;
+  name: string;
+  description: string;
+  attribute_name: string;
+  attribute_description: string;
+}
+
+interface ControlResult {
+  index: number;
+  controlId: string;
+  testSteps: TestStep[];
+}
+
 export default function StepWriter() {
   const [uploadedFile, setUploadedFile] = useState<File | null>(null);
   const [isProcessing, setIsProcessing] = useState(false);
+  const [progress, setProgress] = useState<{ completed: number; total: number } | null>(null);
+  const [controlResults, setControlResults] = useState<ControlResult[]>([]);
 
   const handleFileUpload = (event: React.ChangeEvent<HTMLInputElement>) => {
     const file = event.target.files?.[0];
@@ -18,6 +36,23 @@ export default function StepWriter() {
     setUploadedFile(null);
   };
 
+  const downloadTemplate = async (downloadUrl: string) => {
+    const response = await fetch(`${BACKEND_URL}${downloadUrl}`);
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const blob = await response.blob();
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = 'SOX_Test_Steps_Template.xlsx';
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+    URL.revokeObjectURL(url);
+  };
+
   const generateTestSteps = async () => {
     if (!uploadedFile) {
       alert('Please upload an Excel file first');
@@ -25,30 +60,65 @@ export default function StepWriter() {
     }
 
     setIsProcessing(true);
+    setProgress(null);
+    setControlResults([]);
 
     try {
       const formData = new FormData();
       formData.append('files', uploadedFile);
 
-      const response = await fetch('http://localhost:3002/generate-test-steps', {
+      // Each control's test steps arrive as a Server-Sent Event as soon as they are generated
+      const response = await fetch(`${BACKEND_URL}/generate-test-steps/stream`, {
         method: 'POST',
         body: formData,
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      // The response should be the Excel file for download
-      const blob = await response.blob();
-      const url = URL.createObjectURL(blob);
-      const a = document.createElement('a');
-      a.href = url;
-      a.download = 'SOX_Test_Steps_Template.xlsx';
-      document.body.appendChild(a);
-      a.click();
-      document.body.removeChild(a);
-      URL.revokeObjectURL(url);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let downloadUrl: string | null = null;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop() ?? '';
+
+        for (const message of messages) {
+          const eventLine = message.split('\n').find((line) => line.startsWith('event: '));
+          const dataLine = message.split('\n').find((line) => line.startsWith('data: '));
+          if (!eventLine || !dataLine) continue;
+
+          const eventType = eventLine.slice('event: '.length);
+          const data = JSON.parse(dataLine.slice('data: '.length));
+
+          if (eventType === 'start') {
+            setProgress({ completed: 0, total: data.total });
+          } else if (eventType === 'control') {
+            setProgress({ completed: data.completed, total: data.total });
+            setControlResults((previous) => [
+              ...previous,
+              { index: data.index, controlId: data.controlId, testSteps: data.testSteps },
+            ]);
+          } else if (eventType === 'complete') {
+            downloadUrl = data.downloadUrl;
+          } else if (eventType === 'error') {
+            throw new Error(data.error);
+          }
+        }
+      }
+
+      if (!downloadUrl) {
+        throw new Error('Stream ended before the template was created');
+      }
+
+      await downloadTemplate(downloadUrl);
 
       // Clear the uploaded file after successful processing
       setUploadedFile(null);
@@ -155,7 +225,11 @@ export default function StepWriter() {
                       <circle className="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" strokeWidth="4"></circle>
                       <path className="opacity-75" fill="currentColor" d="m4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"></path>
                     </svg>
-                    <span>Processing Controls...</span>
+                    <span>
+                      {progress
+                        ? `Processing Controls... (${progress.completed}/${progress.total})`
+                        : 'Processing Controls...'}
+                    </span>
                   </>
                 ) : (
                   <>
@@ -168,6 +242,36 @@ export default function StepWriter() {
           )}
         </div>
 
+        {/* Streamed Results */}
+        {controlResults.length > 0 && (
+          <div className="bg-white rounded-lg shadow-sm p-6 mb-8">
+            <h2 className="text-2xl font-semibold text-gray-900 mb-4">
+              Generated Test Steps
+              {progress && (
+                <span className="text-sm font-normal text-gray-500 ml-2">
+                  {progress.completed} of {progress.total} controls
+                </span>
+              )}
+            </h2>
+            <div className="space-y-4 max-h-96 overflow-y-auto">
+              {[...controlResults]
+                .sort((a, b) => a.index - b.index)
+                .map((result) => (
+                  <div key={result.index} className="border border-gray-200 rounded p-3">
+                    <h3 className="font-semibold text-gray-900 mb-2">{result.controlId}</h3>
+                    <ol className="list-decimal list-inside text-sm text-gray-700 space-y-1">
+                      {result.testSteps.map((step, stepIndex) => (
+                        <li key={stepIndex}>
+                          <span className="font-medium">{step.name}</span>: {step.description}
+                        </li>
+                      ))}
+                    </ol>
+                  </div>
+                ))}
+            </div>
+          </div>
+        )}
+
         {/* Process Overview */}
         <div className="bg-white rounded-lg shadow-sm p-6">
           <h2 className="text-2xl font-semibold text-gray-900 mb-4">How It Works</h2>